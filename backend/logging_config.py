@@ -0,0 +1,212 @@
+"""
+Structured, non-blocking logging for the API.
+
+Every log record (and every line written with print()) is put on an
+in-memory queue and written to stdout as one JSON line by a background
+QueueListener thread, so request handlers never block on stdout.
+The request middleware emits one line per request with its timing;
+per-route sampling and levels keep noisy endpoints quiet.
+
+Environment:
+    LOG_LEVEL                root level (default INFO)
+    LOG_FORMAT               json | text (default json)
+    LOG_QUEUE_SIZE           max queued records before new ones are dropped (default 10000)
+    LOG_CAPTURE_PRINTS       route print() output through the queue (default true)
+    LOG_PRINT_LEVEL          level given to captured print() lines (default INFO)
+    LOG_REQUEST_SAMPLE_RATE  fraction of successful requests logged (default 1.0)
+    LOG_ROUTE_SAMPLE_RATES   per-path-prefix overrides, e.g. "/api/health=0,/api/google-sheets/status=0.1"
+    LOG_ROUTE_LEVELS         per-path-prefix request log level, e.g. "/api/nowpayments/webhook=WARNING"
+    LOG_HTTPX_LEVEL          level for httpx's own per-request lines (default WARNING)
+"""
+
+import os
+import sys
+import json
+import atexit
+import queue
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+LOG_CAPTURE_PRINTS = os.environ.get("LOG_CAPTURE_PRINTS", "true").lower() in ("1", "true", "yes")
+LOG_PRINT_LEVEL = os.environ.get("LOG_PRINT_LEVEL", "INFO").upper()
+LOG_REQUEST_SAMPLE_RATE = float(os.environ.get("LOG_REQUEST_SAMPLE_RATE", 1.0))
+LOG_HTTPX_LEVEL = os.environ.get("LOG_HTTPX_LEVEL", "WARNING").upper()
+
+request_logger = logging.getLogger("api.request")
+print_logger = logging.getLogger("stdout")
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[logging.Handler] = None
+_output_handler: Optional[logging.Handler] = None
+_original_stdout = sys.stdout
+
+def _parse_route_map(raw: str) -> Dict[str, str]:
+    """'prefix=value,prefix2=value2' -> {prefix: value}"""
+    routes = {}
+    for item in (raw or "").split(","):
+        if "=" in item:
+            prefix, value = item.split("=", 1)
+            routes[prefix.strip()] = value.strip()
+    return routes
+
+LOG_ROUTE_SAMPLE_RATES = {prefix: float(rate) for prefix, rate in
+                          _parse_route_map(os.environ.get("LOG_ROUTE_SAMPLE_RATES", "")).items()}
+LOG_ROUTE_LEVELS = {prefix: logging.getLevelName(level.upper()) for prefix, level in
+                    _parse_route_map(os.environ.get("LOG_ROUTE_LEVELS", "")).items()}
+
+def _route_setting(settings: Dict[str, object], path: str, default):
+    """Value for the longest configured prefix of path"""
+    best = None
+    for prefix in settings:
+        if path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return settings[best] if best is not None else default
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra={'fields': {...}} is merged in"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Keep `fields` and the raw exc_info for the formatter on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class PrintCapture:
+    """sys.stdout replacement that turns print() lines into log records"""
+
+    def __init__(self, logger: logging.Logger, level: int):
+        self.logger = logger
+        self.level = level
+        self._local = threading.local()
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self._local, "buffer", "") + text
+        *lines, remainder = buffer.split("\n")
+        self._local.buffer = remainder
+        for line in lines:
+            if line.strip():
+                self.logger.log(self.level, line.rstrip())
+        return len(text)
+
+    def flush(self):
+        remainder = getattr(self._local, "buffer", "")
+        if remainder.strip():
+            self._local.buffer = ""
+            self.logger.log(self.level, remainder.rstrip())
+
+    def isatty(self) -> bool:
+        return False
+
+def setup_logging():
+    """Install the queue-backed handler on the root logger (idempotent).
+
+    stop_logging() also runs at interpreter exit, so scripts and workers
+    that never reach the FastAPI shutdown hook still flush their output.
+    """
+    global _listener, _queue_handler, _output_handler
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(_original_stdout)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _output_handler = output
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+    # httpx logs every outgoing Supabase/NowPayments call at INFO
+    logging.getLogger("httpx").setLevel(LOG_HTTPX_LEVEL)
+
+    # The output handler writes to the real stdout, so captured prints cannot loop
+    if LOG_CAPTURE_PRINTS:
+        sys.stdout = PrintCapture(print_logger, logging.getLevelName(LOG_PRINT_LEVEL))
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and restore stdout (on shutdown and at exit; idempotent)
+
+    Anything logged afterwards is written synchronously instead of being
+    queued for a listener that no longer runs.
+    """
+    global _listener, _queue_handler
+    if isinstance(sys.stdout, PrintCapture):
+        sys.stdout.flush()
+        sys.stdout = _original_stdout
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None:
+        root = logging.getLogger()
+        root.removeHandler(_queue_handler)
+        root.addHandler(_output_handler)
+        _queue_handler = None
+
+def log_request(method: str, path: str, status_code: int, duration: float,
+                query: str = "", client: Optional[str] = None, user_agent: Optional[str] = None):
+    """Emit the per-request line, subject to per-route level and sampling"""
+    if status_code >= 500:
+        level = logging.ERROR
+    elif status_code >= 400:
+        level = logging.WARNING
+    else:
+        # Only successful requests are sampled; errors are always kept
+        sample_rate = _route_setting(LOG_ROUTE_SAMPLE_RATES, path, LOG_REQUEST_SAMPLE_RATE)
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            return
+        level = _route_setting(LOG_ROUTE_LEVELS, path, logging.INFO)
+    if not request_logger.isEnabledFor(level):
+        return
+
+    request_logger.log(level, f"{method} {path} {status_code}", extra={"fields": {
+        "method": method,
+        "path": path,
+        "query": query or None,
+        "status": status_code,
+        "duration_ms": round(duration * 1000, 2),
+        "client": client,
+        "user_agent": user_agent
+    }})
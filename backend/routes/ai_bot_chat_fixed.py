@@ -7,6 +7,7 @@ import json
 from datetime import datetime
 from dotenv import load_dotenv
 from supabase_client import supabase_admin
+from services.balance_cache import get_cached_balance, set_cached_balance
 
 # Load environment variables
 load_dotenv()
@@ -665,6 +666,70 @@ Your bot name?""", False, {}
 # Initialize conversation tracker
 conversation_tracker = ConversationTracker()
 
+AI_MESSAGE_COST = 0.10  # $0.10 per AI message
+
+def insufficient_balance_response(current_balance: float, ai_cost: float = AI_MESSAGE_COST) -> Dict[str, Any]:
+    return {
+        "success": False,
+        "error": "insufficient_balance", 
+        "message": f"Insufficient balance for AI usage. Current balance: ${current_balance:.2f}, Required: ${ai_cost:.2f}",
+        "current_balance": current_balance,
+        "required_cost": ai_cost
+    }
+
+async def check_ai_balance(user_id: str) -> Optional[Dict[str, Any]]:
+    """Refuse up front when the balance cannot cover a turn, before any LLM call.
+    
+    Only a pre-check from the balance cache; charge_and_record_turn() is the
+    authoritative debit.
+    """
+    try:
+        account = await get_cached_balance(user_id)
+    except Exception as e:
+        print(f"⚠️ Balance check error: {e}")
+        # Continue anyway; the debit still refuses an insufficient balance
+        return None
+    
+    if account and account['balance'] < AI_MESSAGE_COST:
+        return insufficient_balance_response(account['balance'])
+    return None
+
+async def charge_and_record_turn(user_id: str, session_id: str, user_message: Optional[str],
+                                 assistant_message: Optional[str], ai_model: str,
+                                 bot_creation_stage: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Debit one AI turn and save both messages in one RPC.
+    
+    Returns an insufficient-balance response if the debit was refused, None
+    once the turn is paid for. Raises if the turn could not be charged, so
+    an unpaid response is never returned.
+    """
+    if not supabase_admin:
+        return None
+    
+    result = await supabase_admin.rpc('charge_and_record_chat_turn', {
+        'p_user_id': user_id,
+        'p_session_id': session_id,
+        'p_cost': AI_MESSAGE_COST,
+        'p_user_message': user_message,
+        'p_assistant_message': assistant_message,
+        'p_ai_model': ai_model,
+        'p_bot_creation_stage': bot_creation_stage
+    }).execute_async()
+    
+    if result.error:
+        print(f"❌ Billing/record error: {result.error}")
+        raise RuntimeError("Failed to charge AI message")
+    
+    turn = result.data[0] if isinstance(result.data, list) and result.data else result.data
+    if not isinstance(turn, dict):
+        print(f"❌ Unexpected billing result: {result.data}")
+        raise RuntimeError("Failed to charge AI message")
+    if not turn.get('success'):
+        set_cached_balance(user_id, turn.get('current_balance') or 0)
+        return insufficient_balance_response(float(turn.get('current_balance') or 0))
+    set_cached_balance(user_id, turn.get('new_balance'))
+    return None
+
 # Simplified AI response function
 async def get_contextual_ai_response(message: str, ai_model: str, conversation_history: List[Dict], session_id: str) -> str:
     """Generate contextual AI response that follows conversation flow."""
@@ -716,26 +781,10 @@ async def get_contextual_ai_response(message: str, ai_model: str, conversation_h
 async def start_chat_session(request: ChatSessionRequest):
     """Start AI bot chat session."""
     try:
-        # Check user balance first - simplified without RPC for now
-        ai_cost = 0.10  # $0.10 per AI message
-        
-        try:
-            # Use direct query instead of RPC call to avoid issues
-            balance_result = supabase_admin.table('user_accounts').select('balance').eq('user_id', request.user_id).execute()
-            
-            if balance_result.data and len(balance_result.data) > 0:
-                current_balance = float(balance_result.data[0].get('balance', 0))
-                if current_balance < ai_cost:
-                    return {
-                        "success": False,
-                        "error": "insufficient_balance", 
-                        "message": f"Insufficient balance for AI usage. Current balance: ${current_balance:.2f}, Required: ${ai_cost:.2f}",
-                        "current_balance": current_balance,
-                        "required_cost": ai_cost
-                    }
-        except Exception as e:
-            print(f"⚠️ Balance check error: {e}")
-            # Continue anyway for graceful degradation
+        # Check user balance first, so an unfunded user never triggers an LLM call
+        insufficient = await check_ai_balance(request.user_id)
+        if insufficient:
+            return insufficient
         
         session_id = request.session_id or str(uuid.uuid4())
         
@@ -746,47 +795,17 @@ async def start_chat_session(request: ChatSessionRequest):
             session_id
         )
         
-        # Deduct cost from user balance after successful AI response - FIXED SQL syntax
-        try:
-            # Get current balance first
-            current_balance_result = supabase_admin.table('user_accounts').select('balance').eq('user_id', request.user_id).execute()
-            
-            if current_balance_result.data and len(current_balance_result.data) > 0:
-                current_balance = float(current_balance_result.data[0].get('balance', 0))
-                new_balance = current_balance - ai_cost
-                
-                # Update with calculated new balance
-                supabase_admin.table('user_accounts').update({
-                    'balance': new_balance,
-                    'updated_at': 'NOW()'
-                }).eq('user_id', request.user_id).execute()
-        except Exception as e:
-            print(f"⚠️ Billing deduction error: {e}")
-        
-        # Save messages to database
-        if supabase_admin and request.initial_prompt:
-            try:
-                # Save user message
-                supabase_admin.rpc('save_chat_message', {
-                    'p_user_id': request.user_id,
-                    'p_session_id': session_id,
-                    'p_message_type': 'user', 
-                    'p_message_content': request.initial_prompt,
-                    'p_ai_model': request.ai_model,
-                    'p_bot_creation_stage': 'initial'
-                }).execute()
-                
-                # Save AI response
-                supabase_admin.rpc('save_chat_message', {
-                    'p_user_id': request.user_id,
-                    'p_session_id': session_id,
-                    'p_message_type': 'assistant',
-                    'p_message_content': response,
-                    'p_ai_model': request.ai_model,
-                    'p_bot_creation_stage': 'initial'
-                }).execute()
-            except Exception as e:
-                print(f"Database save error: {e}")
+        # Charge the turn and save both messages atomically (one round trip)
+        insufficient = await charge_and_record_turn(
+            request.user_id,
+            session_id,
+            request.initial_prompt,
+            response if request.initial_prompt else None,
+            request.ai_model,
+            'initial'
+        )
+        if insufficient:
+            return insufficient
         
         return {
             "success": True,
@@ -805,35 +824,19 @@ async def start_chat_session(request: ChatSessionRequest):
 async def send_chat_message(request: ChatMessageRequest):
     """Send message in chat session."""
     try:
-        # Check user balance first - simplified without RPC for now
-        ai_cost = 0.10  # $0.10 per AI message
-        
-        try:
-            # Use direct query instead of RPC call to avoid issues
-            balance_result = supabase_admin.table('user_accounts').select('balance').eq('user_id', request.user_id).execute()
-            
-            if balance_result.data and len(balance_result.data) > 0:
-                current_balance = float(balance_result.data[0].get('balance', 0))
-                if current_balance < ai_cost:
-                    return {
-                        "success": False,
-                        "error": "insufficient_balance", 
-                        "message": f"Insufficient balance for AI usage. Current balance: ${current_balance:.2f}, Required: ${ai_cost:.2f}",
-                        "current_balance": current_balance,
-                        "required_cost": ai_cost
-                    }
-        except Exception as e:
-            print(f"⚠️ Balance check error: {e}")
-            # Continue anyway for graceful degradation
+        # Check user balance first, so an unfunded user never triggers an LLM call
+        insufficient = await check_ai_balance(request.user_id)
+        if insufficient:
+            return insufficient
         
         # Get conversation history
         conversation_history = []
         if supabase_admin:
             try:
-                history_response = supabase_admin.rpc('get_chat_history', {
+                history_response = await supabase_admin.rpc('get_chat_history', {
                     'p_user_id': request.user_id,
                     'p_session_id': request.session_id
-                }).execute()
+                }).execute_async()
                 conversation_history = history_response.data or []
             except Exception as e:
                 print(f"History retrieval error: {e}")
@@ -846,47 +849,17 @@ async def send_chat_message(request: ChatMessageRequest):
             request.session_id
         )
         
-        # Deduct cost from user balance after successful AI response - FIXED SQL syntax
-        try:
-            # Get current balance first
-            current_balance_result = supabase_admin.table('user_accounts').select('balance').eq('user_id', request.user_id).execute()
-            
-            if current_balance_result.data and len(current_balance_result.data) > 0:
-                current_balance = float(current_balance_result.data[0].get('balance', 0))
-                new_balance = current_balance - ai_cost
-                
-                # Update with calculated new balance
-                supabase_admin.table('user_accounts').update({
-                    'balance': new_balance,
-                    'updated_at': 'NOW()'
-                }).eq('user_id', request.user_id).execute()
-        except Exception as e:
-            print(f"⚠️ Billing deduction error: {e}")
-        
-        # Save messages to database
-        if supabase_admin:
-            try:
-                # Save user message
-                supabase_admin.rpc('save_chat_message', {
-                    'p_user_id': request.user_id,
-                    'p_session_id': request.session_id,
-                    'p_message_type': 'user',
-                    'p_message_content': request.message_content,
-                    'p_ai_model': request.ai_model,
-                    'p_bot_creation_stage': request.bot_creation_stage
-                }).execute()
-                
-                # Save AI response
-                supabase_admin.rpc('save_chat_message', {
-                    'p_user_id': request.user_id,
-                    'p_session_id': request.session_id,
-                    'p_message_type': 'assistant',
-                    'p_message_content': response,
-                    'p_ai_model': request.ai_model,
-                    'p_bot_creation_stage': request.bot_creation_stage
-                }).execute()
-            except Exception as e:
-                print(f"Database save error: {e}")
+        # Charge the turn and save both messages atomically (one round trip)
+        insufficient = await charge_and_record_turn(
+            request.user_id,
+            request.session_id,
+            request.message_content,
+            response,
+            request.ai_model,
+            request.bot_creation_stage
+        )
+        if insufficient:
+            return insufficient
         
         # Check if bot is ready
         is_ready = "ready_to_create" in response
@@ -925,10 +898,10 @@ async def create_ai_bot(request: AiBotCreationRequest):
         bot_config = request.bot_config.get('bot_config', {})
         
         # Get original prompt from history
-        chat_response = supabase_admin.rpc('get_chat_history', {
+        chat_response = await supabase_admin.rpc('get_chat_history', {
             'p_user_id': request.user_id,
             'p_session_id': request.session_id
-        }).execute()
+        }).execute_async()
         
         generation_prompt = ""
         if chat_response.data:
@@ -937,7 +910,7 @@ async def create_ai_bot(request: AiBotCreationRequest):
                 generation_prompt = user_messages[0].get('message_content', '')
         
         # Save to AI bots table
-        bot_response = supabase_admin.rpc('save_ai_bot', {
+        bot_response = await supabase_admin.rpc('save_ai_bot', {
             'p_user_id': request.user_id,
             'p_name': bot_config.get('name', 'AI Bot'),
             'p_description': bot_config.get('description', 'AI trading bot'),
@@ -949,7 +922,7 @@ async def create_ai_bot(request: AiBotCreationRequest):
             'p_base_coin': bot_config.get('base_coin'),
             'p_quote_coin': bot_config.get('quote_coin'),
             'p_exchange': 'binance'
-        }).execute()
+        }).execute_async()
         
         if not bot_response.data:
             raise HTTPException(status_code=500, detail="Failed to save bot")
@@ -972,10 +945,10 @@ async def get_chat_history(session_id: str, user_id: str):
         if not supabase_admin:
             return {"success": False, "messages": []}
         
-        response = supabase_admin.rpc('get_chat_history', {
+        response = await supabase_admin.rpc('get_chat_history', {
             'p_user_id': user_id,
             'p_session_id': session_id
-        }).execute()
+        }).execute_async()
         
         return {
             "success": True,
@@ -994,9 +967,9 @@ async def get_user_ai_bots(user_id: str):
         if not supabase_admin:
             return {"success": True, "bots": [], "total": 0}
         
-        response = supabase_admin.rpc('get_user_ai_bots', {
+        response = await supabase_admin.rpc('get_user_ai_bots', {
             'user_uuid': user_id
-        }).execute()
+        }).execute_async()
         
         bots = response.data or []
         
@@ -1014,11 +987,11 @@ async def get_user_ai_bots(user_id: str):
 async def get_user_ai_balance(user_id: str):
     """Get user balance for AI usage."""
     try:
-        # Use direct query since RPC might not exist yet
-        balance_result = supabase_admin.table('user_accounts').select('balance').eq('user_id', user_id).execute()
+        # Served from the write-through balance cache
+        account = await get_cached_balance(user_id)
         
-        if balance_result.data and len(balance_result.data) > 0:
-            balance = float(balance_result.data[0].get('balance', 0))
+        if account:
+            balance = account['balance']
             return {
                 "success": True,
                 "balance_usd": balance,
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from services.grok_service import GrokBotCreator
-from supabase_client import supabase
+from services.subscription_cache import SUPER_ADMIN_USER_ID, get_cached_subscription, get_plan_limits
+from supabase_client import supabase, supabase_admin
 from typing import Optional, Dict, Any
 import uuid
 from datetime import datetime
@@ -84,7 +85,7 @@ async def create_trading_bot(bot_data: Dict[str, Any]):
         user_id = bot_data.get('user_id')
         if user_id:
             # Special case: Super Admin UUID bypasses all limits
-            if user_id == "cd0e9717-f85d-4726-81e9-f260394ead58":
+            if user_id == SUPER_ADMIN_USER_ID:
                 print(f"Super Admin detected - bypassing subscription limits for user {user_id}")
             else:
                 # Determine bot type - AI bots vs manual bots
@@ -96,104 +97,50 @@ async def create_trading_bot(bot_data: Dict[str, Any]):
                 try:
                     if supabase:
                         print(f"Checking existing bots for user {user_id}, resource_type: {resource_type}")
-                        existing_response = supabase.table('user_bots')\
-                            .select('strategy,description,name')\
-                            .eq('user_id', user_id)\
-                            .execute()
-                        
-                        print(f"Existing bots query status: {existing_response.status_code}")
-                        print(f"Existing bots data: {existing_response.data}")
+                        # Use actual database columns: strategy field
+                        # AI bots: mean_reversion, momentum, scalping, swing (from AI Creator)
+                        # Manual bots: simple, advanced, manual (from Advanced Settings)
+                        if resource_type == 'ai_bots':
+                            counted_strategies = ['mean_reversion', 'momentum', 'scalping', 'swing']
+                        else:  # manual_bots
+                            counted_strategies = ['simple', 'advanced', 'manual']
                         
-                        if existing_response.data:
-                            current_count = 0
-                            for bot in existing_response.data:
-                                # Use actual database columns: strategy field
-                                bot_strategy = (bot.get('strategy') or '').lower()
-                                
-                                # AI bots: mean_reversion, momentum, scalping, swing (from AI Creator)
-                                # Manual bots: simple, advanced, manual (from Advanced Settings)
-                                if resource_type == 'ai_bots':
-                                    if bot_strategy in ['mean_reversion', 'momentum', 'scalping', 'swing']:
-                                        current_count += 1
-                                else:  # manual_bots
-                                    if bot_strategy in ['simple', 'advanced', 'manual']:
-                                        current_count += 1
-                        else:
-                            current_count = 0
+                        # Count server-side (HEAD + Content-Range) instead of downloading the bots.
+                        # ilike without wildcards matches the strategy case-insensitively, as the
+                        # old lowercase comparison did
+                        count_response = await supabase.table('user_bots')\
+                            .select('id')\
+                            .eq('user_id', user_id)\
+                            .or_(','.join(f'strategy.ilike.{strategy}' for strategy in counted_strategies))\
+                            .count()\
+                            .execute_async()
+                        current_count = count_response.count or 0
                         
                         print(f"Current {resource_type} count for user {user_id}: {current_count}")
                         
-                        # Call subscription limit checking
-                        # Import here to avoid circular imports
-                        import sys
-                        import os
-                        sys.path.append(os.path.dirname(__file__))
-                        
-                        # Use the supabase admin directly for subscription checking
-                        from supabase_client import supabase_admin
-                        
+                        # Subscription limits come from the in-process cache, so this
+                        # check usually needs no extra network hop. Limits are the plan's
+                        # (or the row's own), the same as the subscription limit endpoints
+                        # report: plus and pro users get their plan limits, not free ones
                         if supabase_admin:
                             print(f"Checking subscription for user {user_id}")
-                            # Check user's subscription
-                            sub_response = supabase_admin.table('subscriptions')\
-                                .select('*')\
-                                .eq('user_id', user_id)\
-                                .execute()
+                            subscription = await get_cached_subscription(user_id)
+                            plan_type = subscription.get('plan_type', 'free') if subscription else 'free'
+                            limits = get_plan_limits(subscription)
                             
-                            print(f"Subscription query status: {sub_response.status_code}")
-                            print(f"Subscription data: {sub_response.data}")
-                            
-                            # Default to free plan limits
-                            limits = {
-                                "ai_bots": 1,
-                                "manual_bots": 2,
-                                "marketplace_products": 1
-                            }
-                            
-                            if sub_response.data and len(sub_response.data) > 0:
-                                subscription = sub_response.data[0]
-                                plan_type = subscription.get('plan_type', 'free')
-                                print(f"User has subscription with plan_type: {plan_type}")
-                                
-                                if plan_type == 'super_admin':
-                                    # Super admin has no limits - skip limit checking
-                                    print("Super admin plan detected - skipping limits")
-                                    pass  # Continue with bot creation
-                                elif plan_type == 'premium':
-                                    # Premium plan limits
-                                    limits = {
-                                        "ai_bots": 10,
-                                        "manual_bots": 20,
-                                        "marketplace_products": 10
-                                    }
-                                    print(f"Premium plan limits applied: {limits}")
-                                # else: use free plan limits (already set above)
+                            if limits is None:
+                                # Super admin has no limits - skip limit checking
+                                print("Super admin plan detected - skipping limits")
                             else:
-                                print("No subscription found - using free plan limits")
-                            
-                            # Check if user has reached the limit (skip for super admin)
-                            if sub_response.data and len(sub_response.data) > 0:
-                                subscription = sub_response.data[0]
-                                if subscription.get('plan_type') != 'super_admin':
-                                    limit = limits.get(resource_type, 1)
-                                    print(f"Checking limit: current_count={current_count}, limit={limit}")
-                                    
-                                    if current_count >= limit:
-                                        error_msg = f"Subscription limit reached. {subscription.get('plan_type', 'Free').title()} plan allows {limit} {resource_type.replace('_', ' ')}. Current: {current_count}"
-                                        print(f"LIMIT EXCEEDED: {error_msg}")
-                                        raise HTTPException(status_code=403, detail=error_msg)
-                                    else:
-                                        print(f"Limit check passed: {current_count} < {limit}")
-                            else:
-                                # No subscription found - apply free limits
                                 limit = limits.get(resource_type, 1)
-                                print(f"No subscription - checking free limit: current_count={current_count}, limit={limit}")
-                                if current_count >= limit:
-                                    error_msg = f"Subscription limit reached. Free plan allows {limit} {resource_type.replace('_', ' ')}. Current: {current_count}"
-                                    print(f"FREE LIMIT EXCEEDED: {error_msg}")
+                                print(f"Checking {plan_type} limit: current_count={current_count}, limit={limit}")
+                                
+                                if limit != -1 and current_count >= limit:
+                                    error_msg = f"Subscription limit reached. {plan_type.title()} plan allows {limit} {resource_type.replace('_', ' ')}. Current: {current_count}"
+                                    print(f"LIMIT EXCEEDED: {error_msg}")
                                     raise HTTPException(status_code=403, detail=error_msg)
                                 else:
-                                    print(f"Free limit check passed: {current_count} < {limit}")
+                                    print(f"Limit check passed: {current_count} < {limit}")
                             
                 except HTTPException:
                     raise  # Re-raise HTTP exceptions
@@ -1,12 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
 from fastapi.security import HTTPBearer
 from pydantic import BaseModel
-from supabase_client import supabase, supabase_admin
+from supabase_client import supabase, supabase_admin, decode_cursor, keyset_page, HISTORY_PAGE_MAX
+from services.subscription_cache import SUPER_ADMIN_USER_ID, DEFAULT_PLAN_LIMITS, get_cached_subscription, get_plan_limits, invalidate_subscription, subscription_cache_stats
+from services.balance_cache import get_cached_balance, set_cached_balance, invalidate_balance, balance_cache_stats
+from services.event_bus import event_bus, ProfileChanged, AccountDeleted, PurchaseCompleted
 from typing import Optional
 import os
 import sys
 import sys
 import time
+import uuid
 from datetime import datetime
 
 router = APIRouter()
@@ -45,7 +49,7 @@ async def auth_health_check():
     try:
         # Test database connection
         if supabase:
-            response = supabase.table('user_profiles').select('count').limit(1).execute()
+            response = await supabase.table('user_profiles').select('user_id').limit(1).execute_async()
             connected = response.status_code == 200
         else:
             connected = False
@@ -53,7 +57,11 @@ async def auth_health_check():
         return {
             "success": True,
             "message": "Authentication service is healthy",
-            "supabase_connected": connected
+            "supabase_connected": connected,
+            "caches": {
+                "balance": balance_cache_stats(),
+                "subscription": subscription_cache_stats()
+            }
         }
         
     except Exception as e:
@@ -70,7 +78,7 @@ async def get_user_profile(user_id: str):
         if not supabase:
             return {"success": False, "message": "Database not available"}
             
-        response = supabase.table('user_profiles').select('*').eq('user_id', user_id).execute()
+        response = await supabase.table('user_profiles').select('*').eq('user_id', user_id).execute_async()
         
         if response.data and len(response.data) > 0:
             return {"success": True, "user": response.data[0]}
@@ -104,18 +112,10 @@ async def update_user_profile(user_id: str, profile_data: dict):
         if not supabase:
             return {"success": False, "message": "Database not available"}
             
-        response = supabase.table('user_profiles').update(profile_data).eq('user_id', user_id).execute()
+        response = await supabase.table('user_profiles').update(profile_data).eq('user_id', user_id).execute_async()
         
         if response.data:
-            # Trigger Google Sheets sync after profile update
-            try:
-                import httpx
-                base_url = os.getenv("REACT_APP_BACKEND_URL", "http://127.0.0.1:8001")
-                async with httpx.AsyncClient() as client:
-                    await client.post(f"{base_url}/api/google-sheets/auto-sync-webhook")
-                print(f"✅ Google Sheets sync triggered after profile update")
-            except Exception as sync_error:
-                print(f"⚠️ Google Sheets sync trigger failed: {sync_error}")
+            event_bus.publish(ProfileChanged(user_id=user_id, action='updated'))
             
             return {"success": True, "message": "Profile updated successfully", "user": response.data[0]}
         else:
@@ -145,20 +145,12 @@ async def create_user_profile(user_id: str, profile_data: dict):
         print(f"Creating profile for user {user_id} with data: {cleaned_data}")
         
         # Use admin client to bypass RLS for profile creation
-        response = supabase_admin.table('user_profiles').insert(cleaned_data).execute()
+        response = await supabase_admin.table('user_profiles').insert(cleaned_data).execute_async()
         
         if response.data:
             print(f"✅ Profile created successfully for user {user_id}")
             
-            # Trigger Google Sheets sync after profile creation
-            try:
-                import httpx
-                base_url = os.getenv("REACT_APP_BACKEND_URL", "http://127.0.0.1:8001")
-                async with httpx.AsyncClient() as client:
-                    await client.post(f"{base_url}/api/google-sheets/auto-sync-webhook")
-                print(f"✅ Google Sheets sync triggered after profile creation")
-            except Exception as sync_error:
-                print(f"⚠️ Google Sheets sync trigger failed: {sync_error}")
+            event_bus.publish(ProfileChanged(user_id=user_id, action='created'))
             
             return {"success": True, "message": "Profile created successfully", "user": response.data[0]}
         else:
@@ -181,7 +173,7 @@ async def create_oauth_user_profile(user_id: str, oauth_data: dict):
         
         # First, verify the user exists in auth.users
         try:
-            user_check = supabase_admin.rpc('get_users_emails_simple').execute()
+            user_check = await supabase_admin.rpc('get_users_emails_simple').execute_async()
             user_exists = False
             if user_check.data:
                 user_exists = any(u['user_id'] == user_id for u in user_check.data)
@@ -218,26 +210,18 @@ async def create_oauth_user_profile(user_id: str, oauth_data: dict):
         print(f"✨ Processed profile data: {profile_data}")
         
         # Check if profile already exists
-        existing_check = supabase_admin.table('user_profiles').select('user_id').eq('user_id', user_id).execute()
+        existing_check = await supabase_admin.table('user_profiles').select('user_id').eq('user_id', user_id).execute_async()
         if existing_check.data:
             print(f"✅ Profile already exists for user {user_id}")
             return {"success": True, "message": "Profile already exists", "existed": True}
         
         # Create the profile using admin client
-        response = supabase_admin.table('user_profiles').insert(profile_data).execute()
+        response = await supabase_admin.table('user_profiles').insert(profile_data).execute_async()
         
         if response.data:
             print(f"✅ OAuth profile created successfully for user {user_id}")
             
-            # Trigger Google Sheets sync
-            try:
-                import httpx
-                base_url = os.getenv("REACT_APP_BACKEND_URL", "http://127.0.0.1:8001")
-                async with httpx.AsyncClient() as client:
-                    await client.post(f"{base_url}/api/google-sheets/auto-sync-webhook")
-                print(f"✅ Google Sheets sync triggered")
-            except Exception as sync_error:
-                print(f"⚠️ Google Sheets sync failed: {sync_error}")
+            event_bus.publish(ProfileChanged(user_id=user_id, action='oauth_created'))
             
             return {"success": True, "message": "OAuth profile created successfully", "user": response.data[0]}
         else:
@@ -276,50 +260,73 @@ async def delete_user_account(user_id: str):
             'commissions'             # Delete commission records
         ]
         
+        # Parent tables are cleared after everything that may reference them
+        parent_tables = ['subscriptions', 'user_accounts', 'user_profiles']
+        
         deletion_summary = {}
         
-        # Delete data from each table
-        for table in tables_to_clean:
-            try:
-                print(f"🧹 Deleting from table: {table}")
-                
-                # Get count before deletion for summary
-                count_result = supabase_admin.table(table).select('id').eq('user_id', user_id).execute()
-                before_count = len(count_result.data) if count_result.data else 0
-                
-                if before_count > 0:
-                    # Delete all records for this user
-                    delete_result = supabase_admin.table(table).delete().eq('user_id', user_id).execute()
-                    after_count = len(delete_result.data) if delete_result.data else 0
-                    
+        # Count rows in every table concurrently for the summary
+        count_results = await supabase_admin.gather(*[
+            supabase_admin.table(table).select('id').eq('user_id', user_id).count()
+            for table in tables_to_clean
+        ])
+        before_counts = {}
+        for table, count_result in zip(tables_to_clean, count_results):
+            if count_result.error:
+                print(f"❌ Error counting rows in {table}: {count_result.error}")
+                deletion_summary[table] = {
+                    "before": "unknown",
+                    "deleted": 0,
+                    "success": False,
+                    "error": count_result.error
+                }
+            else:
+                before_counts[table] = count_result.count or 0
+        
+        # Delete all records for this user, dependent tables first, in two concurrent waves
+        for wave in (
+            [t for t in tables_to_clean if t not in parent_tables],
+            [t for t in tables_to_clean if t in parent_tables]
+        ):
+            to_delete = [t for t in wave if before_counts.get(t, 0) > 0]
+            for table in wave:
+                if table in before_counts and table not in to_delete:
                     deletion_summary[table] = {
-                        "before": before_count,
-                        "deleted": after_count,
+                        "before": 0,
+                        "deleted": 0,
                         "success": True
                     }
-                    print(f"✅ Deleted {after_count} records from {table}")
-                else:
+                    print(f"ℹ️ No records found in {table}")
+            
+            delete_results = await supabase_admin.gather(*[
+                supabase_admin.table(table).delete().eq('user_id', user_id)
+                for table in to_delete
+            ])
+            for table, delete_result in zip(to_delete, delete_results):
+                if delete_result.error:
+                    print(f"❌ Error deleting from {table}: {delete_result.error}")
                     deletion_summary[table] = {
-                        "before": 0,
+                        "before": before_counts[table],
                         "deleted": 0,
+                        "success": False,
+                        "error": delete_result.error
+                    }
+                else:
+                    after_count = len(delete_result.data) if delete_result.data else 0
+                    deletion_summary[table] = {
+                        "before": before_counts[table],
+                        "deleted": after_count,
                         "success": True
                     }
-                    print(f"ℹ️ No records found in {table}")
-                    
-            except Exception as table_error:
-                print(f"❌ Error deleting from {table}: {table_error}")
-                deletion_summary[table] = {
-                    "before": "unknown",
-                    "deleted": 0,
-                    "success": False,
-                    "error": str(table_error)
-                }
+                    print(f"✅ Deleted {after_count} records from {table}")
+        invalidate_subscription(user_id)
+        invalidate_balance(user_id)
         
         # Finally, delete the user from auth.users (this is the critical part)
         print(f"🔥 Deleting user from auth.users table...")
         try:
             # Delete from auth.users using enhanced admin client
-            auth_delete_success = supabase_admin.auth.admin.delete_user(user_id)
+            auth_delete_success = await supabase_admin.auth.admin.delete_user_async(user_id)
             
             if auth_delete_success:
                 print(f"✅ User {user_id} deleted from auth.users successfully")
@@ -344,9 +351,9 @@ async def delete_user_account(user_id: str):
         # Delete user from Google Sheets
         print(f"📊 Deleting user from Google Sheets...")
         try:
-            # Import Google Sheets service
-            sys.path.append('/app/backend/services')
-            from google_sheets_service import google_sheets_service
+            # Same module (and singleton) the Google Sheets routes use
+            from services.google_sheets_service import google_sheets_service
+            from services.sheets_executor import sheets_executor
             
             # Try to get user email for better identification
             user_email = None
@@ -354,7 +361,7 @@ async def delete_user_account(user_id: str):
                 # Try to get email from the deleted profile data (if we captured it)
                 pass  # We'll use user_id for identification
             
-            sheets_delete_success = google_sheets_service.delete_user_from_sheets(user_id, user_email)
+            sheets_delete_success = await sheets_executor.run(google_sheets_service.delete_user_from_sheets, user_id, user_email)
             
             deletion_summary["google_sheets"] = {
                 "success": sheets_delete_success,
@@ -379,15 +386,7 @@ async def delete_user_account(user_id: str):
             if isinstance(item.get("deleted"), int)
         )
         
-        # Trigger Google Sheets sync after account deletion
-        try:
-            import httpx
-            base_url = os.getenv("REACT_APP_BACKEND_URL", "http://127.0.0.1:8001")
-            async with httpx.AsyncClient() as client:
-                await client.post(f"{base_url}/api/google-sheets/auto-sync-webhook")
-            print(f"✅ Google Sheets sync triggered after account deletion")
-        except Exception as sync_error:
-            print(f"⚠️ Google Sheets sync trigger failed: {sync_error}")
+        event_bus.publish(AccountDeleted(user_id=user_id))
         
         print(f"🎉 Account deletion completed! Total records deleted: {total_deleted}")
         
@@ -440,7 +439,7 @@ async def sync_balance(user_id: str):
             return {"success": False, "message": "Database not available"}
         
         # Get current backend balance
-        backend_response = supabase_admin.table('user_accounts').select('balance').eq('user_id', user_id).execute()
+        backend_response = await supabase_admin.table('user_accounts').select('balance').eq('user_id', user_id).execute_async()
         backend_balance = 0.0
         if backend_response.data and len(backend_response.data) > 0:
             backend_balance = float(backend_response.data[0]['balance']) if backend_response.data[0]['balance'] else 0.0
@@ -448,7 +447,7 @@ async def sync_balance(user_id: str):
         print(f"Current backend balance: {backend_balance}")
         
         # Get the balance from the regular supabase client (what frontend was using)
-        frontend_response = supabase.table('user_accounts').select('balance').eq('user_id', user_id).execute()
+        frontend_response = await supabase.table('user_accounts').select('balance').eq('user_id', user_id).execute_async()
         frontend_balance = 0.0
         if frontend_response.data and len(frontend_response.data) > 0:
             frontend_balance = float(frontend_response.data[0]['balance']) if frontend_response.data[0]['balance'] else 0.0
@@ -462,16 +461,17 @@ async def sync_balance(user_id: str):
         # Update backend balance to match
         if correct_balance != backend_balance:
             print(f"Updating backend balance from {backend_balance} to {correct_balance}")
-            supabase_admin.table('user_accounts').upsert({
+            await supabase_admin.table('user_accounts').upsert({
                 'user_id': user_id,
                 'balance': correct_balance,
                 'currency': 'USD'
-            }).execute()
+            }, on_conflict='user_id', returning='minimal').execute_async()
+        set_cached_balance(user_id, correct_balance)
         
         # Create a transaction record for the sync
         try:
             if correct_balance > backend_balance:
-                supabase_admin.table('transactions').insert({
+                await supabase_admin.table('transactions').insert({
                     'user_id': user_id,
                     'transaction_type': 'topup',
                     'amount': correct_balance - backend_balance,
@@ -479,7 +479,7 @@ async def sync_balance(user_id: str):
                     'net_amount': correct_balance - backend_balance,
                     'status': 'completed',
                     'description': f'Balance sync: restored ${correct_balance - backend_balance:.2f}'
-                }).execute()
+                }).execute_async()
         except Exception as tx_error:
             print(f"Failed to create sync transaction record: {tx_error}")
         
@@ -521,7 +521,7 @@ async def get_user_subscription_limits(user_id: str):
         print(f"Getting subscription limits for user {user_id}")
         
         # Super admin check by UUID
-        if user_id == 'cd0e9717-f85d-4726-81e9-f260394ead58':
+        if user_id == SUPER_ADMIN_USER_ID:
             return {
                 "success": True,
                 "subscription": {
@@ -532,43 +532,26 @@ async def get_user_subscription_limits(user_id: str):
                 }
             }
         
-        # Get user's subscription
-        response = supabase_admin.table('subscriptions')\
-            .select('*')\
-            .eq('user_id', user_id)\
-            .execute()
+        # Get user's subscription (cached per user, invalidated on subscription changes)
+        subscription = await get_cached_subscription(user_id)
         
-        if not response.data or len(response.data) == 0:
+        if not subscription:
             # Default to free plan if no subscription found
             return {
                 "success": True,
                 "subscription": {
                     "plan_type": "free",
-                    "limits": {
-                        "ai_bots": 1,
-                        "manual_bots": 2,
-                        "marketplace_products": 1
-                    },
+                    "limits": get_plan_limits(None),
                     "is_super_admin": False,
                     "status": "active"
                 }
             }
         
-        subscription = response.data[0]
         plan_type = subscription.get('plan_type', 'free')
         is_super_admin = plan_type == 'super_admin'
         
-        # Get limits based on plan type
-        if is_super_admin:
-            limits = None  # No limits
-        else:
-            # Default limits based on plan
-            default_limits = {
-                "free": {"ai_bots": 1, "manual_bots": 2, "marketplace_products": 1},
-                "plus": {"ai_bots": 3, "manual_bots": 5, "marketplace_products": 10},
-                "pro": {"ai_bots": -1, "manual_bots": -1, "marketplace_products": -1}
-            }
-            limits = subscription.get('limits') or default_limits.get(plan_type, default_limits["free"])
+        # Get limits based on plan type (None = no limits)
+        limits = get_plan_limits(subscription)
         
         return {
             "success": True,
@@ -596,7 +579,7 @@ async def check_subscription_limit(user_id: str, limit_check: LimitCheckRequest)
         print(f"Checking limit for user {user_id}: {limit_check.resource_type} (current: {limit_check.current_count})")
         
         # Super admin check by UUID
-        if user_id == 'cd0e9717-f85d-4726-81e9-f260394ead58':
+        if user_id == SUPER_ADMIN_USER_ID:
             return {
                 "success": True,
                 "can_create": True,
@@ -607,20 +590,12 @@ async def check_subscription_limit(user_id: str, limit_check: LimitCheckRequest)
                 "is_super_admin": True
             }
         
-        # Get user's subscription
-        response = supabase_admin.table('subscriptions')\
-            .select('*')\
-            .eq('user_id', user_id)\
-            .execute()
+        # Get user's subscription (cached per user, invalidated on subscription changes)
+        subscription = await get_cached_subscription(user_id)
         
         # Default to free plan if no subscription
-        if not response.data or len(response.data) == 0:
-            default_limits = {
-                "ai_bots": 1,
-                "manual_bots": 2,
-                "marketplace_products": 1
-            }
-            limit = default_limits.get(limit_check.resource_type, 1)
+        if not subscription:
+            limit = get_plan_limits(None).get(limit_check.resource_type, 1)
             
             # Validate current_count is non-negative
             if limit_check.current_count < 0:
@@ -645,7 +620,6 @@ async def check_subscription_limit(user_id: str, limit_check: LimitCheckRequest)
                 "is_super_admin": False
             }
         
-        subscription = response.data[0]
         plan_type = subscription.get('plan_type', 'free')
         
         # Super admin has no limits
@@ -661,15 +635,7 @@ async def check_subscription_limit(user_id: str, limit_check: LimitCheckRequest)
             }
         
         # Get limits from subscription or use defaults
-        limits = subscription.get('limits', {})
-        if not limits:
-            # Fallback to default limits based on plan
-            default_limits = {
-                "free": {"ai_bots": 1, "manual_bots": 2, "marketplace_products": 1},
-                "plus": {"ai_bots": 3, "manual_bots": 5, "marketplace_products": 10},
-                "pro": {"ai_bots": -1, "manual_bots": -1, "marketplace_products": -1}
-            }
-            limits = default_limits.get(plan_type, default_limits["free"])
+        limits = get_plan_limits(subscription)
         
         limit = limits.get(limit_check.resource_type, 1)
         
@@ -725,12 +691,12 @@ async def get_user_subscription(user_id: str):
         print(f"Getting subscription for user {user_id}")
         
         # Super admin check by UUID
-        if user_id == 'cd0e9717-f85d-4726-81e9-f260394ead58':
+        if user_id == SUPER_ADMIN_USER_ID:
             # Check if super admin subscription exists, if not create it
-            response = supabase_admin.table('subscriptions')\
+            response = await supabase_admin.table('subscriptions')\
                 .select('*')\
                 .eq('user_id', user_id)\
-                .execute()
+                .execute_async()
             
             if not response.data or len(response.data) == 0:
                 # Create super admin subscription
@@ -746,17 +712,19 @@ async def get_user_subscription(user_id: str):
                     'limits': None
                 }
                 
-                create_response = supabase_admin.table('subscriptions').insert(super_admin_sub).execute()
+                create_response = await supabase_admin.table('subscriptions').insert(super_admin_sub).execute_async()
+                invalidate_subscription(user_id)
                 subscription = create_response.data[0] if create_response.data else super_admin_sub
             else:
                 subscription = response.data[0]
                 # Update to super_admin if not already
                 if subscription.get('plan_type') != 'super_admin':
-                    supabase_admin.table('subscriptions').update({
+                    await supabase_admin.table('subscriptions').update({
                         'plan_type': 'super_admin',
                         'status': 'active',
                         'limits': None
-                    }).eq('user_id', user_id).execute()
+                    }).eq('user_id', user_id).execute_async()
+                    invalidate_subscription(user_id)
                     subscription['plan_type'] = 'super_admin'
                     subscription['limits'] = None
             
@@ -766,10 +734,10 @@ async def get_user_subscription(user_id: str):
             }
         
         # Get user's subscription
-        response = supabase_admin.table('subscriptions')\
+        response = await supabase_admin.table('subscriptions')\
             .select('*')\
             .eq('user_id', user_id)\
-            .execute()
+            .execute_async()
         
         if not response.data or len(response.data) == 0:
             # Create default free subscription
@@ -789,7 +757,8 @@ async def get_user_subscription(user_id: str):
                 }
             }
             
-            create_response = supabase_admin.table('subscriptions').insert(default_sub).execute()
+            create_response = await supabase_admin.table('subscriptions').insert(default_sub).execute_async()
+            invalidate_subscription(user_id)
             
             return {
                 "success": True,
@@ -801,12 +770,7 @@ async def get_user_subscription(user_id: str):
         
         # Ensure limits are set for non-super-admin plans
         if plan_type != 'super_admin' and not subscription.get('limits'):
-            default_limits = {
-                "free": {"ai_bots": 1, "manual_bots": 2, "marketplace_products": 1},
-                "plus": {"ai_bots": 3, "manual_bots": 5, "marketplace_products": 10},
-                "pro": {"ai_bots": -1, "manual_bots": -1, "marketplace_products": -1}
-            }
-            subscription['limits'] = default_limits.get(plan_type, default_limits["free"])
+            subscription['limits'] = get_plan_limits(subscription)
         
         # Check if subscription has expired
         if subscription.get('end_date'):
@@ -815,16 +779,17 @@ async def get_user_subscription(user_id: str):
                 end_date = datetime.fromisoformat(subscription['end_date'].replace('Z', '+00:00'))
                 if end_date < datetime.now(timezone.utc):
                     # Subscription expired, downgrade to free
-                    supabase_admin.table('subscriptions').update({
+                    await supabase_admin.table('subscriptions').update({
                         'plan_type': 'free',
                         'status': 'expired',
                         'end_date': None,
-                        'limits': {"ai_bots": 1, "manual_bots": 2, "marketplace_products": 1}
-                    }).eq('user_id', user_id).execute()
+                        'limits': DEFAULT_PLAN_LIMITS["free"]
+                    }).eq('user_id', user_id).execute_async()
+                    invalidate_subscription(user_id)
                     
                     subscription['plan_type'] = 'free'
                     subscription['status'] = 'expired'
-                    subscription['limits'] = {"ai_bots": 1, "manual_bots": 2, "marketplace_products": 1}
+                    subscription['limits'] = get_plan_limits(None)
             except Exception as date_error:
                 print(f"Error parsing end_date: {date_error}")
         
@@ -847,11 +812,14 @@ async def upgrade_user_subscription(user_id: str, upgrade_request: SubscriptionU
         print(f"Upgrading subscription for user {user_id} to {upgrade_request.plan_type} for ${upgrade_request.price}")
         
         # Use the database function to handle the upgrade
-        response = supabase_admin.rpc('upgrade_subscription', {
+        response = await supabase_admin.rpc('upgrade_subscription', {
             'p_user_id': user_id,
             'p_plan_type': upgrade_request.plan_type,
             'p_price': upgrade_request.price
-        }).execute()
+        }).execute_async()
+        
+        invalidate_subscription(user_id)
+        invalidate_balance(user_id)
         
         if response.data:
             result = response.data
@@ -859,13 +827,13 @@ async def upgrade_user_subscription(user_id: str, upgrade_request: SubscriptionU
             # Create success notification if upgrade succeeded
             if result.get('success'):
                 try:
-                    supabase_admin.table('user_notifications').insert({
+                    await supabase_admin.table('user_notifications').insert({
                         'user_id': user_id,
                         'title': f'Subscription Upgraded to {upgrade_request.plan_type.title()}',
                         'message': f'Your subscription has been upgraded to {upgrade_request.plan_type.title()} plan for ${upgrade_request.price:.2f}. Enjoy your new features!',
                         'type': 'success',
                         'is_read': False
-                    }).execute()
+                    }).execute_async()
                 except Exception as notification_error:
                     print(f"Failed to create upgrade notification: {notification_error}")
             
@@ -887,10 +855,10 @@ async def cancel_user_subscription(user_id: str):
         print(f"Cancelling subscription for user {user_id}")
         
         # Get current subscription first
-        current_response = supabase_admin.table('subscriptions')\
+        current_response = await supabase_admin.table('subscriptions')\
             .select('*')\
             .eq('user_id', user_id)\
-            .execute()
+            .execute_async()
         
         if not current_response.data:
             return {"success": False, "message": "No active subscription found"}
@@ -904,73 +872,56 @@ async def cancel_user_subscription(user_id: str):
             return {"success": False, "message": "No active paid subscription to cancel"}
         
         # Update subscription to cancelled status but keep plan_type until end_date
-        response = supabase_admin.table('subscriptions').update({
+        response = await supabase_admin.table('subscriptions').update({
             'status': 'cancelled',  # Mark as cancelled
             'renewal': False,       # Disable auto-renewal
             'updated_at': 'now()'
-        }).eq('user_id', user_id).execute()
+        }).eq('user_id', user_id).execute_async()
+        invalidate_subscription(user_id)
         
         # ALSO CANCEL IN NOWPAYMENTS - Get the NowPayments subscription ID
-        nowpayments_sub = supabase_admin.table('nowpayments_subscriptions')\
+        nowpayments_sub = await supabase_admin.table('nowpayments_subscriptions')\
             .select('subscription_id')\
             .eq('user_id', user_id)\
             .eq('is_active', True)\
-            .execute()
+            .execute_async()
         
         if nowpayments_sub.data:
             nowpayments_subscription_id = nowpayments_sub.data[0]['subscription_id']
             print(f"🔄 Also cancelling NowPayments subscription: {nowpayments_subscription_id}")
             
             try:
-                import httpx
-                import json
                 import os
+                from services.nowpayments_auth import nowpayments_tokens
                 
-                # Get JWT token for NowPayments API
-                async def get_nowpayments_jwt():
-                    auth_data = {
-                        "email": os.getenv("NOWPAYMENTS_EMAIL"),
-                        "password": os.getenv("NOWPAYMENTS_PASSWORD")
-                    }
-                    
-                    async with httpx.AsyncClient() as client:
-                        response = await client.post(
-                            "https://api.nowpayments.io/v1/auth",
-                            json=auth_data,
-                            headers={"x-api-key": os.getenv("NOWPAYMENTS_API_KEY")}
-                        )
-                        if response.status_code == 200:
-                            return response.json().get("token")
-                    return None
-                
-                jwt_token = await get_nowpayments_jwt()
+                # Shared, cached NowPayments JWT
+                jwt_token = await nowpayments_tokens.get_token()
                 
                 if jwt_token:
-                    # Cancel subscription in NowPayments
+                    # Cancel subscription in NowPayments (retried once with a fresh token on 401)
                     headers = {
                         "x-api-key": os.getenv("NOWPAYMENTS_API_KEY"),
-                        "Authorization": f"Bearer {jwt_token}",
                         "Content-Type": "application/json"
                     }
                     
-                    async with httpx.AsyncClient() as client:
-                        cancel_response = await client.delete(
-                            f"https://api.nowpayments.io/v1/subscriptions/{nowpayments_subscription_id}",
-                            headers=headers
-                        )
+                    cancel_response = await nowpayments_tokens.request(
+                        "DELETE",
+                        f"https://api.nowpayments.io/v1/subscriptions/{nowpayments_subscription_id}",
+                        headers=headers
+                    )
                     
                     if cancel_response.status_code in [200, 201]:
                         print(f"✅ Successfully cancelled NowPayments subscription: {nowpayments_subscription_id}")
                         
                         # Also update nowpayments_subscriptions table
-                        supabase_admin.table('nowpayments_subscriptions')\
+                        await supabase_admin.table('nowpayments_subscriptions')\
                             .update({
                                 'status': 'CANCELLED',
                                 'is_active': False,
                                 'updated_at': 'now()'
                             })\
                             .eq('subscription_id', nowpayments_subscription_id)\
-                            .execute()
+                            .execute_async()
                     else:
                         print(f"⚠️ Failed to cancel NowPayments subscription: {nowpayments_subscription_id}, status: {cancel_response.status_code}")
                 else:
@@ -992,13 +943,13 @@ async def cancel_user_subscription(user_id: str):
                 except:
                     end_date_str = "the end of your billing period"
             
-            supabase_admin.table('user_notifications').insert({
+            await supabase_admin.table('user_notifications').insert({
                 'user_id': user_id,
                 'title': 'Subscription Cancelled',
                 'message': f'Your {current_plan.title()} subscription has been cancelled. You will keep your current features until {end_date_str}, after which your plan will automatically downgrade to Free.',
                 'type': 'info',
                 'is_read': False
-            }).execute()
+            }).execute_async()
         except Exception as notification_error:
             print(f"Failed to create cancellation notification: {notification_error}")
         
@@ -1093,28 +1044,33 @@ async def get_subscription_plans():
     }
 
 @router.get("/auth/user/{user_id}/notifications")
-async def get_user_notifications(user_id: str, limit: int = 50, offset: int = 0):
-    """Get user notifications"""
+async def get_user_notifications(user_id: str, limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX), offset: int = Query(0, ge=0), cursor: Optional[str] = None):
+    """Get user notifications, newest first; pass next_cursor back as cursor for the next page"""
     try:
         if not supabase_admin:
             return {"success": False, "message": "Database not available"}
         
-        print(f"Getting notifications for user {user_id}, limit: {limit}, offset: {offset}")
+        print(f"Getting notifications for user {user_id}, limit: {limit}, offset: {offset}, cursor: {cursor}")
         
-        response = supabase_admin.table('user_notifications')\
+        query = supabase_admin.table('user_notifications')\
             .select('*')\
             .eq('user_id', user_id)\
-            .order('created_at', desc=True)\
-            .limit(limit)\
-            .execute()
+            .keyset(cursor, limit)
+        if offset and not cursor:
+            query.offset(offset)
+        response = await query.execute_async()
         
-        print(f"Notifications response: {response}")
+        notifications, next_cursor = keyset_page(response.data, limit)
         
         return {
             "success": True,
-            "notifications": response.data if response.data else []
+            "notifications": notifications,
+            "next_cursor": next_cursor
         }
         
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
+        
     except Exception as e:
         print(f"Error getting notifications: {e}")
         return {"success": False, "message": f"Failed to get notifications: {str(e)}"}
@@ -1129,7 +1085,7 @@ async def delete_notification(user_id: str, notification_id: str):
         print(f"Deleting notification {notification_id} for user {user_id}")
         
         # Delete the notification
-        response = supabase_admin.table('user_notifications').delete().eq('id', notification_id).eq('user_id', user_id).execute()
+        response = await supabase_admin.table('user_notifications').delete().eq('id', notification_id).eq('user_id', user_id).execute_async()
         
         print(f"Delete response: {response}")
         
@@ -1152,7 +1108,7 @@ async def delete_all_notifications(user_id: str):
         print(f"Deleting all notifications for user {user_id}")
         
         # Delete all notifications for the user
-        response = supabase_admin.table('user_notifications').delete().eq('user_id', user_id).execute()
+        response = await supabase_admin.table('user_notifications').delete().eq('user_id', user_id).execute_async()
         
         print(f"Delete all response: {response}")
         
@@ -1193,20 +1149,24 @@ async def set_balance_direct(user_id: str, balance_data: dict):
         # Use raw SQL to bypass RLS if needed
         if supabase_admin:
             # First try normal upsert
-            response = supabase_admin.table('user_accounts').select('*').eq('user_id', user_id).execute()
+            response = await supabase_admin.table('user_accounts').select('*').eq('user_id', user_id).execute_async()
             print(f"Current account check: {response.data}")
             
             # Force upsert with admin privileges
-            upsert_response = supabase_admin.table('user_accounts').upsert({
+            upsert_response = await supabase_admin.table('user_accounts').upsert({
                 'user_id': user_id,
                 'balance': amount,
                 'currency': 'USD',
                 'updated_at': 'now()'
-            }).execute()
+            }, on_conflict='user_id').execute_async()
             print(f"Upsert response: {upsert_response.data}")
+            if upsert_response.error:
+                invalidate_balance(user_id)
+            else:
+                set_cached_balance(user_id, amount)
             
             # Verify the update worked
-            verify_response = supabase_admin.table('user_accounts').select('*').eq('user_id', user_id).execute()
+            verify_response = await supabase_admin.table('user_accounts').select('*').eq('user_id', user_id).execute_async()
             print(f"Verification response: {verify_response.data}")
             
             return {
@@ -1235,24 +1195,16 @@ async def get_user_balance(user_id: str):
             print("❌ Database not available")
             return {"success": False, "message": "Database not available"}
             
-        print("✅ Database client available")
-        print(f"Querying user_accounts table for user_id: {user_id}")
-        
-        response = supabase_admin.table('user_accounts').select('balance, currency').eq('user_id', user_id).execute()
+        # Served from the write-through balance cache; Postgres is only hit on a miss
+        account = await get_cached_balance(user_id)
         
-        print(f"Database response: {response}")
-        print(f"Response data: {response.data}")
-        print(f"Response count: {response.count if hasattr(response, 'count') else 'N/A'}")
-        
-        if response.data and len(response.data) > 0:
-            balance_value = response.data[0]['balance']
-            currency_value = response.data[0].get('currency', 'USD')
-            print(f"Found balance record: balance={balance_value}, currency={currency_value}")
+        if account:
+            print(f"Found balance record: balance={account['balance']}, currency={account['currency']}")
             
             result = {
                 "success": True, 
-                "balance": float(balance_value) if balance_value else 0.0,
-                "currency": currency_value
+                "balance": account['balance'],
+                "currency": account['currency']
             }
             print(f"Returning result: {result}")
             print("=== END GET BALANCE ENDPOINT ===\n")
@@ -1260,12 +1212,13 @@ async def get_user_balance(user_id: str):
         else:
             print("No balance record found, creating new account with zero balance")
             # Create account with zero balance if doesn't exist
-            insert_response = supabase_admin.table('user_accounts').insert({
+            insert_response = await supabase_admin.table('user_accounts').insert({
                 'user_id': user_id,
                 'balance': 0.0,
                 'currency': 'USD'
-            }).execute()
+            }).execute_async()
             print(f"Insert response: {insert_response}")
+            set_cached_balance(user_id, 0.0)
             
             result = {"success": True, "balance": 0.0, "currency": "USD"}
             print(f"Returning new account result: {result}")
@@ -1287,150 +1240,76 @@ async def process_transaction(user_id: str, transaction: TransactionRequest):
         if not supabase_admin:
             return {"success": False, "message": "Database not available"}
         
-        # Call the database function to process the purchase
-        # Since we don't have rpc support, we'll implement the logic here
+        # Balance check, both balance moves, the transaction record, both
+        # notifications and the company fee are one Postgres transaction
+        # (see create_atomic_marketplace_purchase_rpc.sql)
+        purchase_response = await supabase_admin.rpc('process_marketplace_purchase_atomic', {
+            'p_buyer_id': user_id,
+            'p_seller_id': transaction.seller_id,
+            'p_product_id': transaction.product_id,
+            'p_amount': transaction.amount,
+            'p_description': transaction.description
+        }).execute_async()
         
-        # First check buyer's balance
-        balance_response = supabase_admin.table('user_accounts').select('balance').eq('user_id', user_id).execute()
-        
-        if not balance_response.data or len(balance_response.data) == 0:
-            # Create account with zero balance if doesn't exist
-            supabase_admin.table('user_accounts').insert({
-                'user_id': user_id,
-                'balance': 0.0,
-                'currency': 'USD'
-            }).execute()
-            current_balance = 0.0
-        else:
-            current_balance = float(balance_response.data[0]['balance']) if balance_response.data[0]['balance'] else 0.0
+        purchase = purchase_response.data[0] if isinstance(purchase_response.data, list) and purchase_response.data else purchase_response.data
         
-        # Check if buyer has sufficient funds
-        if current_balance < transaction.amount:
+        if purchase_response.error or not isinstance(purchase, dict):
+            # Return error if transaction fails
+            print(f"❌ Transaction processing failed: {purchase_response.error}")
             return {
                 'success': False,
-                'error': 'insufficient_funds',
-                'message': 'Insufficient balance to complete purchase',
-                'current_balance': current_balance,
-                'required_amount': transaction.amount
+                'error': 'transaction_failed',
+                'message': f'Failed to process purchase: {purchase_response.error}'
             }
         
-        # Calculate fees (10% platform fee)
-        platform_fee = transaction.amount * 0.10
-        seller_amount = transaction.amount * 0.90
-        
-        try:
-            # 1. Deduct amount from buyer's balance
-            new_buyer_balance = current_balance - transaction.amount
-            supabase_admin.table('user_accounts').update({
-                'balance': new_buyer_balance,
-                'updated_at': 'now()'
-            }).eq('user_id', user_id).execute()
-            
-            # 2. Add seller amount to seller's balance (create account if doesn't exist)
-            seller_balance_response = supabase_admin.table('user_accounts').select('balance').eq('user_id', transaction.seller_id).execute()
-            
-            if not seller_balance_response.data or len(seller_balance_response.data) == 0:
-                # Create seller account
-                supabase_admin.table('user_accounts').insert({
-                    'user_id': transaction.seller_id,
-                    'balance': seller_amount,
-                    'currency': 'USD'
-                }).execute()
-            else:
-                current_seller_balance = float(seller_balance_response.data[0]['balance']) if seller_balance_response.data[0]['balance'] else 0.0
-                new_seller_balance = current_seller_balance + seller_amount
-                supabase_admin.table('user_accounts').update({
-                    'balance': new_seller_balance,
-                    'updated_at': 'now()'
-                }).eq('user_id', transaction.seller_id).execute()
-            
-            # 3. Create transaction record for the purchase
-            transaction_record = supabase_admin.table('transactions').insert({
-                'user_id': user_id,
-                'seller_id': transaction.seller_id,
-                'product_id': transaction.product_id,
-                'transaction_type': 'purchase',
-                'amount': transaction.amount,
-                'platform_fee': platform_fee,
-                'net_amount': seller_amount,
-                'status': 'completed',
-                'description': transaction.description or f"Purchase of product {transaction.product_id}"
-            }).execute()
-            
-            transaction_id = transaction_record.data[0]['id'] if transaction_record.data else None
-            
-            result = {
-                'success': True,
-                'transaction_id': transaction_id,
-                'amount_charged': transaction.amount,
-                'platform_fee': platform_fee,
-                'seller_received': seller_amount,
-                'buyer_new_balance': new_buyer_balance
-            }
-            
-            # Create notifications BEFORE returning the result
-            try:
-                # Create notification for buyer
-                supabase_admin.table('user_notifications').insert({
-                    'user_id': user_id,
-                    'title': 'Purchase Successful! 🛒',
-                    'message': f'You have successfully purchased "{transaction.description or "a product"}" for ${transaction.amount:.2f}. Your new balance is ${new_buyer_balance:.2f}.',
-                    'type': 'success',
-                    'is_read': False
-                }).execute()
-                
-                # Create notification for seller
-                supabase_admin.table('user_notifications').insert({
-                    'user_id': transaction.seller_id,
-                    'title': 'Sale Completed! 💰',
-                    'message': f'Your product was purchased for ${transaction.amount:.2f}. You received ${seller_amount:.2f} (after 10% platform fee).',
-                    'type': 'success',
-                    'is_read': False
-                }).execute()
-                
-                print(f"✅ Notifications created for buyer and seller")
-            except Exception as notification_error:
-                print(f"⚠️ Failed to create notifications: {notification_error}")
-            
-            # Trigger Google Sheets sync after successful purchase
-            try:
-                import httpx
-                base_url = os.getenv("REACT_APP_BACKEND_URL", "http://127.0.0.1:8001")
-                async with httpx.AsyncClient() as client:
-                    await client.post(f"{base_url}/api/google-sheets/auto-sync-webhook")
-                print(f"✅ Google Sheets sync triggered after purchase")
-            except Exception as sync_error:
-                print(f"⚠️ Google Sheets sync trigger failed: {sync_error}")
-            
-            # Update company balance with marketplace fees and user funds tracking
-            try:
-                print(f"💰 Updating company balance with platform fee: ${platform_fee:.2f}")
-                company_update = supabase_admin.rpc('update_company_balance_marketplace', {
-                    'platform_fee_amount': platform_fee
-                }).execute()
-                
-                if company_update.data:
-                    company_data = company_update.data[0] if isinstance(company_update.data, list) else company_update.data
-                    print(f"✅ Company balance updated:")
-                    print(f"   Platform fee added: ${company_data.get('platform_fee_added', 0):.2f}")
-                    print(f"   New fees earned: ${company_data.get('new_fees_earned', 0):.2f}")
-                    print(f"   New company funds: ${company_data.get('new_company_funds', 0):.2f}")
-                    print(f"   Current user funds: ${company_data.get('current_user_funds', 0):.2f}")
-                else:
-                    print(f"⚠️ Company balance update returned no data")
-            except Exception as balance_error:
-                print(f"⚠️ Company balance update failed: {balance_error}")
-            
-            return result
-            
-        except Exception as transaction_error:
-            # Return error if transaction fails
-            print(f"❌ Transaction processing failed: {transaction_error}")
+        if not purchase.get('success'):
+            if purchase.get('error') == 'insufficient_funds':
+                set_cached_balance(user_id, purchase.get('current_balance') or 0)
+                return {
+                    'success': False,
+                    'error': 'insufficient_funds',
+                    'message': purchase.get('message', 'Insufficient balance to complete purchase'),
+                    'current_balance': float(purchase.get('current_balance') or 0),
+                    'required_amount': transaction.amount
+                }
+            print(f"❌ Transaction processing failed: {purchase.get('message')}")
             return {
                 'success': False,
-                'error': 'transaction_failed',
-                'message': f'Failed to process purchase: {str(transaction_error)}'
+                'error': purchase.get('error', 'transaction_failed'),
+                'message': purchase.get('message', 'Failed to process purchase')
             }
+        
+        result = {
+            'success': True,
+            'transaction_id': purchase.get('transaction_id'),
+            'amount_charged': transaction.amount,
+            'platform_fee': float(purchase['platform_fee']),
+            'seller_received': float(purchase['seller_received']),
+            'buyer_new_balance': float(purchase['buyer_new_balance'])
+        }
+        print(f"✅ Purchase {result['transaction_id']} committed, notifications created for buyer and seller")
+        set_cached_balance(user_id, purchase['buyer_new_balance'])
+        set_cached_balance(transaction.seller_id, purchase.get('seller_new_balance'))
+        
+        company_data = purchase.get('company_balance')
+        if company_data and company_data.get('success'):
+            print(f"✅ Company balance updated:")
+            print(f"   Platform fee added: ${float(company_data.get('platform_fee_added', 0)):.2f}")
+            print(f"   New fees earned: ${float(company_data.get('new_fees_earned', 0)):.2f}")
+            print(f"   New company funds: ${float(company_data.get('new_company_funds', 0)):.2f}")
+            print(f"   Current user funds: ${float(company_data.get('current_user_funds', 0)):.2f}")
+        else:
+            print(f"⚠️ Company balance update failed: {company_data}")
+        
+        event_bus.publish(PurchaseCompleted(
+            buyer_id=user_id,
+            seller_id=transaction.seller_id,
+            product_id=transaction.product_id,
+            transaction_id=result['transaction_id'],
+            amount=transaction.amount
+        ))
+        
+        return result
             
     except Exception as e:
         return {"success": False, "message": f"Failed to process transaction: {str(e)}"}
@@ -1458,7 +1337,7 @@ async def save_user_purchase(user_id: str, purchase_data: dict):
         print(f"Purchase record to save: {purchase_record}")
         
         # Use admin client to save purchase (bypasses RLS)
-        result = supabase_admin.table('user_purchases').insert(purchase_record).execute()
+        result = await supabase_admin.table('user_purchases').insert(purchase_record).execute_async()
         
         if result.data:
             print(f"✅ Purchase saved successfully: {result.data[0]['id']}")
@@ -1506,18 +1385,18 @@ async def update_balance(user_id: str, balance_update: BalanceUpdateRequest):
         
         # Get current balance first
         print(f"Fetching current balance for user: {user_id}")
-        current_response = supabase_admin.table('user_accounts').select('balance').eq('user_id', user_id).execute()
+        current_response = await supabase_admin.table('user_accounts').select('balance').eq('user_id', user_id).execute_async()
         print(f"Current balance query response: {current_response}")
         
         if not current_response.data or len(current_response.data) == 0:
             print("No existing account found, creating new account")
             current_balance = 0.0
             # Create account with zero balance if doesn't exist
-            supabase_admin.table('user_accounts').insert({
+            await supabase_admin.table('user_accounts').insert({
                 'user_id': user_id,
                 'balance': 0.0,
                 'currency': 'USD'
-            }).execute()
+            }).execute_async()
             print("✅ New account created")
         else:
             current_balance = float(current_response.data[0]['balance']) if current_response.data[0]['balance'] else 0.0
@@ -1538,26 +1417,32 @@ async def update_balance(user_id: str, balance_update: BalanceUpdateRequest):
         
         # Update balance
         print("Updating balance in database...")
-        update_response = supabase_admin.table('user_accounts').update({
+        update_response = await supabase_admin.table('user_accounts').update({
             'balance': new_balance,
             'currency': 'USD'
-        }).eq('user_id', user_id).execute()
+        }).eq('user_id', user_id).execute_async()
         print(f"Balance update response: {update_response}")
         
         if not update_response.data:
             print("Update failed, trying insert (upsert behavior)...")
             # If update failed, try insert (upsert behavior)
-            insert_response = supabase_admin.table('user_accounts').insert({
+            insert_response = await supabase_admin.table('user_accounts').insert({
                 'user_id': user_id,
                 'balance': new_balance,
                 'currency': 'USD'
-            }).execute()
+            }).execute_async()
             print(f"Insert response: {insert_response}")
+            if insert_response.error:
+                invalidate_balance(user_id)
+            else:
+                set_cached_balance(user_id, new_balance)
+        else:
+            set_cached_balance(user_id, new_balance)
         
         # Create transaction record (skip if table doesn't exist)
         try:
             print("Creating transaction record...")
-            tx_response = supabase_admin.table('transactions').insert({
+            tx_response = await supabase_admin.table('transactions').insert({
                 'user_id': user_id,
                 'transaction_type': balance_update.transaction_type,
                 'amount': balance_update.amount,
@@ -1565,7 +1450,7 @@ async def update_balance(user_id: str, balance_update: BalanceUpdateRequest):
                 'net_amount': balance_update.amount,
                 'status': 'completed',
                 'description': balance_update.description or f"{balance_update.transaction_type.title()} of ${balance_update.amount:.2f}"
-            }).execute()
+            }).execute_async()
             print(f"Transaction record created: {tx_response}")
         except Exception as tx_error:
             print(f"Failed to create transaction record (table may not exist): {tx_error}")
@@ -1579,13 +1464,13 @@ async def update_balance(user_id: str, balance_update: BalanceUpdateRequest):
                 else f"You have withdrawn ${balance_update.amount:.2f}. New balance: ${new_balance:.2f}"
             )
             
-            notification_response = supabase_admin.table('user_notifications').insert({
+            notification_response = await supabase_admin.table('user_notifications').insert({
                 'user_id': user_id,
                 'title': f"{balance_update.transaction_type.title()} Successful",
                 'message': notification_message,
                 'type': 'success',
                 'is_read': False
-            }).execute()
+            }).execute_async()
             print(f"Notification created: {notification_response}")
         except Exception as notification_error:
             print(f"Failed to create notification (table may not exist): {notification_error}")
@@ -1612,55 +1497,42 @@ async def update_balance(user_id: str, balance_update: BalanceUpdateRequest):
         return {"success": False, "message": f"Failed to update balance: {str(e)}"}
 
 @router.get("/auth/user/{user_id}/transactions")
-async def get_user_transactions(user_id: str, limit: int = 50, offset: int = 0):
-    """Get user's transaction history"""
+async def get_user_transactions(user_id: str, limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX), offset: int = Query(0, ge=0), cursor: Optional[str] = None):
+    """Get user's transaction history, newest first; pass next_cursor back as cursor for the next page"""
     try:
         if not supabase_admin:
             return {"success": False, "message": "Database not available"}
         
+        # user_id goes into an or=() logic filter below, so only a UUID is accepted
+        try:
+            user_id = str(uuid.UUID(user_id))
+        except ValueError:
+            return {"success": False, "message": "Invalid user_id"}
+        
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError as e:
+                return {"success": False, "message": str(e)}
+        
         # Check if transactions table exists, return empty list if not
         try:
-            response = supabase_admin.table('transactions')\
-                .select('*')\
-                .eq('user_id', user_id)\
-                .order('created_at', False)\
-                .limit(limit)\
-                .execute()
-            
-            # Also get transactions where user is the seller
-            seller_response = supabase_admin.table('transactions')\
+            # Buyer-side and seller-side history in one query, paged by Postgres
+            query = supabase_admin.table('transactions')\
                 .select('*')\
-                .eq('seller_id', user_id)\
-                .order('created_at', False)\
-                .limit(limit)\
-                .execute()
-            
-            # Combine and sort results
-            all_transactions = []
-            if response.data:
-                all_transactions.extend(response.data)
-            if seller_response.data:
-                all_transactions.extend(seller_response.data)
-            
-            # Remove duplicates and sort by created_at
-            seen_ids = set()
-            unique_transactions = []
-            for tx in all_transactions:
-                if tx['id'] not in seen_ids:
-                    seen_ids.add(tx['id'])
-                    unique_transactions.append(tx)
-            
-            # Sort by created_at descending
-            unique_transactions.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+                .or_(f'user_id.eq.{user_id},seller_id.eq.{user_id}')\
+                .keyset(cursor, limit)
+            if offset and not cursor:
+                query.offset(offset)
+            response = await query.execute_async()
             
-            # Apply limit
-            limited_transactions = unique_transactions[:limit]
+            transactions, next_cursor = keyset_page(response.data, limit)
             
-            return {"success": True, "transactions": limited_transactions}
+            return {"success": True, "transactions": transactions, "next_cursor": next_cursor}
             
         except Exception as table_error:
             print(f"Transactions table not available: {table_error}")
-            return {"success": True, "transactions": []}
+            return {"success": True, "transactions": [], "next_cursor": None}
             
     except Exception as e:
         return {"success": False, "message": f"Failed to get transactions: {str(e)}"}
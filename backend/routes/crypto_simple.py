@@ -2,14 +2,18 @@
 Simple Crypto Payments Routes - Compatible with existing FastAPI setup
 """
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional, List
 import os
+import json
 import time
 import uuid
 import hashlib
 
+from services.balance_cache import invalidate_balance
+from services.webhook_queue import webhook_queue
+
 router = APIRouter()
 
 # Simple Pydantic models compatible with v1
@@ -176,104 +180,164 @@ async def create_deposit_address(request: DepositAddressRequest, user_id: str =
 
 @router.post("/crypto/webhook/capitalist")
 async def capitalist_webhook(request: dict):
-    """Webhook endpoint to receive Capitalist API callbacks for deposit confirmations"""
+    """Webhook endpoint to receive Capitalist API callbacks for deposit confirmations.
+    
+    The callback is acknowledged once it is stored in the webhook queue and
+    applied from there.
+    """
     try:
-        # Import Supabase client with service role key
-        import sys
-        sys.path.append('/app/backend')
-        from supabase_client import supabase_admin as supabase
-        
-        if not supabase:
-            return {"success": False, "detail": "Database connection not available"}
-        
         # Extract payment data from Capitalist callback
         # Format: Operation code;USDT address;Amount;Payment number from your system;Payment description
         payment_reference = request.get('payment_reference') or request.get('reference')
         amount = float(request.get('amount', 0))
-        transaction_hash = request.get('transaction_hash') or request.get('txn_hash')
-        status = request.get('status', 'confirmed')
         
         if not payment_reference or amount <= 0:
             return {"success": False, "detail": "Invalid callback data"}
         
-        # Find the crypto transaction by reference
-        transaction_result = supabase.table('crypto_transactions')\
-            .select('*')\
-            .eq('reference', payment_reference)\
-            .eq('transaction_type', 'deposit')\
-            .eq('status', 'pending')\
-            .execute()
-        
-        if not transaction_result.data:
-            return {"success": False, "detail": "Transaction not found or already processed"}
-        
-        crypto_tx = transaction_result.data[0]
-        user_id = crypto_tx['user_id']
-        transaction_id = crypto_tx['id']
-        
-        # Update crypto transaction with confirmation details
-        supabase.table('crypto_transactions')\
-            .update({
-                'amount': amount,
-                'transaction_hash': transaction_hash,
-                'status': 'confirmed',
-                'confirmations': 1,
-                'updated_at': 'now()'
-            })\
-            .eq('id', transaction_id)\
-            .execute()
-        
-        # Create balance transaction (credit user account)
-        balance_transaction = {
-            'user_id': user_id,
-            'transaction_type': 'topup',
-            'amount': amount,
-            'platform_fee': 0.0,  # No fee on deposits
-            'net_amount': amount,
-            'status': 'completed',
-            'description': f"Crypto deposit: ${amount} from {crypto_tx['currency']} ({crypto_tx['network']})"
-        }
-        
-        balance_result = supabase.table('transactions').insert(balance_transaction).execute()
+        try:
+            job_id = webhook_queue.enqueue("capitalist_deposit", json.dumps(request), ordering_key=payment_reference)
+        except Exception as queue_error:
+            print(f"⚠️ Webhook queue unavailable ({queue_error}), processing inline")
+            try:
+                return await process_capitalist_callback(request)
+            except Exception as e:
+                # Not applied: answer 500 so Capitalist retries the callback
+                raise HTTPException(status_code=500, detail=f"Webhook processing failed: {str(e)}")
         
-        if balance_result.data:
-            balance_tx_id = balance_result.data[0]['id']
-            
-            # Link crypto transaction to balance transaction
-            supabase.table('crypto_transactions')\
-                .update({'balance_transaction_id': balance_tx_id})\
-                .eq('id', transaction_id)\
-                .execute()
-        
-        # Update user balance
-        supabase.rpc('update_user_balance', {
-            'user_uuid': user_id,
-            'amount_change': amount
-        }).execute()
-        
-        # Create success notification
-        notification = {
-            'user_id': user_id,
-            'title': 'Crypto Deposit Confirmed! 🎉',
-            'message': f'Your {crypto_tx["currency"]} deposit of ${amount:.2f} has been confirmed and added to your balance.',
-            'type': 'success',
-            'is_read': False
-        }
-        
-        supabase.table('user_notifications').insert(notification).execute()
-        
-        return {
-            "success": True,
-            "transaction_id": transaction_id,
-            "user_id": user_id,
-            "amount": amount,
-            "currency": crypto_tx['currency'],
-            "message": "Deposit processed successfully"
-        }
+        return {"success": True, "job_id": job_id, "message": "Deposit callback queued for processing"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         return {"success": False, "detail": f"Webhook processing failed: {str(e)}"}
 
+async def process_capitalist_callback(request: dict) -> dict:
+    """Credit a confirmed Capitalist deposit; raises to be retried.
+    
+    Runs on the event loop as a queue handler, so every query is awaited.
+    Moving the deposit out of 'pending' is the claim: a redelivered callback
+    finds nothing pending and credits nothing.
+    """
+    # Import Supabase client with service role key
+    import sys
+    sys.path.append('/app/backend')
+    from supabase_client import supabase_admin as supabase
+    
+    if not supabase:
+        raise RuntimeError("Database connection not available")
+    
+    payment_reference = request.get('payment_reference') or request.get('reference')
+    amount = float(request.get('amount', 0))
+    transaction_hash = request.get('transaction_hash') or request.get('txn_hash')
+    status = request.get('status', 'confirmed')
+    
+    # Find the crypto transaction by reference
+    transaction_result = await supabase.table('crypto_transactions')\
+        .select('*')\
+        .eq('reference', payment_reference)\
+        .eq('transaction_type', 'deposit')\
+        .eq('status', 'pending')\
+        .execute_async()
+    if transaction_result.error:
+        raise RuntimeError(f"Failed to read deposit {payment_reference}: {transaction_result.error}")
+    
+    if not transaction_result.data:
+        return {"success": False, "detail": "Transaction not found or already processed"}
+    
+    crypto_tx = transaction_result.data[0]
+    user_id = crypto_tx['user_id']
+    transaction_id = crypto_tx['id']
+    
+    # Update crypto transaction with confirmation details (only while it is still pending)
+    confirm_result = await supabase.table('crypto_transactions')\
+        .update({
+            'amount': amount,
+            'transaction_hash': transaction_hash,
+            'status': 'confirmed',
+            'confirmations': 1,
+            'updated_at': 'now()'
+        })\
+        .eq('id', transaction_id)\
+        .eq('status', 'pending')\
+        .execute_async()
+    if confirm_result.error:
+        raise RuntimeError(f"Failed to confirm deposit {transaction_id}: {confirm_result.error}")
+    if not confirm_result.data:
+        return {"success": False, "detail": "Transaction not found or already processed"}
+    
+    async def undo(balance_tx_id=None):
+        # Back to pending so the retry credits the deposit
+        if balance_tx_id:
+            await supabase.table('transactions').delete(returning='minimal').eq('id', balance_tx_id).execute_async()
+        await supabase.table('crypto_transactions')\
+            .update({'status': 'pending', 'balance_transaction_id': None}, returning='minimal')\
+            .eq('id', transaction_id)\
+            .execute_async()
+    
+    # Create balance transaction (credit user account)
+    balance_transaction = {
+        'user_id': user_id,
+        'transaction_type': 'topup',
+        'amount': amount,
+        'platform_fee': 0.0,  # No fee on deposits
+        'net_amount': amount,
+        'status': 'completed',
+        'description': f"Crypto deposit: ${amount} from {crypto_tx['currency']} ({crypto_tx['network']})"
+    }
+    
+    balance_result = await supabase.table('transactions').insert(balance_transaction).execute_async()
+    if balance_result.error:
+        await undo()
+        raise RuntimeError(f"Failed to record deposit {transaction_id}: {balance_result.error}")
+    
+    balance_tx_id = balance_result.data[0]['id'] if balance_result.data else None
+    if balance_tx_id:
+        # Link crypto transaction to balance transaction
+        await supabase.table('crypto_transactions')\
+            .update({'balance_transaction_id': balance_tx_id}, returning='minimal')\
+            .eq('id', transaction_id)\
+            .execute_async()
+    
+    # Update user balance
+    balance_update = await supabase.rpc('update_user_balance', {
+        'user_uuid': user_id,
+        'amount_change': amount
+    }).execute_async()
+    invalidate_balance(user_id)
+    if balance_update.error or not (isinstance(balance_update.data, dict) and balance_update.data.get('success')):
+        await undo(balance_tx_id)
+        raise RuntimeError(f"Failed to credit deposit {transaction_id} to user {user_id}: {balance_update.error or balance_update.data}")
+    
+    # Create success notification (the balance is credited, so a failure here is not retried)
+    notification = {
+        'user_id': user_id,
+        'title': 'Crypto Deposit Confirmed! 🎉',
+        'message': f'Your {crypto_tx["currency"]} deposit of ${amount:.2f} has been confirmed and added to your balance.',
+        'type': 'success',
+        'is_read': False
+    }
+    
+    notification_result = await supabase.table('user_notifications').insert(notification, returning='minimal').execute_async()
+    if notification_result.error:
+        print(f"⚠️ Failed to notify user {user_id} of deposit {transaction_id}: {notification_result.error}")
+    
+    return {
+        "success": True,
+        "transaction_id": transaction_id,
+        "user_id": user_id,
+        "amount": amount,
+        "currency": crypto_tx['currency'],
+        "message": "Deposit processed successfully"
+    }
+
+async def apply_capitalist_callback(body: str) -> dict:
+    """Queue job for a Capitalist deposit callback body"""
+    return await process_capitalist_callback(json.loads(body))
+
+# Only registered when this module is imported; server.py does not mount crypto_simple,
+# so capitalist_deposit jobs are neither queued nor processed in the running API
+webhook_queue.register("capitalist_deposit", apply_capitalist_callback)
+
 @router.post("/crypto/deposit/manual-confirm")
 async def manual_confirm_deposit(
     deposit_reference: str,
@@ -349,6 +413,7 @@ async def manual_confirm_deposit(
             'user_uuid': user_id,
             'amount_change': amount
         }).execute()
+        invalidate_balance(user_id)
         
         # Create success notification
         notification = {
@@ -563,6 +628,7 @@ async def submit_withdrawal(request: WithdrawalRequest, user_id: str = "demo_use
             'user_uuid': user_id,
             'amount_change': -total_needed
         }).execute()
+        invalidate_balance(user_id)
         
         # Create notification for withdrawal initiation
         notification = {
@@ -11,27 +11,34 @@ import os
 sys.path.append('/app/backend')
 sys.path.append('/app/backend/services')
 from services.google_sheets_service import google_sheets_service
+from services.event_bus import event_bus, ProfileChanged, AccountDeleted, PurchaseCompleted, SubscriptionActivated
+from services.sync_scheduler import CoalescingScheduler
+from services.sheets_executor import sheets_executor
 from supabase_client import supabase_admin as supabase
 
 router = APIRouter()
 
+# Burst window for automatic users syncs: every trigger inside it shares one full sync
+SHEETS_SYNC_DEBOUNCE_SECONDS = float(os.getenv("SHEETS_SYNC_DEBOUNCE_SECONDS", 5.0))
+
 class MonthlyReportRequest(BaseModel):
     year: int
     month: int
 
 class SyncRequest(BaseModel):
     sync_type: str = "all"  # "all", "balance", "users"
+    full: bool = False  # rewrite whole sheets instead of pushing changed rows
 
 @router.post("/google-sheets/sync")
 async def sync_to_google_sheets(request: SyncRequest, background_tasks: BackgroundTasks):
     """Manually trigger Google Sheets sync"""
     try:
         if request.sync_type == "balance":
-            success = google_sheets_service.sync_company_balance()
+            success = await sheets_executor.run(google_sheets_service.sync_company_balance, full=request.full)
         elif request.sync_type == "users":
-            success = google_sheets_service.sync_users_data()
+            success = await sheets_executor.run(google_sheets_service.sync_users_data, full=request.full)
         elif request.sync_type == "all":
-            success = google_sheets_service.sync_all_data()
+            success = await sheets_executor.run(google_sheets_service.sync_all_data, full=request.full)
         else:
             raise HTTPException(status_code=400, detail="Invalid sync_type. Use 'all', 'balance', or 'users'")
         
@@ -59,7 +66,7 @@ async def generate_monthly_report(request: MonthlyReportRequest):
         
         if result.data:
             # Sync to Google Sheets
-            google_sheets_service.sync_company_balance()
+            await sheets_executor.run(google_sheets_service.sync_company_balance)
             
             return {
                 "success": True,
@@ -78,15 +85,15 @@ async def get_sync_status():
     """Get Google Sheets integration status"""
     try:
         # Test authentication
-        auth_success = google_sheets_service.authenticate()
+        auth_success = await sheets_executor.run(google_sheets_service.authenticate)
         
         # Get last sync timestamps from company balance
         balance_data = supabase.table('company_balance').select('last_updated').execute()
         last_balance_update = balance_data.data[0]['last_updated'] if balance_data.data else None
         
         # Get monthly reports count
-        monthly_reports = supabase.table('company_balance_monthly').select('id').execute()
-        reports_count = len(monthly_reports.data) if monthly_reports.data else 0
+        monthly_reports = await supabase.table('company_balance_monthly').select('id').count().execute_async()
+        reports_count = monthly_reports.count or 0
         
         return {
             "success": True,
@@ -95,7 +102,11 @@ async def get_sync_status():
             "users_sheet_id": google_sheets_service.users_sheet_id,
             "last_balance_update": last_balance_update,
             "monthly_reports_count": reports_count,
-            "service_account_email": os.getenv("GOOGLE_CLIENT_EMAIL", "service_account_not_configured")
+            "service_account_email": os.getenv("GOOGLE_CLIENT_EMAIL", "service_account_not_configured"),
+            "users_sync": users_sync_scheduler.status(),
+            "delta_sync": google_sheets_service.sync_status(),
+            "executor": sheets_executor.stats(),
+            "events": event_bus.stats()
         }
         
     except Exception as e:
@@ -130,8 +141,10 @@ async def get_company_summary():
         balance_data = supabase.table('company_balance').select('*').execute()
         
         # Get user statistics
-        users_count = supabase.table('auth.users').select('id').execute()
-        active_subs = supabase.table('subscriptions').select('id').eq('status', 'active').execute()
+        users_count, active_subs = await supabase.gather(
+            supabase.table('auth.users').select('id').count(),
+            supabase.table('subscriptions').select('id').eq('status', 'active').count()
+        )
         
         # Get commission totals
         commissions = supabase.table('commissions').select('amount, status').execute()
@@ -150,8 +163,8 @@ async def get_company_summary():
             "success": True,
             "current_balance": balance_data.data[0] if balance_data.data else {},
             "user_statistics": {
-                "total_users": len(users_count.data) if users_count.data else 0,
-                "active_subscribers": len(active_subs.data) if active_subs.data else 0
+                "total_users": users_count.count or 0,
+                "active_subscribers": active_subs.count or 0
             },
             "commission_statistics": {
                 "total_paid_commissions": total_commissions,
@@ -168,7 +181,7 @@ async def get_company_summary():
 async def sync_users_only():
     """Sync only users data to Google Sheets (bypassing balance sync issues)"""
     try:
-        success = google_sheets_service.sync_users_data()
+        success = await sheets_executor.run(google_sheets_service.sync_users_data)
         
         if success:
             return {
@@ -183,18 +196,19 @@ async def sync_users_only():
         raise HTTPException(status_code=500, detail=f"Sync error: {str(e)}")
 
 @router.post("/google-sheets/auto-sync-webhook")
-async def auto_sync_webhook(background_tasks: BackgroundTasks):
+async def auto_sync_webhook():
     """Webhook endpoint to automatically trigger users data sync"""
     try:
         print("🔄 Auto-sync webhook triggered")
         
-        # Run sync in background
-        background_tasks.add_task(trigger_users_sync)
+        # Coalesced with any other pending trigger
+        users_sync_scheduler.trigger("auto-sync-webhook")
         
         return {
             "success": True,
             "message": "Auto-sync triggered in background",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            "sync": users_sync_scheduler.status()
         }
         
     except Exception as e:
@@ -204,22 +218,26 @@ async def trigger_users_sync():
     """Background task to sync users data"""
     try:
         print("🔄 Running background users data sync...")
-        success = google_sheets_service.sync_users_data()
+        success = await sheets_executor.run(google_sheets_service.sync_users_data)
         
         if success:
             print("✅ Background users sync completed successfully")
         else:
             print("⚠️ Background users sync had failures")
+        return success
             
     except Exception as e:
         print(f"❌ Background users sync error: {str(e)}")
+        return False
+
+users_sync_scheduler = CoalescingScheduler("google_sheets_users", trigger_users_sync, SHEETS_SYNC_DEBOUNCE_SECONDS)
 
 @router.get("/google-sheets/trigger-sync")
 async def trigger_manual_sync(sync_type: str = "users"):
     """Manually trigger sync for testing"""
     try:
         if sync_type == "users":
-            success = google_sheets_service.sync_users_data()
+            success = await sheets_executor.run(google_sheets_service.sync_users_data)
             message = "users data"
         else:
             raise HTTPException(status_code=400, detail="Only 'users' sync type supported for now")
@@ -238,31 +256,22 @@ async def trigger_manual_sync(sync_type: str = "users"):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Manual sync error: {str(e)}")
 
-# Background task for automatic syncing
-async def schedule_auto_sync():
-    """Background task to automatically sync data every hour"""
-    try:
-        print("🔄 Running scheduled Google Sheets sync...")
-        success = google_sheets_service.sync_users_data()
-        
-        if success:
-            print("✅ Scheduled sync completed successfully")
-        else:
-            print("⚠️ Scheduled sync had some failures")
-            
-    except Exception as e:
-        print(f"❌ Scheduled sync error: {str(e)}")
+@event_bus.on(ProfileChanged, AccountDeleted, PurchaseCompleted, SubscriptionActivated)
+async def sync_users_on_event(event):
+    """Keep the users sheet current when profiles, purchases or subscriptions change"""
+    users_sync_scheduler.trigger(type(event).__name__)
 
 # Auto-sync trigger for webhook updates
 @router.post("/google-sheets/trigger-sync")
-async def trigger_auto_sync(background_tasks: BackgroundTasks):
+async def trigger_auto_sync():
     """Trigger automatic sync (called by webhooks or other events)"""
     try:
-        background_tasks.add_task(schedule_auto_sync)
+        users_sync_scheduler.trigger("trigger-sync")
         
         return {
             "success": True,
-            "message": "Auto-sync triggered in background"
+            "message": "Auto-sync triggered in background",
+            "sync": users_sync_scheduler.status()
         }
         
     except Exception as e:
@@ -11,10 +11,20 @@ import uuid
 import hashlib
 import hmac
 import json
+import asyncio
 import httpx
 import pyotp  # For TOTP 2FA code generation
 from datetime import datetime, timedelta
 
+from supabase_client import HISTORY_PAGE_MAX
+from services.subscription_cache import invalidate_subscription
+from services.balance_cache import get_cached_balance, set_cached_balance, invalidate_balance
+from services.event_bus import event_bus, SubscriptionActivated
+from services.nowpayments_auth import nowpayments_tokens
+from services.reference_cache import ReferenceDataCache
+from services.ipn_idempotency import ipn_idempotency
+from services.webhook_queue import webhook_queue
+
 router = APIRouter()
 
 # NowPayments API Configuration
@@ -24,6 +34,16 @@ NOWPAYMENTS_PUBLIC_KEY = os.getenv("NOWPAYMENTS_PUBLIC_KEY", "f56ecfa5-09db-45d0
 NOWPAYMENTS_IPN_SECRET = os.getenv("NOWPAYMENTS_IPN_SECRET", "")
 NOWPAYMENTS_2FA_SECRET = os.getenv("NOWPAYMENTS_2FA_SECRET")  # For TOTP 2FA automation
 
+# Reference data cache: (seconds fresh, further seconds a stale value is served while it refreshes)
+REFERENCE_DATA_TTLS = {
+    "currencies": (float(os.getenv("NOWPAYMENTS_CURRENCIES_TTL", 3600)), 86400),
+    "min_amount": (float(os.getenv("NOWPAYMENTS_MIN_AMOUNT_TTL", 600)), 3600),
+    "estimate": (float(os.getenv("NOWPAYMENTS_ESTIMATE_TTL", 30)), 120),
+    "withdrawal_min_amount": (float(os.getenv("NOWPAYMENTS_MIN_AMOUNT_TTL", 600)), 3600),
+    "withdrawal_fee": (float(os.getenv("NOWPAYMENTS_FEE_TTL", 120)), 600)
+}
+reference_cache = ReferenceDataCache()
+
 # Base URL for return URLs (will be configured in environment)
 BASE_URL = os.getenv("REACT_APP_BACKEND_URL", "https://ai-flow-invest.preview.emergentagent.com")
 
@@ -83,42 +103,8 @@ SUPPORTED_CURRENCIES = {
 }
 
 async def get_nowpayments_jwt_token():
-    """Get JWT token for NowPayments subscriptions API"""
-    try:
-        # Get credentials from environment variables
-        nowpayments_email = os.getenv("NOWPAYMENTS_EMAIL")
-        nowpayments_password = os.getenv("NOWPAYMENTS_PASSWORD")
-        
-        if not nowpayments_email or not nowpayments_password:
-            print(f"❌ NowPayments credentials missing:")
-            print(f"   NOWPAYMENTS_EMAIL: {'Present' if nowpayments_email else 'Missing'}")
-            print(f"   NOWPAYMENTS_PASSWORD: {'Present' if nowpayments_password else 'Missing'}")
-            return None
-        
-        auth_data = {
-            "email": nowpayments_email,
-            "password": nowpayments_password
-        }
-        
-        print(f"🔐 Authenticating with NowPayments using email: {nowpayments_email}")
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.nowpayments.io/v1/auth",
-                json=auth_data,
-                headers={"Content-Type": "application/json"}
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get("token")
-            else:
-                print(f"JWT auth failed: {response.status_code} - {response.text}")
-                return None
-                
-    except Exception as e:
-        print(f"JWT auth error: {str(e)}")
-        return None
+    """Get JWT token for NowPayments subscriptions API (cached and refreshed by nowpayments_tokens)"""
+    return await nowpayments_tokens.get_token()
 
 def get_nowpayments_headers_with_jwt(jwt_token=None):
     """Get headers for NowPayments API requests with JWT"""
@@ -155,6 +141,45 @@ async def make_nowpayments_request(method: str, endpoint: str, data: Optional[Di
         
         return response
 
+class NowPaymentsAPIError(Exception):
+    """NowPayments answered with a non-200 status"""
+    def __init__(self, status_code: int, detail: str = ""):
+        super().__init__(f"NowPayments returned {status_code}: {detail}")
+        self.status_code = status_code
+
+async def get_nowpayments_reference(kind: str, endpoint: str, params: Optional[Dict] = None):
+    """JSON from a NowPayments reference-data GET, served from reference_cache.
+
+    Raises NowPaymentsAPIError (non-200) or the transport error when there
+    is no usable cached value.
+    """
+    ttl, stale_ttl = REFERENCE_DATA_TTLS[kind]
+    key = (kind, endpoint, tuple(sorted((params or {}).items())))
+
+    async def load():
+        response = await make_nowpayments_request("GET", endpoint, params)
+        if response.status_code != 200:
+            raise NowPaymentsAPIError(response.status_code, response.text)
+        return response.json()
+
+    return await reference_cache.get(key, load, ttl, stale_ttl)
+
+async def warm_reference_cache():
+    """Preload currencies and the minimum amounts for every SUPPORTED_CURRENCIES network"""
+    if not NOWPAYMENTS_API_KEY:
+        print("⚠️ NOWPAYMENTS_API_KEY not set, skipping reference data warm-up")
+        return
+
+    codes = [code for config in SUPPORTED_CURRENCIES.values() for code in config["networks"].values()]
+    loads = [get_nowpayments_reference("currencies", "/currencies")]
+    for code in codes:
+        loads.append(get_nowpayments_reference("min_amount", "/min-amount", {"currency_from": "usd", "currency_to": code}))
+        loads.append(get_nowpayments_reference("withdrawal_min_amount", f"/payout-withdrawal/min-amount/{code}"))
+
+    results = await asyncio.gather(*loads, return_exceptions=True)
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    print(f"🔥 NowPayments reference data warmed: {len(results) - failed}/{len(results)} entries for {len(codes)} networks")
+
 @router.get("/nowpayments/health")
 async def nowpayments_health_check():
     """Health check for NowPayments integration"""
@@ -165,7 +190,12 @@ async def nowpayments_health_check():
                 "status": "healthy",
                 "nowpayments_status": response.json(),
                 "supported_currencies": list(SUPPORTED_CURRENCIES.keys()),
-                "api_connected": True
+                "api_connected": True,
+                "jwt": nowpayments_tokens.stats(),
+                "reference_cache": reference_cache.stats(),
+                "ipn_idempotency": ipn_idempotency.stats(),
+                "webhook_queue": webhook_queue.stats(),
+                "subscription_matching": subscription_match_stats
             }
         else:
             return {
@@ -183,14 +213,12 @@ async def nowpayments_health_check():
 async def get_supported_currencies():
     """Get supported cryptocurrencies and networks"""
     try:
-        # Get available currencies from NowPayments
-        response = await make_nowpayments_request("GET", "/currencies")
-        
-        if response.status_code != 200:
+        # Get available currencies from NowPayments (cached)
+        try:
+            available_currencies = (await get_nowpayments_reference("currencies", "/currencies")).get("currencies", [])
+        except NowPaymentsAPIError:
             raise HTTPException(status_code=500, detail="Failed to fetch currencies from NowPayments")
         
-        available_currencies = response.json().get("currencies", [])
-        
         # Filter and organize our supported currencies
         filtered_currencies = {}
         for currency, config in SUPPORTED_CURRENCIES.items():
@@ -225,12 +253,11 @@ async def get_minimum_amount(currency_from: str = "usd", currency_to: str = "usd
             "currency_to": currency_to
         }
         
-        response = await make_nowpayments_request("GET", "/min-amount", params)
-        
-        if response.status_code != 200:
+        try:
+            result = await get_nowpayments_reference("min_amount", "/min-amount", params)
+        except NowPaymentsAPIError:
             return {"success": False, "min_amount": 10.0}  # Default fallback
         
-        result = response.json()
         return {
             "success": True,
             "min_amount": result.get("min_amount", 10.0),
@@ -305,7 +332,7 @@ async def create_invoice(request: InvoiceRequest, user_id: str = Query(..., desc
         }
         
         # Insert into nowpayments_invoices table
-        result = supabase.table('nowpayments_invoices').insert(payment_record).execute()
+        result = await supabase.table('nowpayments_invoices').insert(payment_record).execute_async()
         
         if not result.data:
             raise HTTPException(status_code=500, detail="Failed to store payment record")
@@ -356,11 +383,11 @@ async def get_payment_status(payment_id: str, user_id: str = Query(..., descript
         if payment_data.get('payment_status') == 'finished':
             update_data['completed_at'] = 'now()'
         
-        supabase.table('nowpayments_invoices')\
+        await supabase.table('nowpayments_invoices')\
             .update(update_data)\
             .eq('invoice_id', payment_id)\
             .eq('user_id', user_id)\
-            .execute()
+            .execute_async()
         
         return {
             "success": True,
@@ -373,21 +400,72 @@ async def get_payment_status(payment_id: str, user_id: str = Query(..., descript
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get payment status: {str(e)}")
 
+def verify_nowpayments_signature(body: bytes, signature: Optional[str]) -> bool:
+    """Check x-nowpayments-sig against NOWPAYMENTS_IPN_SECRET.
+    
+    Accepts HMAC-SHA512 of the key-sorted JSON body (NowPayments' documented
+    method) or of the raw body, and HMAC-SHA256 of the raw body. True when no
+    IPN secret is configured; webhooks reject the request on False.
+    """
+    if not NOWPAYMENTS_IPN_SECRET:
+        print(f"⚠️ No IPN secret configured - skipping signature verification")
+        return True
+    if not signature:
+        print(f"❌ IPN secret is configured but no signature provided in webhook")
+        return False
+    
+    secret = NOWPAYMENTS_IPN_SECRET.encode('utf-8')
+    signed_bodies = [body]
+    try:
+        signed_bodies.insert(0, json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    except ValueError:
+        pass
+    
+    received = signature.strip().lower()
+    for signed_body in signed_bodies:
+        if hmac.compare_digest(hmac.new(secret, signed_body, hashlib.sha512).hexdigest(), received):
+            print(f"✅ Webhook signature verified successfully with SHA512")
+            return True
+    if hmac.compare_digest(hmac.new(secret, body, hashlib.sha256).hexdigest(), received):
+        print(f"✅ Webhook signature verified with SHA256 method")
+        return True
+    
+    print(f"❌ Invalid webhook signature ({len(body)} byte body), rejecting")
+    return False
+
+# Subscription payments are resolved from order_id "f01i-sub:<validation id>";
+# the amount heuristic only covers payments created without one.
+SUBSCRIPTION_ORDER_PREFIX = "f01i-sub:"
+subscription_match_stats = {"order_id": 0, "order_id_not_found": 0, "amount_fallback": 0}
+
+def encode_subscription_order_id(validation_id) -> str:
+    return f"{SUBSCRIPTION_ORDER_PREFIX}{validation_id}"
+
+def decode_subscription_order_id(order_id: Optional[str]) -> Optional[str]:
+    """The subscription_email_validation id encoded in order_id, if it is one of ours"""
+    if not order_id or not str(order_id).startswith(SUBSCRIPTION_ORDER_PREFIX):
+        return None
+    validation_id = str(order_id)[len(SUBSCRIPTION_ORDER_PREFIX):]
+    return validation_id if validation_id.replace('-', '').isalnum() else None
+
+def parse_ipn_amount(value) -> float:
+    """IPN amount as float; handles both "All-Strings" and "Classic way" webhook formats"""
+    return float(value) if value else 0
+
 @router.post("/nowpayments/webhook")
 async def nowpayments_webhook(request: Request):
     """Handle NowPayments IPN webhooks with proper signature verification"""
     try:
-        import sys
-        sys.path.append('/app/backend')
-        from supabase_client import supabase_admin as supabase
-        
         # Get request body and headers
         body = await request.body()
         signature = request.headers.get("x-nowpayments-sig")
         
         print(f"🔔 Received webhook - Signature: {signature[:20]}..." if signature else "🔔 Received webhook - NO SIGNATURE")
         
-        # Parse JSON data first
+        # Verify IPN signature before anything is queued or applied
+        if not verify_nowpayments_signature(body, signature):
+            raise HTTPException(status_code=401, detail="Invalid webhook signature")
+        
         webhook_data = json.loads(body.decode())
         
         # Handle both "All-Strings" and "Classic way" webhook formats
@@ -396,55 +474,10 @@ async def nowpayments_webhook(request: Request):
         order_id = webhook_data.get('order_id')
         customer_email = webhook_data.get('customer_email') or webhook_data.get('email')
         
-        # Handle amount as string (All-Strings format) or number (Classic format)
-        actually_paid_raw = webhook_data.get('actually_paid', 0)
-        if isinstance(actually_paid_raw, str):
-            actually_paid = float(actually_paid_raw) if actually_paid_raw else 0
-        else:
-            actually_paid = float(actually_paid_raw) if actually_paid_raw else 0
+        actually_paid = parse_ipn_amount(webhook_data.get('actually_paid', 0))
         
         print(f"📊 Webhook data: payment_id={payment_id}, status={payment_status}, email={customer_email}, amount=${actually_paid}")
         
-        # Verify IPN signature if secret is available
-        if NOWPAYMENTS_IPN_SECRET and signature:
-            try:
-                # NowPayments signature verification method
-                # The signature should be calculated as HMAC-SHA512 of the entire raw body
-                expected_signature = hmac.new(
-                    NOWPAYMENTS_IPN_SECRET.encode('utf-8'),
-                    body,
-                    hashlib.sha512  # Use SHA512, not SHA256
-                ).hexdigest()
-                
-                if signature != expected_signature:
-                    print(f"❌ Invalid webhook signature.")
-                    print(f"   Expected (SHA512): {expected_signature}")
-                    print(f"   Received: {signature}")
-                    print(f"   Body length: {len(body)} bytes")
-                    print(f"   IPN Secret configured: {'Yes' if NOWPAYMENTS_IPN_SECRET else 'No'}")
-                    
-                    # Try alternative signature methods for compatibility
-                    expected_sha256 = hmac.new(
-                        NOWPAYMENTS_IPN_SECRET.encode('utf-8'),
-                        body,
-                        hashlib.sha256
-                    ).hexdigest()
-                    
-                    if signature == expected_sha256:
-                        print(f"✅ Webhook signature verified with SHA256 method")
-                    else:
-                        print(f"   Also tried SHA256: {expected_sha256}")
-                        print(f"⚠️ Continuing webhook processing despite signature mismatch for debugging")
-                else:
-                    print(f"✅ Webhook signature verified successfully with SHA512")
-            except Exception as sig_error:
-                print(f"⚠️ Signature verification error: {sig_error}")
-                print(f"⚠️ Continuing webhook processing for debugging")
-        elif NOWPAYMENTS_IPN_SECRET:
-            print(f"⚠️ IPN secret is configured but no signature provided in webhook")
-        else:
-            print(f"⚠️ No IPN secret configured - skipping signature verification")
-            
         # Log all webhook data for debugging
         print(f"🔍 COMPLETE WEBHOOK DATA:")
         print(f"   Payment ID: {payment_id}")
@@ -459,68 +492,277 @@ async def nowpayments_webhook(request: Request):
         
         print(f"🔔 Processing webhook for payment_id: {payment_id}, status: {payment_status}, email: {customer_email}, amount: ${actually_paid}")
         
-        # For subscription payments, we need to handle the case where email is None
-        # Look for subscription payments by amount range and check if it's a subscription
-        is_subscription_payment = False
+        # Already applied by this process: answer without queueing
+        if ipn_idempotency.seen(payment_id, payment_status):
+            print(f"♻️ Duplicate IPN for payment_id {payment_id} ({payment_status}), skipping")
+            return {"success": True, "message": "Duplicate webhook ignored", "duplicate": True}
+        
+        # Acknowledge now, apply from the durable queue (in payment_id order)
+        try:
+            job_id = webhook_queue.enqueue("nowpayments_ipn", body, ordering_key=payment_id)
+        except Exception as queue_error:
+            print(f"⚠️ Webhook queue unavailable ({queue_error}), processing inline")
+            return await apply_inline(apply_nowpayments_ipn, body.decode())
+        
+        print(f"📥 IPN for payment_id {payment_id} queued as job {job_id}")
+        return {"success": True, "message": "Webhook queued for processing", "job_id": job_id}
         
-        # Method 1: Check by amount (subscription payments are usually $9-15)
-        if actually_paid >= 9.0 and actually_paid <= 15.0 and payment_status == 'finished':
-            print(f"💡 Detected potential subscription payment by amount: ${actually_paid}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Log error but return success to avoid webhook retries
+        print(f"❌ Webhook processing error: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+async def apply_inline(handler, body: str) -> Dict[str, Any]:
+    """Run a queue handler in the request when the queue is unavailable; a failure answers 500 so the provider retries"""
+    try:
+        return await handler(body)
+    except Exception as e:
+        print(f"❌ Inline webhook processing failed: {e}")
+        raise HTTPException(status_code=500, detail="Webhook processing failed, please retry")
+
+async def apply_nowpayments_ipn(body: str) -> Dict[str, Any]:
+    """Queue job: apply an IPN once per (payment_id, payment_status); raises to be retried"""
+    webhook_data = json.loads(body)
+    ipn_key = (webhook_data.get('payment_id'), webhook_data.get('payment_status'))
+    
+    duplicate = await ipn_idempotency.claim(*ipn_key)
+    if duplicate:
+        print(f"♻️ Duplicate IPN for payment_id {ipn_key[0]} ({ipn_key[1]}) caught in {duplicate}, skipping")
+        return {"success": True, "message": "Duplicate webhook ignored", "duplicate": True}
+    
+    try:
+        result = await process_nowpayments_ipn(webhook_data)
+    except Exception:
+        # Let the retry process this IPN again
+        await ipn_idempotency.release(*ipn_key)
+        raise
+    
+    # Only reached once every write succeeded (process_nowpayments_ipn raises otherwise)
+    await ipn_idempotency.complete(*ipn_key)
+    return result
+
+async def process_nowpayments_ipn(webhook_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply one NowPayments payment IPN: subscription upgrade or invoice top-up.
+    
+    Raises RuntimeError when a database read or write fails, so the claim is
+    released and the queue retries the IPN instead of recording it as done.
+    """
+    from supabase_client import supabase_admin as supabase
+    
+    payment_id = webhook_data.get('payment_id')
+    payment_status = webhook_data.get('payment_status')
+    order_id = webhook_data.get('order_id')
+    customer_email = webhook_data.get('customer_email') or webhook_data.get('email')
+    actually_paid = parse_ipn_amount(webhook_data.get('actually_paid', 0))
+    
+    # For subscription payments, we need to handle the case where email is None
+    is_subscription_payment = False
+    best_match = None
+    
+    # Method 1: subscriptions are created with an order_id naming their validation record
+    validation_id = decode_subscription_order_id(order_id)
+    if validation_id and payment_status == 'finished':
+        validation_result = await supabase.table('subscription_email_validation')\
+            .select('*')\
+            .eq('id', validation_id)\
+            .limit(1)\
+            .execute_async()
+        if validation_result.error:
+            raise RuntimeError(f"Failed to read subscription validation {validation_id}: {validation_result.error}")
+        
+        if validation_result.data:
+            best_match = validation_result.data[0]
+            subscription_match_stats['order_id'] += 1
+            print(f"🎯 Matched subscription payment to validation record {validation_id} via order_id")
+        else:
+            subscription_match_stats['order_id_not_found'] += 1
+            print(f"⚠️ order_id {order_id} names unknown validation record {validation_id}")
+    
+    # Method 2 (fallback): pending validation records near this amount (subscription payments are usually $9-15)
+    if best_match is None and actually_paid >= 9.0 and actually_paid <= 15.0 and payment_status == 'finished':
+        print(f"💡 Detected potential subscription payment by amount: ${actually_paid}")
+        
+        validation_result = await supabase.table('subscription_email_validation')\
+            .select('*')\
+            .eq('status', 'pending')\
+            .gte('amount', actually_paid - 1.0)\
+            .lte('amount', actually_paid + 1.0)\
+            .order('created_at', desc=True)\
+            .limit(5)\
+            .execute_async()
+        if validation_result.error:
+            raise RuntimeError(f"Failed to read pending subscription validations: {validation_result.error}")
+        
+        if validation_result.data:
+            print(f"🎯 Found {len(validation_result.data)} potential matching subscription validation records")
+            
+            # Find the best match (closest amount and most recent)
+            min_amount_diff = float('inf')
+            
+            for validation_record in validation_result.data:
+                amount_diff = abs(float(validation_record.get('amount', 0)) - actually_paid)
+                if amount_diff < min_amount_diff:
+                    min_amount_diff = amount_diff
+                    best_match = validation_record
+            
+            if best_match:
+                subscription_match_stats['amount_fallback'] += 1
+                print(f"⚠️ Subscription payment matched by amount (diff ${min_amount_diff:.2f}), not order_id")
+    
+    if best_match:
+        user_id = best_match['user_id']
+        customer_email = best_match['email']  # Get email from validation record
+        plan_type = best_match['plan_type']
+        
+        print(f"✅ Best match found: user {user_id}, email: {customer_email}")
+        
+        is_subscription_payment = True
+        
+        # Update validation record to completed
+        validation_update = await supabase.table('subscription_email_validation')\
+            .update({
+                'status': 'completed',
+                'nowpayments_payment_id': str(payment_id),
+                'actual_amount_paid': actually_paid,
+                'updated_at': 'now()'
+            }, returning='minimal')\
+            .eq('id', best_match['id'])\
+            .execute_async()
+        if validation_update.error:
+            raise RuntimeError(f"Failed to complete subscription validation {best_match['id']}: {validation_update.error}")
+        
+        print(f"✅ Validation record updated with payment ID {payment_id}")
+    
+    # Process subscription upgrade if we identified this as a subscription payment
+    if is_subscription_payment and customer_email:
+        print(f"💡 Processing as subscription payment for {customer_email}")
+        
+        from datetime import datetime, timedelta
+        end_date = datetime.utcnow() + timedelta(days=31)
+        
+        plus_plan_limits = {
+            'ai_bots': 3,
+            'manual_bots': 5, 
+            'marketplace_products': 10
+        }
+        
+        subscription_data = {
+            'plan_type': 'plus',
+            'status': 'active',
+            'start_date': datetime.utcnow().isoformat(),
+            'end_date': end_date.isoformat(),
+            'renewal': True,
+            'price_paid': actually_paid,
+            'currency': 'USD',
+            'limits': plus_plan_limits,
+            'metadata': {
+                'payment_method': 'crypto', 
+                'nowpayments_payment_id': str(payment_id), 
+                'email_validated': True,
+                'webhook_processed': True
+            },
+            'updated_at': datetime.utcnow().isoformat()
+        }
+        
+        # Single INSERT ... ON CONFLICT (user_id) with ADMIN CLIENT to bypass RLS.
+        # created_at is left out so an existing row keeps it and a new row gets the default.
+        subscription_data['user_id'] = user_id
+        result = await supabase.table('subscriptions')\
+            .upsert(subscription_data, on_conflict='user_id', returning='minimal')\
+            .execute_async()
+        
+        invalidate_subscription(user_id)
+        if result.error:
+            raise RuntimeError(f"Failed to upsert subscription for user {user_id}: {result.error}")
+        print(f"✅ Upserted subscription for user {user_id} to Plus plan")
+        
+        # Create success notification
+        notification = {
+            'user_id': user_id,
+            'title': '🎉 Subscription Upgraded to Plus!',
+            'message': f'Your crypto payment of ${actually_paid:.2f} has been confirmed and your subscription has been upgraded to Plus Plan. Enjoy your new features!',
+            'type': 'success',
+            'is_read': False
+        }
+        
+        notification_result = await supabase.table('user_notifications').insert(notification, returning='minimal').execute_async()
+        if notification_result.error:
+            raise RuntimeError(f"Failed to notify user {user_id} of the upgrade: {notification_result.error}")
+        
+        # Update company balance (last write: a retry after it would count the revenue twice)
+        print(f"💰 Adding ${actually_paid:.2f} subscription revenue to company balance")
+        company_update = await supabase.rpc('update_company_balance_subscription', {
+            'subscription_revenue': actually_paid
+        }).execute_async()
+        if company_update.error:
+            raise RuntimeError(f"Failed to add subscription revenue to company balance: {company_update.error}")
+        print(f"✅ Company balance updated with subscription revenue: ${actually_paid:.2f}")
+        
+        event_bus.publish(SubscriptionActivated(
+            user_id=user_id, plan_type='plus', payment_id=str(payment_id), amount=actually_paid
+        ))
+        
+        return {"success": True, "message": "Subscription webhook processed successfully"}
+        
+    # For subscription payments, use email validation approach
+    # Check if this is a subscription payment (amount around $10 and has customer email)
+    elif customer_email and actually_paid >= 9.0 and actually_paid <= 15.0 and payment_status == 'finished':
+        print(f"💡 Processing as subscription payment via email validation")
+        
+        # Find matching email validation record (ANY status to handle retries)
+        validation_result = await supabase.table('subscription_email_validation')\
+            .select('*')\
+            .eq('email', customer_email)\
+            .order('created_at', desc=True)\
+            .limit(1)\
+            .execute_async()
+        if validation_result.error:
+            raise RuntimeError(f"Failed to read subscription validation for {customer_email}: {validation_result.error}")
+        
+        if validation_result.data:
+            validation_record = validation_result.data[0]
+            user_id = validation_record['user_id']
+            plan_type = validation_record['plan_type']
+            current_status = validation_record['status']
+            
+            print(f"✅ Found email validation record for user {user_id}, plan: {plan_type}, current_status: {current_status}")
+            
+            # Always update validation record with webhook payment data
+            validation_update = await supabase.table('subscription_email_validation')\
+                .update({
+                    'status': 'completed',
+                    'nowpayments_payment_id': str(payment_id),
+                    'actual_amount_paid': actually_paid,
+                    'updated_at': 'now()'
+                }, returning='minimal')\
+                .eq('id', validation_record['id'])\
+                .execute_async()
+            if validation_update.error:
+                raise RuntimeError(f"Failed to complete subscription validation {validation_record['id']}: {validation_update.error}")
+            
+            print(f"✅ Validation record updated with payment ID {payment_id}")
             
-            # Method 2: Look for recent subscription validation records for this amount
-            validation_result = supabase.table('subscription_email_validation')\
+            # Check if user already has an active subscription to avoid duplicates
+            existing_active_sub = await supabase.table('subscriptions')\
                 .select('*')\
-                .eq('status', 'pending')\
-                .gte('amount', actually_paid - 1.0)\
-                .lte('amount', actually_paid + 1.0)\
-                .order('created_at', desc=True)\
-                .limit(5)\
-                .execute()
-            
-            if validation_result.data:
-                print(f"🎯 Found {len(validation_result.data)} potential matching subscription validation records")
-                
-                # Find the best match (closest amount and most recent)
-                best_match = None
-                min_amount_diff = float('inf')
-                
-                for validation_record in validation_result.data:
-                    amount_diff = abs(float(validation_record.get('amount', 0)) - actually_paid)
-                    if amount_diff < min_amount_diff:
-                        min_amount_diff = amount_diff
-                        best_match = validation_record
-                
-                if best_match:
-                    user_id = best_match['user_id']
-                    customer_email = best_match['email']  # Get email from validation record
-                    plan_type = best_match['plan_type']
-                    
-                    print(f"✅ Best match found: user {user_id}, email: {customer_email}, amount diff: ${min_amount_diff:.2f}")
-                    
-                    is_subscription_payment = True
-                    
-                    # Update validation record to completed
-                    supabase.table('subscription_email_validation')\
-                        .update({
-                            'status': 'completed',
-                            'nowpayments_payment_id': str(payment_id),
-                            'actual_amount_paid': actually_paid,
-                            'updated_at': 'now()'
-                        })\
-                        .eq('id', best_match['id'])\
-                        .execute()
-                    
-                    print(f"✅ Validation record updated with payment ID {payment_id}")
-        
-        # Process subscription upgrade if we identified this as a subscription payment
-        if is_subscription_payment and customer_email:
-            print(f"💡 Processing as subscription payment for {customer_email}")
-            
-            # ALWAYS update existing subscription - never try to insert
-            # This avoids the unique constraint error
+                .eq('user_id', user_id)\
+                .eq('status', 'active')\
+                .eq('plan_type', 'plus')\
+                .execute_async()
+            
+            if existing_active_sub.data:
+                print(f"ℹ️ User {user_id} already has an active Plus subscription, skipping upgrade")
+                return {"success": True, "message": "User already has active subscription"}
+            
+            # Process subscription upgrade
             from datetime import datetime, timedelta
+            
+            # Calculate subscription end date (31 days from now)
             end_date = datetime.utcnow() + timedelta(days=31)
             
+            # Define proper Plus plan limits
             plus_plan_limits = {
                 'ai_bots': 3,
                 'manual_bots': 5, 
@@ -528,6 +770,7 @@ async def nowpayments_webhook(request: Request):
             }
             
             subscription_data = {
+                'user_id': user_id,
                 'plan_type': 'plus',
                 'status': 'active',
                 'start_date': datetime.utcnow().isoformat(),
@@ -545,311 +788,168 @@ async def nowpayments_webhook(request: Request):
                 'updated_at': datetime.utcnow().isoformat()
             }
             
-            # ALWAYS use UPDATE with ADMIN CLIENT to bypass RLS - this handles both existing subscriptions and creates if none exist
-            result = supabase.table('subscriptions')\
-                .update(subscription_data)\
-                .eq('user_id', user_id)\
-                .execute()
+            # Single INSERT ... ON CONFLICT (user_id): an existing row (any status) keeps its created_at
+            result = await supabase.table('subscriptions')\
+                .upsert(subscription_data, on_conflict='user_id', returning='minimal')\
+                .execute_async()
             
-            if result.data:
-                print(f"✅ Updated subscription for user {user_id} to Plus plan")
-            else:
-                print(f"⚠️ No existing subscription found, creating new one...")
-                # If update didn't work (no existing record), create new one
-                subscription_data['user_id'] = user_id
-                subscription_data['created_at'] = datetime.utcnow().isoformat()
-                
-                try:
-                    result = supabase.table('subscriptions')\
-                        .insert(subscription_data)\
-                        .execute()
-                    print(f"➕ Created new subscription for user {user_id}")
-                except Exception as insert_error:
-                    print(f"❌ Failed to create subscription: {insert_error}")
-                    # Try one more update in case of race condition
-                    result = supabase.table('subscriptions')\
-                        .update(subscription_data)\
-                        .eq('user_id', user_id)\
-                        .execute()
-                    print(f"🔄 Retry update result: {len(result.data) if result.data else 0} records updated")
+            invalidate_subscription(user_id)
+            
+            if result.error:
+                raise RuntimeError(f"Failed to upsert subscription for user {user_id}: {result.error}")
+            print(f"✅ Email-validated subscription upgrade completed for user {user_id}")
+            
+            # Update NowPayments subscription record if exists
+            nowpayments_sub_update = await supabase.table('nowpayments_subscriptions')\
+                .update({
+                    'status': 'PAID',
+                    'is_active': True,
+                    'updated_at': 'now()'
+                }, returning='minimal')\
+                .eq('user_id', user_id)\
+                .eq('user_email', customer_email)\
+                .execute_async()
+            if nowpayments_sub_update.error:
+                raise RuntimeError(f"Failed to mark NowPayments subscription paid for user {user_id}: {nowpayments_sub_update.error}")
             
             # Create success notification
             notification = {
                 'user_id': user_id,
                 'title': '🎉 Subscription Upgraded to Plus!',
-                'message': f'Your crypto payment of ${actually_paid:.2f} has been confirmed and your subscription has been upgraded to Plus Plan. Enjoy your new features!',
+                'message': f'Your crypto payment of ${actually_paid:.2f} has been confirmed and your subscription has been upgraded to Plus Plan. Enjoy your new features including 3 AI bots, 5 manual bots, and up to 10 marketplace products! Valid until {end_date.strftime("%B %d, %Y")}',
                 'type': 'success',
                 'is_read': False
             }
             
-            supabase.table('user_notifications').insert(notification).execute()
+            notification_result = await supabase.table('user_notifications').insert(notification, returning='minimal').execute_async()
+            if notification_result.error:
+                raise RuntimeError(f"Failed to notify user {user_id} of the upgrade: {notification_result.error}")
             
-            # Update company balance
+            # UPDATE COMPANY BALANCE - Add subscription revenue (last write: a retry after it would count the revenue twice)
             print(f"💰 Adding ${actually_paid:.2f} subscription revenue to company balance")
-            try:
-                company_update = supabase.rpc('update_company_balance_subscription', {
-                    'subscription_revenue': actually_paid
-                }).execute()
-                
-                if company_update.data:
-                    print(f"✅ Company balance updated with subscription revenue: ${actually_paid:.2f}")
-            except Exception as balance_error:
-                print(f"❌ Error updating company balance: {balance_error}")
-            
-            # Trigger Google Sheets sync
-            try:
-                import httpx
-                async with httpx.AsyncClient() as client:
-                    await client.post(f"{BASE_URL}/api/google-sheets/trigger-sync")
-                print(f"✅ Google Sheets sync triggered")
-            except Exception as sync_error:
-                print(f"⚠️ Google Sheets sync trigger failed: {sync_error}")
-            
-            return {"success": True, "message": "Subscription webhook processed successfully"}
-            
-        # For subscription payments, use email validation approach
-        # Check if this is a subscription payment (amount around $10 and has customer email)
-        elif customer_email and actually_paid >= 9.0 and actually_paid <= 15.0 and payment_status == 'finished':
-            print(f"💡 Processing as subscription payment via email validation")
-            
-            # Find matching email validation record (ANY status to handle retries)
-            validation_result = supabase.table('subscription_email_validation')\
-                .select('*')\
-                .eq('email', customer_email)\
-                .order('created_at', desc=True)\
-                .limit(1)\
-                .execute()
-            
-            if validation_result.data:
-                validation_record = validation_result.data[0]
-                user_id = validation_record['user_id']
-                plan_type = validation_record['plan_type']
-                current_status = validation_record['status']
-                
-                print(f"✅ Found email validation record for user {user_id}, plan: {plan_type}, current_status: {current_status}")
+            company_update = await supabase.rpc('update_company_balance_subscription', {
+                'subscription_revenue': actually_paid
+            }).execute_async()
+            
+            if not company_update.error:
+                print(f"✅ Company balance updated with subscription revenue: ${actually_paid:.2f}")
+            else:
+                print(f"⚠️ Company balance update failed, will try direct update")
                 
-                # Always update validation record with webhook payment data
-                supabase.table('subscription_email_validation')\
+                # Fallback: Direct update to company_balance table
+                current_balance = await supabase.table('company_balance').select('company_funds').execute_async()
+                if current_balance.error or not current_balance.data:
+                    raise RuntimeError(f"Failed to add subscription revenue to company balance: {company_update.error}")
+                current_funds = float(current_balance.data[0]['company_funds'])
+                direct_update = await supabase.table('company_balance')\
                     .update({
-                        'status': 'completed',
-                        'nowpayments_payment_id': str(payment_id),
-                        'actual_amount_paid': actually_paid,
-                        'updated_at': 'now()'
-                    })\
-                    .eq('id', validation_record['id'])\
-                    .execute()
-                
-                print(f"✅ Validation record updated with payment ID {payment_id}")
-                
-                # Check if user already has an active subscription to avoid duplicates
-                existing_active_sub = supabase.table('subscriptions')\
-                    .select('*')\
-                    .eq('user_id', user_id)\
-                    .eq('status', 'active')\
-                    .eq('plan_type', 'plus')\
-                    .execute()
-                
-                if existing_active_sub.data:
-                    print(f"ℹ️ User {user_id} already has an active Plus subscription, skipping upgrade")
-                    return {"success": True, "message": "User already has active subscription"}
-                
-                # Process subscription upgrade
-                from datetime import datetime, timedelta
-                
-                # Calculate subscription end date (31 days from now)
-                end_date = datetime.utcnow() + timedelta(days=31)
-                
-                # Define proper Plus plan limits
-                plus_plan_limits = {
-                    'ai_bots': 3,
-                    'manual_bots': 5, 
-                    'marketplace_products': 10
-                }
+                        'company_funds': current_funds + actually_paid,
+                        'last_updated': 'now()'
+                    }, returning='minimal')\
+                    .eq('id', '00000000-0000-0000-0000-000000000001')\
+                    .execute_async()
+                if direct_update.error:
+                    raise RuntimeError(f"Failed to add subscription revenue to company balance: {direct_update.error}")
                 
-                # Check if user has ANY subscription record (active, cancelled, etc.)
-                existing_sub = supabase.table('subscriptions').select('*').eq('user_id', user_id).execute()
-                
-                subscription_data = {
-                    'user_id': user_id,
-                    'plan_type': 'plus',
-                    'status': 'active',
-                    'start_date': datetime.utcnow().isoformat(),
-                    'end_date': end_date.isoformat(),
-                    'renewal': True,
-                    'price_paid': actually_paid,
-                    'currency': 'USD',
-                    'limits': plus_plan_limits,
-                    'metadata': {
-                        'payment_method': 'crypto', 
-                        'nowpayments_payment_id': str(payment_id), 
-                        'email_validated': True,
-                        'webhook_processed': True
-                    },
-                    'updated_at': datetime.utcnow().isoformat()
-                }
-                
-                if existing_sub.data:
-                    # Update existing subscription
-                    result = supabase.table('subscriptions')\
-                        .update(subscription_data)\
-                        .eq('user_id', user_id)\
-                        .execute()
-                    print(f"📝 Updated existing subscription for user {user_id}")
-                else:
-                    # Create new subscription
-                    subscription_data['created_at'] = datetime.utcnow().isoformat()
-                    result = supabase.table('subscriptions')\
-                        .insert(subscription_data)\
-                        .execute()
-                    print(f"➕ Created new subscription for user {user_id}")
+                print(f"✅ Company balance updated directly with subscription revenue: ${actually_paid:.2f}")
+            
+            event_bus.publish(SubscriptionActivated(
+                user_id=user_id, plan_type='plus', payment_id=str(payment_id), amount=actually_paid
+            ))
+            
+            return {"success": True, "message": "Subscription webhook processed successfully via email validation"}
                 
-                if result.data:
-                    print(f"✅ Email-validated subscription upgrade completed for user {user_id}")
-                    
-                    # Update NowPayments subscription record if exists
-                    supabase.table('nowpayments_subscriptions')\
-                        .update({
-                            'status': 'PAID',
-                            'is_active': True,
-                            'updated_at': 'now()'
-                        })\
-                        .eq('user_id', user_id)\
-                        .eq('user_email', customer_email)\
-                        .execute()
-                    
-                    # Create success notification
-                    notification = {
-                        'user_id': user_id,
-                        'title': '🎉 Subscription Upgraded to Plus!',
-                        'message': f'Your crypto payment of ${actually_paid:.2f} has been confirmed and your subscription has been upgraded to Plus Plan. Enjoy your new features including 3 AI bots, 5 manual bots, and up to 10 marketplace products! Valid until {end_date.strftime("%B %d, %Y")}',
-                        'type': 'success',
-                        'is_read': False
-                    }
-                    
-                    supabase.table('user_notifications').insert(notification).execute()
-                    
-                    # UPDATE COMPANY BALANCE - Add subscription revenue
-                    print(f"💰 Adding ${actually_paid:.2f} subscription revenue to company balance")
-                    try:
-                        # Update company balance with subscription revenue
-                        company_update = supabase.rpc('update_company_balance_subscription', {
-                            'subscription_revenue': actually_paid
-                        }).execute()
-                        
-                        if company_update.data:
-                            print(f"✅ Company balance updated with subscription revenue: ${actually_paid:.2f}")
-                        else:
-                            print(f"⚠️ Company balance update failed, will try direct update")
-                            
-                            # Fallback: Direct update to company_balance table
-                            current_balance = supabase.table('company_balance').select('company_funds').execute()
-                            if current_balance.data:
-                                current_funds = float(current_balance.data[0]['company_funds'])
-                                supabase.table('company_balance')\
-                                    .update({
-                                        'company_funds': current_funds + actually_paid,
-                                        'last_updated': 'now()'
-                                    })\
-                                    .eq('id', '00000000-0000-0000-0000-000000000001')\
-                                    .execute()
-                                
-                                print(f"✅ Company balance updated directly with subscription revenue: ${actually_paid:.2f}")
-                            
-                    except Exception as balance_error:
-                        print(f"❌ Error updating company balance: {balance_error}")
-                    
-                    # TRIGGER GOOGLE SHEETS SYNC
-                    try:
-                        import httpx
-                        async with httpx.AsyncClient() as client:
-                            await client.post(f"{BASE_URL}/api/google-sheets/trigger-sync")
-                        print(f"✅ Google Sheets sync triggered")
-                    except Exception as sync_error:
-                        print(f"⚠️ Google Sheets sync trigger failed: {sync_error}")
-                    
-                    return {"success": True, "message": "Subscription webhook processed successfully via email validation"}
-                else:
-                    print(f"❌ Failed to upgrade subscription for user {user_id}")
-                    
-            else:
-                print(f"⚠️ No email validation record found for {customer_email}")
-                print(f"   This might be a regular invoice payment, not a subscription")
-        
-        # For regular invoice payments (balance top-ups) or non-subscription payments
         else:
-            print(f"💰 Processing as invoice payment or balance top-up")
-            
-            # Extract the correct invoice_id from webhook data
-            invoice_id = webhook_data.get('invoice_id')
+            print(f"⚠️ No email validation record found for {customer_email}")
+            print(f"   This might be a regular invoice payment, not a subscription")
+    
+    # For regular invoice payments (balance top-ups) or non-subscription payments
+    else:
+        print(f"💰 Processing as invoice payment or balance top-up")
+        
+        # Extract the correct invoice_id from webhook data
+        invoice_id = webhook_data.get('invoice_id')
+        
+        if not invoice_id:
+            print(f"⚠️ No invoice_id found in webhook data, trying payment_id as fallback")
+            invoice_id = payment_id
+        
+        print(f"🔍 Looking for invoice record with invoice_id: {invoice_id}")
+        
+        # Update invoice record if exists - use the correct invoice_id
+        result = await supabase.table('nowpayments_invoices')\
+            .update({
+                'payment_status': payment_status,
+                'actually_paid': actually_paid,
+                'pay_currency': webhook_data.get('pay_currency'),
+                'updated_at': 'now()',
+                'webhook_data': webhook_data,
+                'completed_at': 'now()' if payment_status == 'finished' else None
+            })\
+            .eq('invoice_id', str(invoice_id))\
+            .execute_async()
+        if result.error:
+            raise RuntimeError(f"Failed to update invoice {invoice_id}: {result.error}")
+        
+        print(f"📊 Invoice update result: {len(result.data) if result.data else 0} records updated")
+        
+        if result.data and payment_status == 'finished':
+            invoice = result.data[0]
+            user_id = invoice['user_id']
+            amount = float(actually_paid)
             
-            if not invoice_id:
-                print(f"⚠️ No invoice_id found in webhook data, trying payment_id as fallback")
-                invoice_id = payment_id
+            print(f"💰 Processing balance top-up for user {user_id}, amount: ${amount}")
             
-            print(f"🔍 Looking for invoice record with invoice_id: {invoice_id}")
+            # Create balance transaction
+            balance_transaction = {
+                'user_id': user_id,
+                'transaction_type': 'topup',
+                'amount': amount,
+                'platform_fee': 0.0,
+                'net_amount': amount,
+                'status': 'completed',
+                'description': f"Crypto payment: ${amount} via NowPayments (Order: {order_id})"
+            }
             
-            # Update invoice record if exists - use the correct invoice_id
-            result = supabase.table('nowpayments_invoices')\
-                .update({
-                    'payment_status': payment_status,
-                    'actually_paid': actually_paid,
-                    'pay_currency': webhook_data.get('pay_currency'),
-                    'updated_at': 'now()',
-                    'webhook_data': webhook_data,
-                    'completed_at': 'now()' if payment_status == 'finished' else None
-                })\
-                .eq('invoice_id', str(invoice_id))\
-                .execute()
+            transaction_result = await supabase.table('transactions').insert(balance_transaction).execute_async()
+            if transaction_result.error:
+                raise RuntimeError(f"Failed to record top-up for user {user_id}: {transaction_result.error}")
+            
+            # Update user balance
+            balance_update = await supabase.rpc('update_user_balance', {
+                'user_uuid': user_id,
+                'amount_change': amount
+            }).execute_async()
+            if isinstance(balance_update.data, dict) and balance_update.data.get('success'):
+                set_cached_balance(user_id, balance_update.data.get('new_balance'))
+            else:
+                invalidate_balance(user_id)
+                # Not credited: drop the transaction row so the retry does not record the top-up twice
+                if transaction_result.data:
+                    await supabase.table('transactions')\
+                        .delete(returning='minimal')\
+                        .eq('id', transaction_result.data[0]['id'])\
+                        .execute_async()
+                raise RuntimeError(f"Failed to credit ${amount:.2f} to user {user_id}: {balance_update.error or balance_update.data}")
+            
+            # Create success notification (the balance is credited, so a failure here is not retried)
+            notification = {
+                'user_id': user_id,
+                'title': 'Payment Successful! 🎉',
+                'message': f'Your payment of ${amount:.2f} has been confirmed and added to your balance.',
+                'type': 'success',
+                'is_read': False
+            }
             
-            print(f"📊 Invoice update result: {len(result.data) if result.data else 0} records updated")
+            notification_result = await supabase.table('user_notifications').insert(notification, returning='minimal').execute_async()
+            if notification_result.error:
+                print(f"⚠️ Failed to notify user {user_id} of the top-up: {notification_result.error}")
             
-            if result.data and payment_status == 'finished':
-                invoice = result.data[0]
-                user_id = invoice['user_id']
-                amount = float(actually_paid)
-                
-                print(f"💰 Processing balance top-up for user {user_id}, amount: ${amount}")
-                
-                # Create balance transaction
-                balance_transaction = {
-                    'user_id': user_id,
-                    'transaction_type': 'topup',
-                    'amount': amount,
-                    'platform_fee': 0.0,
-                    'net_amount': amount,
-                    'status': 'completed',
-                    'description': f"Crypto payment: ${amount} via NowPayments (Order: {order_id})"
-                }
-                
-                supabase.table('transactions').insert(balance_transaction).execute()
-                
-                # Update user balance
-                supabase.rpc('update_user_balance', {
-                    'user_uuid': user_id,
-                    'amount_change': amount
-                }).execute()
-                
-                # Create success notification
-                notification = {
-                    'user_id': user_id,
-                    'title': 'Payment Successful! 🎉',
-                    'message': f'Your payment of ${amount:.2f} has been confirmed and added to your balance.',
-                    'type': 'success',
-                    'is_read': False
-                }
-                
-                supabase.table('user_notifications').insert(notification).execute()
-                
-                print(f"✅ Balance top-up completed for user {user_id}")
-            else:
-                print(f"ℹ️ No matching invoice found for payment_id {payment_id} or payment not finished")
-        
-        return {"success": True, "message": "Webhook processed successfully"}
-        
-    except Exception as e:
-        # Log error but return success to avoid webhook retries
-        print(f"❌ Webhook processing error: {str(e)}")
-        return {"success": False, "error": str(e)}
+            print(f"✅ Balance top-up completed for user {user_id}")
+        else:
+            print(f"ℹ️ No matching invoice found for payment_id {payment_id} or payment not finished")
+    
+    return {"success": True, "message": "Webhook processed successfully"}
 
 @router.get("/nowpayments/webhook/test")
 async def test_webhook_connectivity():
@@ -904,12 +1004,12 @@ async def simulate_webhook_payment(test_data: dict):
         webhook_body = json.dumps(simulated_webhook_data).encode()
         
         # Find matching email validation record
-        validation_result = supabase.table('subscription_email_validation')\
+        validation_result = await supabase.table('subscription_email_validation')\
             .select('*')\
             .eq('email', customer_email)\
             .order('created_at', desc=True)\
             .limit(1)\
-            .execute()
+            .execute_async()
         
         if validation_result.data:
             validation_record = validation_result.data[0]
@@ -918,7 +1018,7 @@ async def simulate_webhook_payment(test_data: dict):
             print(f"✅ Found validation record for user {user_id}")
             
             # Update validation record to completed with webhook data
-            supabase.table('subscription_email_validation')\
+            await supabase.table('subscription_email_validation')\
                 .update({
                     'status': 'completed',
                     'nowpayments_payment_id': str(payment_id),
@@ -926,7 +1026,7 @@ async def simulate_webhook_payment(test_data: dict):
                     'updated_at': 'now()'
                 })\
                 .eq('id', validation_record['id'])\
-                .execute()
+                .execute_async()
             
             print(f"✅ Validation record updated with payment ID {payment_id}")
             
@@ -959,27 +1059,19 @@ async def simulate_webhook_payment(test_data: dict):
                 'updated_at': datetime.utcnow().isoformat()
             }
             
-            # Update or create subscription
-            existing_sub = supabase.table('subscriptions').select('*').eq('user_id', user_id).execute()
+            # Update or create subscription in one INSERT ... ON CONFLICT (user_id)
+            result = await supabase.table('subscriptions')\
+                .upsert(subscription_data, on_conflict='user_id', returning='minimal')\
+                .execute_async()
+            print(f"📝 Upserted subscription for user {user_id}")
             
-            if existing_sub.data:
-                result = supabase.table('subscriptions')\
-                    .update(subscription_data)\
-                    .eq('user_id', user_id)\
-                    .execute()
-                print(f"📝 Updated existing subscription for user {user_id}")
-            else:
-                subscription_data['created_at'] = datetime.utcnow().isoformat()
-                result = supabase.table('subscriptions')\
-                    .insert(subscription_data)\
-                    .execute()
-                print(f"➕ Created new subscription for user {user_id}")
+            invalidate_subscription(user_id)
             
             # Update company balance
-            if result.data:
-                company_update = supabase.rpc('update_company_balance_subscription', {
+            if not result.error:
+                company_update = await supabase.rpc('update_company_balance_subscription', {
                     'subscription_revenue': float(amount)
-                }).execute()
+                }).execute_async()
                 
                 if company_update.data:
                     print(f"✅ Company balance updated with ${amount}")
@@ -1056,12 +1148,12 @@ async def manual_process_subscription_payment(payment_data: dict):
         print(f"🔧 Manual processing: payment_id={payment_id}, email={customer_email}, amount=${actually_paid}")
         
         # Find matching email validation record
-        validation_result = supabase.table('subscription_email_validation')\
+        validation_result = await supabase.table('subscription_email_validation')\
             .select('*')\
             .eq('email', customer_email)\
             .order('created_at', desc=True)\
             .limit(1)\
-            .execute()
+            .execute_async()
         
         if validation_result.data:
             validation_record = validation_result.data[0]
@@ -1070,7 +1162,7 @@ async def manual_process_subscription_payment(payment_data: dict):
             print(f"✅ Found validation record for user {user_id}")
             
             # Update validation record with actual payment ID
-            supabase.table('subscription_email_validation')\
+            await supabase.table('subscription_email_validation')\
                 .update({
                     'status': 'completed',
                     'nowpayments_payment_id': str(payment_id),  # Store the actual payment ID
@@ -1078,7 +1170,7 @@ async def manual_process_subscription_payment(payment_data: dict):
                     'updated_at': 'now()'
                 })\
                 .eq('id', validation_record['id'])\
-                .execute()
+                .execute_async()
             
             # Process subscription upgrade (same logic as webhook)
             from datetime import datetime, timedelta
@@ -1091,9 +1183,6 @@ async def manual_process_subscription_payment(payment_data: dict):
                 'marketplace_products': 10
             }
             
-            # Check if user already has a subscription record
-            existing_sub = supabase.table('subscriptions').select('*').eq('user_id', user_id).execute()
-            
             subscription_data = {
                 'user_id': user_id,
                 'plan_type': 'plus',
@@ -1108,28 +1197,20 @@ async def manual_process_subscription_payment(payment_data: dict):
                 'updated_at': datetime.utcnow().isoformat()
             }
             
-            if existing_sub.data:
-                # Update existing subscription
-                result = supabase.table('subscriptions')\
-                    .update(subscription_data)\
-                    .eq('user_id', user_id)\
-                    .execute()
-                print(f"📝 Updated existing subscription for user {user_id}")
-            else:
-                # Create new subscription
-                subscription_data['created_at'] = datetime.utcnow().isoformat()
-                result = supabase.table('subscriptions')\
-                    .insert(subscription_data)\
-                    .execute()
-                print(f"➕ Created new subscription for user {user_id}")
-            
-            if result.data:
+            # Update or create the user's subscription in one INSERT ... ON CONFLICT (user_id)
+            result = await supabase.table('subscriptions')\
+                .upsert(subscription_data, on_conflict='user_id', returning='minimal')\
+                .execute_async()
+            
+            invalidate_subscription(user_id)
+            
+            if not result.error:
                 print(f"✅ Subscription upgrade completed for user {user_id}")
                 
                 # Update company balance
-                company_update = supabase.rpc('update_company_balance_subscription', {
+                company_update = await supabase.rpc('update_company_balance_subscription', {
                     'subscription_revenue': actually_paid
-                }).execute()
+                }).execute_async()
                 
                 if company_update.data:
                     print(f"✅ Company balance updated with subscription revenue: ${actually_paid:.2f}")
@@ -1211,31 +1292,31 @@ async def create_subscription(request: SubscriptionRequest, user_id: str = Query
             'status': 'pending'
         }
         
-        validation_result = supabase.table('subscription_email_validation').insert(validation_record).execute()
+        validation_result = await supabase.table('subscription_email_validation').insert(validation_record).execute_async()
         
         if not validation_result.data:
             raise HTTPException(status_code=500, detail="Failed to create subscription validation record")
         
         validation_id = validation_result.data[0]['id']
         
-        # Now create subscription with NowPayments
+        # Now create subscription with NowPayments; its IPNs carry order_id back to the webhook
         subscription_data = {
             "subscription_plan_id": nowpayments_plan_id,
-            "email": request.user_email
+            "email": request.user_email,
+            "order_id": encode_subscription_order_id(validation_id)
         }
         
         # Make authenticated request to NowPayments subscriptions API
-        headers = get_nowpayments_headers_with_jwt(jwt_token)
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{NOWPAYMENTS_API_URL}/subscriptions",
-                json=subscription_data,
-                headers=headers
-            )
+        response = await nowpayments_tokens.request(
+            "POST",
+            f"{NOWPAYMENTS_API_URL}/subscriptions",
+            json=subscription_data,
+            headers=get_nowpayments_headers()
+        )
         
         if response.status_code not in [200, 201]:
             # Clean up validation record if NowPayments call fails
-            supabase.table('subscription_email_validation').delete().eq('id', validation_id).execute()
+            await supabase.table('subscription_email_validation').delete().eq('id', validation_id).execute_async()
             error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
             raise HTTPException(status_code=400, detail=f"Failed to create NowPayments subscription: {error_detail}")
         
@@ -1257,10 +1338,10 @@ async def create_subscription(request: SubscriptionRequest, user_id: str = Query
         nowpayments_subscription_id = subscription_result.get('id')
         
         # Update validation record with NowPayments subscription ID
-        supabase.table('subscription_email_validation')\
+        await supabase.table('subscription_email_validation')\
             .update({'nowpayments_subscription_id': str(nowpayments_subscription_id)})\
             .eq('id', validation_id)\
-            .execute()
+            .execute_async()
         
         # Store subscription record in database with proper data extraction
         subscription_record = {
@@ -1273,7 +1354,7 @@ async def create_subscription(request: SubscriptionRequest, user_id: str = Query
             'expire_date': subscription_result.get('expire_date')
         }
         
-        result = supabase.table('nowpayments_subscriptions').insert(subscription_record).execute()
+        result = await supabase.table('nowpayments_subscriptions').insert(subscription_record).execute_async()
         
         if not result.data:
             raise HTTPException(status_code=500, detail="Failed to store subscription record")
@@ -1287,12 +1368,13 @@ async def create_subscription(request: SubscriptionRequest, user_id: str = Query
             'is_read': False
         }
         
-        supabase.table('user_notifications').insert(notification).execute()
+        await supabase.table('user_notifications').insert(notification).execute_async()
         
         return {
             "success": True,
             "subscription": subscription_result,
             "validation_id": validation_id,
+            "order_id": subscription_data["order_id"],
             "nowpayments_plan_id": nowpayments_plan_id,
             "message": f"Subscription created successfully with NowPayments! Payment instructions have been sent to {request.user_email}"
         }
@@ -1319,20 +1401,19 @@ async def cancel_subscription(subscription_id: str, user_id: str = Query(..., de
         if not jwt_token:
             raise HTTPException(status_code=500, detail="Failed to authenticate with NowPayments for subscription cancellation")
         
-        # Make authenticated DELETE request to NowPayments subscriptions API
-        headers = get_nowpayments_headers_with_jwt(jwt_token)
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(
-                f"{NOWPAYMENTS_API_URL}/subscriptions/{subscription_id}",
-                headers=headers
-            )
+        # Make authenticated DELETE request to NowPayments subscriptions API (retried once on 401)
+        response = await nowpayments_tokens.request(
+            "DELETE",
+            f"{NOWPAYMENTS_API_URL}/subscriptions/{subscription_id}",
+            headers=get_nowpayments_headers()
+        )
         
         if response.status_code not in [200, 201]:
             error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
             raise HTTPException(status_code=400, detail=f"Failed to cancel NowPayments subscription: {error_detail}")
         
         # Update local database to mark subscription as cancelled
-        result = supabase.table('nowpayments_subscriptions')\
+        result = await supabase.table('nowpayments_subscriptions')\
             .update({
                 'status': 'CANCELLED',
                 'is_active': False,
@@ -1340,7 +1421,7 @@ async def cancel_subscription(subscription_id: str, user_id: str = Query(..., de
             })\
             .eq('subscription_id', subscription_id)\
             .eq('user_id', user_id)\
-            .execute()
+            .execute_async()
         
         # Create cancellation notification
         notification = {
@@ -1351,7 +1432,7 @@ async def cancel_subscription(subscription_id: str, user_id: str = Query(..., de
             'is_read': False
         }
         
-        supabase.table('user_notifications').insert(notification).execute()
+        await supabase.table('user_notifications').insert(notification).execute_async()
         
         return {
             "success": True,
@@ -1365,24 +1446,32 @@ async def cancel_subscription(subscription_id: str, user_id: str = Query(..., de
         raise HTTPException(status_code=500, detail=f"Failed to cancel subscription: {str(e)}")
 
 @router.get("/nowpayments/user/{user_id}/payments")
-async def get_user_payments(user_id: str, limit: int = 50):
-    """Get user's payment history"""
+async def get_user_payments(user_id: str, limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX), cursor: Optional[str] = None):
+    """Get user's payment history, newest first; pass next_cursor back as cursor for the next page"""
+    import sys
+    sys.path.append('/app/backend')
+    from supabase_client import supabase_admin as supabase, decode_cursor, keyset_page
+    
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
     try:
-        import sys
-        sys.path.append('/app/backend')
-        from supabase_client import supabase_admin as supabase
-        
-        result = supabase.table('nowpayments_invoices')\
+        result = await supabase.table('nowpayments_invoices')\
             .select('*')\
             .eq('user_id', user_id)\
-            .order('created_at', desc=True)\
-            .limit(limit)\
-            .execute()
+            .keyset(cursor, limit)\
+            .execute_async()
+        
+        payments, next_cursor = keyset_page(result.data, limit)
         
         return {
             "success": True,
-            "payments": result.data,
-            "count": len(result.data)
+            "payments": payments,
+            "count": len(payments),
+            "next_cursor": next_cursor
         }
         
     except Exception as e:
@@ -1400,13 +1489,14 @@ async def reset_all_balances(admin_key: str = "admin123"):
         from supabase_client import supabase_admin as supabase
         
         # First, get all user accounts to see how many exist
-        all_accounts = supabase.table('user_accounts').select('user_id, balance').execute()
+        all_accounts = await supabase.table('user_accounts').select('user_id, balance').execute_async()
         
         # Reset all balances to 0 - update all existing records
-        reset_result = supabase.table('user_accounts')\
+        reset_result = await supabase.table('user_accounts')\
             .update({'balance': 0.0})\
             .neq('balance', -99999)\
-            .execute()  # Update all accounts (using a condition that matches all)
+            .execute_async()  # Update all accounts (using a condition that matches all)
+        invalidate_balance()
         
         # Count affected records
         affected_count = len(reset_result.data) if reset_result.data else 0
@@ -1436,14 +1526,14 @@ async def get_estimated_price(amount: float, currency_from: str = "usd", currenc
             "currency_to": currency_to
         }
         
-        response = await make_nowpayments_request("GET", "/estimate", params)
-        
-        if response.status_code != 200:
+        try:
+            estimate = await get_nowpayments_reference("estimate", "/estimate", params)
+        except NowPaymentsAPIError:
             raise HTTPException(status_code=400, detail="Failed to get price estimate")
         
         return {
             "success": True,
-            "estimate": response.json()
+            "estimate": estimate
         }
         
     except HTTPException:
@@ -1473,9 +1563,12 @@ def generate_2fa_code():
 async def get_withdrawal_min_amount(currency: str):
     """Get minimum withdrawal amount for a specific currency"""
     try:
-        response = await make_nowpayments_request("GET", f"/payout-withdrawal/min-amount/{currency}")
+        try:
+            result = await get_nowpayments_reference("withdrawal_min_amount", f"/payout-withdrawal/min-amount/{currency.lower()}")
+        except NowPaymentsAPIError:
+            result = None
         
-        if response.status_code != 200:
+        if result is None:
             # Fallback minimum amounts for supported currencies
             fallback_minimums = {
                 "usdttrc20": 1.0,
@@ -1497,7 +1590,6 @@ async def get_withdrawal_min_amount(currency: str):
                 "source": "fallback"
             }
         
-        result = response.json()
         return {
             "success": True,
             "min_amount": result.get("min_amount", 10.0),
@@ -1523,9 +1615,12 @@ async def get_withdrawal_fee(currency: str, amount: float):
             "amount": amount
         }
         
-        response = await make_nowpayments_request("GET", "/payout/fee", params)
+        try:
+            result = await get_nowpayments_reference("withdrawal_fee", "/payout/fee", params)
+        except NowPaymentsAPIError:
+            result = None
         
-        if response.status_code != 200:
+        if result is None:
             # Fallback network fees for supported currencies (approximate)
             fallback_fees = {
                 "usdttrc20": 1.0,   # TRC20 usually ~$1
@@ -1548,7 +1643,6 @@ async def get_withdrawal_fee(currency: str, amount: float):
                 "source": "fallback"
             }
         
-        result = response.json()
         return {
             "success": True,
             "fee": result.get("fee", 5.0),
@@ -1596,7 +1690,7 @@ async def create_withdrawal_request(request: WithdrawalRequest, user_id: str = Q
         if request.currency not in supported_currencies:
             raise HTTPException(status_code=400, detail=f"Currency {request.currency} is not supported")
         
-        # Check minimum amount
+        # Check minimum amount (served from the reference data cache)
         try:
             min_amount_result = await get_withdrawal_min_amount(request.currency)
             min_amount = min_amount_result.get("min_amount", 1.0)
@@ -1610,16 +1704,14 @@ async def create_withdrawal_request(request: WithdrawalRequest, user_id: str = Q
                 detail=f"Amount {request.amount} is below minimum withdrawal amount {min_amount} for {request.currency}"
             )
         
-        # Check user balance
+        # Check user balance (pre-check from the write-through cache; the RPC below is authoritative)
         try:
-            user_balance_result = supabase.table('user_accounts').select('balance').eq('user_id', user_id).execute()
+            account = await get_cached_balance(user_id)
         except Exception as e:
             print(f"Error fetching user balance: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Database error: Could not fetch user balance - {str(e)}")
         
-        user_balance = 0.0
-        if user_balance_result.data:
-            user_balance = float(user_balance_result.data[0]['balance'])
+        user_balance = account['balance'] if account else 0.0
         
         if user_balance < request.amount:
             raise HTTPException(
@@ -1631,15 +1723,16 @@ async def create_withdrawal_request(request: WithdrawalRequest, user_id: str = Q
         try:
             print(f"🔄 Calling create_withdrawal_request RPC with user_id={user_id}, amount={request.amount}, currency={request.currency}")
             
-            result = supabase.rpc('create_withdrawal_request', {
+            result = await supabase.rpc('create_withdrawal_request', {
                 'p_user_id': user_id,
                 'p_recipient_address': request.recipient_address,
                 'p_currency': request.currency,
                 'p_amount': request.amount,
                 'p_description': request.description
-            }).execute()
+            }).execute_async()
             
             print(f"📊 RPC result: {result}")
+            invalidate_balance(user_id)
             
         except Exception as rpc_error:
             print(f"❌ RPC function error: {type(rpc_error).__name__}: {str(rpc_error)}")
@@ -1686,7 +1779,7 @@ async def create_withdrawal_request(request: WithdrawalRequest, user_id: str = Q
                 'is_read': False
             }
             
-            supabase.table('user_notifications').insert(notification).execute()
+            await supabase.table('user_notifications').insert(notification).execute_async()
         except Exception as notif_error:
             print(f"Warning: Failed to create notification: {str(notif_error)}")
         
@@ -1721,11 +1814,11 @@ async def verify_and_process_withdrawal(request: VerifyWithdrawalRequest, user_i
             raise HTTPException(status_code=400, detail="Valid user_id is required for verification")
         
         # Get withdrawal record
-        withdrawal_result = supabase.table('nowpayments_withdrawals')\
+        withdrawal_result = await supabase.table('nowpayments_withdrawals')\
             .select('*')\
             .eq('id', request.withdrawal_id)\
             .eq('user_id', user_id)\
-            .execute()
+            .execute_async()
         
         if not withdrawal_result.data:
             raise HTTPException(status_code=404, detail="Withdrawal request not found")
@@ -1741,10 +1834,10 @@ async def verify_and_process_withdrawal(request: VerifyWithdrawalRequest, user_i
             expires_at = datetime.fromisoformat(withdrawal['verification_expires_at'].replace('Z', '+00:00'))
             if datetime.now(expires_at.tzinfo) > expires_at:
                 # Update status to expired
-                supabase.table('nowpayments_withdrawals')\
+                await supabase.table('nowpayments_withdrawals')\
                     .update({'status': 'failed', 'error_message': 'Verification expired'})\
                     .eq('id', request.withdrawal_id)\
-                    .execute()
+                    .execute_async()
                 
                 raise HTTPException(status_code=400, detail="Verification has expired. Please create a new withdrawal request.")
         
@@ -1768,26 +1861,25 @@ async def verify_and_process_withdrawal(request: VerifyWithdrawalRequest, user_i
             }]
         }
         
-        headers = get_nowpayments_headers_with_jwt(jwt_token)
-        async with httpx.AsyncClient() as client:
-            payout_response = await client.post(
-                f"{NOWPAYMENTS_API_URL}/payout",
-                json=payout_data,
-                headers=headers
-            )
+        payout_response = await nowpayments_tokens.request(
+            "POST",
+            f"{NOWPAYMENTS_API_URL}/payout",
+            json=payout_data,
+            headers=get_nowpayments_headers()
+        )
         
         if payout_response.status_code not in [200, 201]:
             error_detail = payout_response.json() if payout_response.headers.get("content-type", "").startswith("application/json") else payout_response.text
             
             # Update withdrawal with error
-            supabase.table('nowpayments_withdrawals')\
+            await supabase.table('nowpayments_withdrawals')\
                 .update({
                     'status': 'failed',
                     'error_message': f'NowPayments payout creation failed: {error_detail}',
                     'api_response': error_detail
                 })\
                 .eq('id', request.withdrawal_id)\
-                .execute()
+                .execute_async()
             
             raise HTTPException(status_code=400, detail=f"Failed to create payout with NowPayments: {error_detail}")
         
@@ -1813,18 +1905,18 @@ async def verify_and_process_withdrawal(request: VerifyWithdrawalRequest, user_i
             "verification_code": verification_code
         }
         
-        async with httpx.AsyncClient() as client:
-            verify_response = await client.post(
-                f"{NOWPAYMENTS_API_URL}/payout/{batch_withdrawal_id}/verify",
-                json=verify_data,
-                headers=headers
-            )
+        verify_response = await nowpayments_tokens.request(
+            "POST",
+            f"{NOWPAYMENTS_API_URL}/payout/{batch_withdrawal_id}/verify",
+            json=verify_data,
+            headers=get_nowpayments_headers()
+        )
         
         if verify_response.status_code not in [200, 201]:
             verify_error = verify_response.json() if verify_response.headers.get("content-type", "").startswith("application/json") else verify_response.text
             
             # Update withdrawal with verification error
-            supabase.table('nowpayments_withdrawals')\
+            await supabase.table('nowpayments_withdrawals')\
                 .update({
                     'status': 'verifying',
                     'batch_withdrawal_id': str(batch_withdrawal_id),
@@ -1833,7 +1925,7 @@ async def verify_and_process_withdrawal(request: VerifyWithdrawalRequest, user_i
                     'api_response': {'payout': payout_result, 'verify_error': verify_error}
                 })\
                 .eq('id', request.withdrawal_id)\
-                .execute()
+                .execute_async()
             
             print(f"2FA verification failed: {verify_error}")
             raise HTTPException(status_code=400, detail=f"2FA verification failed: {verify_error}")
@@ -1842,7 +1934,7 @@ async def verify_and_process_withdrawal(request: VerifyWithdrawalRequest, user_i
         print(f"2FA verification successful: {verify_result}")
         
         # Update withdrawal record with success
-        supabase.table('nowpayments_withdrawals')\
+        await supabase.table('nowpayments_withdrawals')\
             .update({
                 'status': 'verified',
                 'batch_withdrawal_id': str(batch_withdrawal_id),
@@ -1851,12 +1943,13 @@ async def verify_and_process_withdrawal(request: VerifyWithdrawalRequest, user_i
                 'api_response': {'payout': payout_result, 'verify': verify_result}
             })\
             .eq('id', request.withdrawal_id)\
-            .execute()
+            .execute_async()
         
         # Process the verified withdrawal (deduct balance)
-        process_result = supabase.rpc('process_verified_withdrawal', {
+        process_result = await supabase.rpc('process_verified_withdrawal', {
             'p_withdrawal_id': request.withdrawal_id
-        }).execute()
+        }).execute_async()
+        invalidate_balance(user_id)
         
         if not process_result.data or not process_result.data[0].get('success'):
             print(f"Warning: Failed to process verified withdrawal: {process_result}")
@@ -1871,7 +1964,7 @@ async def verify_and_process_withdrawal(request: VerifyWithdrawalRequest, user_i
             'is_read': False
         }
         
-        supabase.table('user_notifications').insert(notification).execute()
+        await supabase.table('user_notifications').insert(notification).execute_async()
         
         return {
             "success": True,
@@ -1891,24 +1984,32 @@ async def verify_and_process_withdrawal(request: VerifyWithdrawalRequest, user_i
         raise HTTPException(status_code=500, detail=f"Failed to verify withdrawal: {str(e)}")
 
 @router.get("/nowpayments/user/{user_id}/withdrawals")
-async def get_user_withdrawals(user_id: str, limit: int = 50):
-    """Get user's withdrawal history"""
+async def get_user_withdrawals(user_id: str, limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX), cursor: Optional[str] = None):
+    """Get user's withdrawal history, newest first; pass next_cursor back as cursor for the next page"""
+    import sys
+    sys.path.append('/app/backend')
+    from supabase_client import supabase_admin as supabase, decode_cursor, keyset_page
+    
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
     try:
-        import sys
-        sys.path.append('/app/backend')
-        from supabase_client import supabase_admin as supabase
-        
-        result = supabase.table('nowpayments_withdrawals')\
+        result = await supabase.table('nowpayments_withdrawals')\
             .select('*')\
             .eq('user_id', user_id)\
-            .order('created_at', desc=True)\
-            .limit(limit)\
-            .execute()
+            .keyset(cursor, limit)\
+            .execute_async()
+        
+        withdrawals, next_cursor = keyset_page(result.data, limit)
         
         return {
             "success": True,
-            "withdrawals": result.data,
-            "count": len(result.data)
+            "withdrawals": withdrawals,
+            "count": len(withdrawals),
+            "next_cursor": next_cursor
         }
         
     except Exception as e:
@@ -1918,167 +2019,234 @@ async def get_user_withdrawals(user_id: str, limit: int = 50):
 async def withdrawal_webhook(request: Request):
     """Handle NowPayments withdrawal webhooks"""
     try:
-        import sys
-        sys.path.append('/app/backend')
-        from supabase_client import supabase_admin as supabase
-        
         # Get request body
         body = await request.body()
-        webhook_data = json.loads(body.decode())
+        if not verify_nowpayments_signature(body, request.headers.get("x-nowpayments-sig")):
+            raise HTTPException(status_code=401, detail="Invalid webhook signature")
         
+        webhook_data = json.loads(body.decode())
         print(f"🔔 Withdrawal webhook received: {webhook_data}")
         
-        # Extract relevant data - check both 'id' and 'batch_withdrawal_id'
-        withdrawal_id = webhook_data.get('id')  # This is the batch withdrawal ID from NowPayments
-        batch_withdrawal_id = webhook_data.get('batch_withdrawal_id')  
-        status = webhook_data.get('status')
-        transaction_hash = webhook_data.get('hash') or webhook_data.get('transaction_hash')
-        actual_amount = webhook_data.get('amount')
-        error_message = webhook_data.get('error_message')
-        network_fee = webhook_data.get('fee', 0)
-        
-        # Use the ID from webhook as batch_withdrawal_id
-        search_batch_id = withdrawal_id or batch_withdrawal_id
-        
+        search_batch_id = webhook_data.get('id') or webhook_data.get('batch_withdrawal_id')
         if not search_batch_id:
             print("❌ No withdrawal/batch ID in webhook")
             return {"success": False, "error": "Missing withdrawal ID"}
         
-        print(f"🔍 Looking for withdrawal with batch_withdrawal_id: {search_batch_id}")
-        
-        # Use the new database function to update withdrawal status
+        # Acknowledge now, apply from the durable queue (in batch id order)
         try:
-            result = supabase.rpc('update_withdrawal_status_webhook', {
-                'p_batch_withdrawal_id': str(search_batch_id),
-                'p_status': status,
-                'p_transaction_hash': transaction_hash,
-                'p_network_fee': float(network_fee) if network_fee else 0,
-                'p_actual_amount_sent': float(actual_amount) if actual_amount else None
-            }).execute()
-            
-            if result.data and result.data[0].get('success'):
-                withdrawal_data = result.data[0]
-                print(f"✅ Withdrawal status updated via database function: {withdrawal_data}")
-                
-                # Get withdrawal info for notifications
-                withdrawal_result = supabase.table('nowpayments_withdrawals')\
-                    .select('*')\
-                    .eq('batch_withdrawal_id', str(search_batch_id))\
-                    .execute()
-                
-                if withdrawal_result.data:
-                    withdrawal = withdrawal_result.data[0]
-                    user_id = withdrawal['user_id']
-                    
-                    # Create notification for user
-                    notification_title = ""
-                    notification_message = ""
-                    notification_type = "info"
-                    
-                    if status in ['SENDING', 'sending']:
-                        notification_title = "🚀 Withdrawal Being Processed"
-                        notification_message = f"Your withdrawal of {withdrawal['amount']} {withdrawal['currency']} is being processed and sent to the blockchain."
-                        notification_type = "info"
-                    elif status in ['FINISHED', 'completed', 'sent']:
-                        notification_title = "✅ Withdrawal Completed"
-                        notification_message = f"Your withdrawal of {withdrawal['amount']} {withdrawal['currency']} has been completed successfully! Balance deducted: ${withdrawal['amount']:.2f}"
-                        if transaction_hash:
-                            notification_message += f" | Transaction hash: {transaction_hash}"
-                        notification_type = "success"
-                    elif status in ['failed', 'FAILED']:
-                        notification_title = "❌ Withdrawal Failed"
-                        notification_message = f"Your withdrawal of {withdrawal['amount']} {withdrawal['currency']} has failed."
-                        if error_message:
-                            notification_message += f" Reason: {error_message}"
-                        notification_type = "error"
-                    
-                    # Create notification
-                    if notification_title:
-                        notification = {
-                            'user_id': user_id,
-                            'title': notification_title,
-                            'message': notification_message,
-                            'type': notification_type,
-                            'is_read': False
-                        }
-                        
-                        supabase.table('user_notifications').insert(notification).execute()
-                        print(f"📧 Notification created for user {user_id}")
-                
-                return {"success": True, "message": "Withdrawal webhook processed successfully"}
-            else:
-                error_msg = result.data[0].get('message', 'Database function failed') if result.data else 'No response from database function'
-                print(f"❌ Database function failed: {error_msg}")
-                return {"success": False, "error": error_msg}
-                
-        except Exception as db_error:
-            print(f"❌ Database function error: {str(db_error)}")
-            
-            # Fallback: Try to find and update the record manually
-            withdrawal_result = supabase.table('nowpayments_withdrawals')\
-                .select('*')\
-                .eq('batch_withdrawal_id', str(search_batch_id))\
-                .execute()
-            
-            if not withdrawal_result.data:
-                print(f"⚠️ Withdrawal record not found for batch ID: {search_batch_id}")
-                return {"success": False, "error": "Withdrawal record not found"}
-            
-            withdrawal = withdrawal_result.data[0]
-            user_id = withdrawal['user_id']
-            
-            # Manual update
-            update_data = {
-                'api_response': webhook_data,
-                'updated_at': 'now()',
-                'status': 'completed' if status == 'FINISHED' else status.lower()
-            }
-            
-            if transaction_hash:
-                update_data['transaction_hash'] = transaction_hash
-            if actual_amount:
-                update_data['actual_amount_sent'] = float(actual_amount)
-            if network_fee:
-                update_data['network_fee'] = float(network_fee)
-                
-            if status in ['FINISHED', 'completed']:
-                update_data['completed_at'] = 'now()'
-                
-                # Manually deduct balance for completed withdrawals
-                try:
-                    balance_result = supabase.table('user_accounts')\
-                        .select('balance')\
-                        .eq('user_id', user_id)\
-                        .execute()
-                    
-                    if balance_result.data:
-                        current_balance = float(balance_result.data[0]['balance'])
-                        if current_balance >= withdrawal['amount']:
-                            supabase.table('user_accounts')\
-                                .update({
-                                    'balance': current_balance - withdrawal['amount'],
-                                    'updated_at': 'now()'
-                                })\
-                                .eq('user_id', user_id)\
-                                .execute()
-                            print(f"💰 Manually deducted ${withdrawal['amount']} from user {user_id}")
-                        else:
-                            print(f"⚠️ Insufficient balance to deduct: ${current_balance} < ${withdrawal['amount']}")
-                except Exception as balance_error:
-                    print(f"❌ Failed to manually update balance: {str(balance_error)}")
-            
-            # Update withdrawal record
-            supabase.table('nowpayments_withdrawals')\
-                .update(update_data)\
-                .eq('id', withdrawal['id'])\
-                .execute()
-            
-            return {"success": True, "message": "Withdrawal webhook processed with manual fallback"}
+            job_id = webhook_queue.enqueue("nowpayments_withdrawal", body, ordering_key=search_batch_id)
+        except Exception as queue_error:
+            print(f"⚠️ Webhook queue unavailable ({queue_error}), processing inline")
+            return await apply_inline(apply_withdrawal_webhook, body.decode())
+        
+        print(f"📥 Withdrawal webhook for {search_batch_id} queued as job {job_id}")
+        return {"success": True, "message": "Withdrawal webhook queued for processing", "job_id": job_id}
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Withdrawal webhook error: {str(e)}")
         return {"success": False, "error": str(e)}
+
+# A withdrawal in one of these states has had its balance deducted (as in update_withdrawal_status_webhook)
+WITHDRAWAL_DEDUCTED_STATUSES = ('completed', 'sent', 'processing')
+
+async def process_withdrawal_webhook(webhook_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply a NowPayments withdrawal status update.
+    
+    Raises when the update cannot be applied, so the queue retries (and
+    eventually dead-letters) it. Safe to run more than once for the same
+    update: the balance is deducted at most once per withdrawal.
+    """
+    from supabase_client import supabase_admin as supabase
+    
+    # Extract relevant data - check both 'id' and 'batch_withdrawal_id'
+    withdrawal_id = webhook_data.get('id')  # This is the batch withdrawal ID from NowPayments
+    batch_withdrawal_id = webhook_data.get('batch_withdrawal_id')  
+    status = webhook_data.get('status')
+    transaction_hash = webhook_data.get('hash') or webhook_data.get('transaction_hash')
+    actual_amount = webhook_data.get('amount')
+    error_message = webhook_data.get('error_message')
+    network_fee = webhook_data.get('fee', 0)
+    
+    # Use the ID from webhook as batch_withdrawal_id
+    search_batch_id = withdrawal_id or batch_withdrawal_id
+    
+    if not search_batch_id:
+        raise ValueError("Missing withdrawal ID in withdrawal webhook")
+    
+    print(f"🔍 Looking for withdrawal with batch_withdrawal_id: {search_batch_id}")
+    
+    # Use the new database function to update withdrawal status
+    result = await supabase.rpc('update_withdrawal_status_webhook', {
+        'p_batch_withdrawal_id': str(search_batch_id),
+        'p_status': status,
+        'p_transaction_hash': transaction_hash,
+        'p_network_fee': float(network_fee) if network_fee else 0,
+        'p_actual_amount_sent': float(actual_amount) if actual_amount else None
+    }).execute_async()
+    
+    if result.error:
+        print(f"❌ Database function error: {result.error}")
+        return await process_withdrawal_webhook_manually(webhook_data, search_batch_id)
+    
+    # The function returns one JSONB object
+    withdrawal_data = result.data[0] if isinstance(result.data, list) and result.data else result.data
+    if not isinstance(withdrawal_data, dict) or not withdrawal_data.get('success'):
+        error_msg = withdrawal_data.get('message', 'Database function failed') if isinstance(withdrawal_data, dict) else 'No response from database function'
+        raise RuntimeError(f"Withdrawal {search_batch_id} status update failed: {error_msg}")
+    
+    print(f"✅ Withdrawal status updated via database function: {withdrawal_data}")
+    # Get withdrawal info for notifications
+    withdrawal_result = await supabase.table('nowpayments_withdrawals')\
+        .select('*')\
+        .eq('batch_withdrawal_id', str(search_batch_id))\
+        .execute_async()
+    if withdrawal_result.error:
+        raise RuntimeError(f"Failed to read withdrawal {search_batch_id}: {withdrawal_result.error}")
+    
+    if withdrawal_result.data:
+        withdrawal = withdrawal_result.data[0]
+        user_id = withdrawal['user_id']
+        # The status function may have deducted the balance
+        invalidate_balance(user_id)
+        
+        # Create notification for user
+        notification_title = ""
+        notification_message = ""
+        notification_type = "info"
+        
+        if status in ['SENDING', 'sending']:
+            notification_title = "🚀 Withdrawal Being Processed"
+            notification_message = f"Your withdrawal of {withdrawal['amount']} {withdrawal['currency']} is being processed and sent to the blockchain."
+            notification_type = "info"
+        elif status in ['FINISHED', 'completed', 'sent']:
+            notification_title = "✅ Withdrawal Completed"
+            notification_message = f"Your withdrawal of {withdrawal['amount']} {withdrawal['currency']} has been completed successfully! Balance deducted: ${withdrawal['amount']:.2f}"
+            if transaction_hash:
+                notification_message += f" | Transaction hash: {transaction_hash}"
+            notification_type = "success"
+        elif status in ['failed', 'FAILED']:
+            notification_title = "❌ Withdrawal Failed"
+            notification_message = f"Your withdrawal of {withdrawal['amount']} {withdrawal['currency']} has failed."
+            if error_message:
+                notification_message += f" Reason: {error_message}"
+            notification_type = "error"
         
-    except Exception as e:
-        print(f"❌ Withdrawal webhook error: {str(e)}")
-        return {"success": False, "error": str(e)}
\ No newline at end of file
+        # Create notification
+        if notification_title:
+            notification = {
+                'user_id': user_id,
+                'title': notification_title,
+                'message': notification_message,
+                'type': notification_type,
+                'is_read': False
+            }
+            
+            notification_result = await supabase.table('user_notifications').insert(notification, returning='minimal').execute_async()
+            if notification_result.error:
+                raise RuntimeError(f"Failed to notify user {user_id} of withdrawal {search_batch_id}: {notification_result.error}")
+            print(f"📧 Notification created for user {user_id}")
+    
+    return {"success": True, "message": "Withdrawal webhook processed successfully"}
+
+async def process_withdrawal_webhook_manually(webhook_data: Dict[str, Any], search_batch_id) -> Dict[str, Any]:
+    """Fallback when update_withdrawal_status_webhook is unavailable: same updates made table by table"""
+    from supabase_client import supabase_admin as supabase
+    
+    status = webhook_data.get('status') or ''
+    transaction_hash = webhook_data.get('hash') or webhook_data.get('transaction_hash')
+    actual_amount = webhook_data.get('amount')
+    network_fee = webhook_data.get('fee', 0)
+    
+    # Fallback: Try to find and update the record manually
+    withdrawal_result = await supabase.table('nowpayments_withdrawals')\
+        .select('*')\
+        .eq('batch_withdrawal_id', str(search_batch_id))\
+        .execute_async()
+    if withdrawal_result.error:
+        raise RuntimeError(f"Failed to read withdrawal {search_batch_id}: {withdrawal_result.error}")
+    if not withdrawal_result.data:
+        raise RuntimeError(f"Withdrawal record not found for batch ID: {search_batch_id}")
+    
+    withdrawal = withdrawal_result.data[0]
+    user_id = withdrawal['user_id']
+    previous_status = withdrawal.get('status')
+    
+    # Manual update
+    update_data = {
+        'api_response': webhook_data,
+        'updated_at': 'now()',
+        'status': 'completed' if status == 'FINISHED' else status.lower()
+    }
+    
+    if transaction_hash:
+        update_data['transaction_hash'] = transaction_hash
+    if actual_amount:
+        update_data['actual_amount_sent'] = float(actual_amount)
+    if network_fee:
+        update_data['network_fee'] = float(network_fee)
+    
+    deduct = status in ['FINISHED', 'completed'] and previous_status not in WITHDRAWAL_DEDUCTED_STATUSES
+    if status in ['FINISHED', 'completed']:
+        update_data['completed_at'] = 'now()'
+    
+    # Update withdrawal record. When this update completes the withdrawal, the status filter lets
+    # exactly one delivery make the transition, and only that delivery deducts the balance.
+    update_query = supabase.table('nowpayments_withdrawals')\
+        .update(update_data)\
+        .eq('id', withdrawal['id'])
+    if deduct:
+        update_query.not_('status', 'in', WITHDRAWAL_DEDUCTED_STATUSES)
+    update_result = await update_query.execute_async()
+    if update_result.error:
+        raise RuntimeError(f"Failed to update withdrawal {search_batch_id}: {update_result.error}")
+    
+    if deduct and not update_result.data:
+        print(f"ℹ️ Withdrawal {search_batch_id} was already completed, balance not deducted again")
+        deduct = False
+    
+    if deduct:
+        # Manually deduct balance for completed withdrawals
+        balance_result = await supabase.table('user_accounts')\
+            .select('balance')\
+            .eq('user_id', user_id)\
+            .execute_async()
+        
+        deducted = None
+        if not balance_result.error and balance_result.data:
+            current_balance = float(balance_result.data[0]['balance'])
+            if current_balance >= withdrawal['amount']:
+                # Conditional on the balance read above, so a concurrent change is not overwritten
+                deducted = await supabase.table('user_accounts')\
+                    .update({
+                        'balance': current_balance - withdrawal['amount'],
+                        'updated_at': 'now()'
+                    })\
+                    .eq('user_id', user_id)\
+                    .eq('balance', balance_result.data[0]['balance'])\
+                    .execute_async()
+            else:
+                print(f"⚠️ Insufficient balance to deduct: ${current_balance} < ${withdrawal['amount']}")
+        
+        if deducted is not None and not deducted.error and deducted.data:
+            set_cached_balance(user_id, current_balance - withdrawal['amount'])
+            print(f"💰 Manually deducted ${withdrawal['amount']} from user {user_id}")
+        elif deducted is not None or balance_result.error:
+            # Put the status back so the retry deducts again
+            invalidate_balance(user_id)
+            await supabase.table('nowpayments_withdrawals')\
+                .update({'status': previous_status, 'completed_at': withdrawal.get('completed_at')}, returning='minimal')\
+                .eq('id', withdrawal['id'])\
+                .execute_async()
+            error = balance_result.error or (deducted.error if deducted is not None else None) or "balance changed concurrently"
+            raise RuntimeError(f"Failed to deduct withdrawal {search_batch_id} from user {user_id}: {error}")
+    
+    return {"success": True, "message": "Withdrawal webhook processed with manual fallback"}
+
+async def apply_withdrawal_webhook(body: str) -> Dict[str, Any]:
+    """Queue job for a withdrawal webhook body"""
+    return await process_withdrawal_webhook(json.loads(body))
+
+webhook_queue.register("nowpayments_ipn", apply_nowpayments_ipn)
+webhook_queue.register("nowpayments_withdrawal", apply_withdrawal_webhook)
\ No newline at end of file
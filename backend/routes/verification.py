@@ -11,7 +11,7 @@ async def verification_health_check():
     try:
         if supabase:
             # Test database connection
-            response = supabase.table('user_profiles').select('count').limit(1).execute()
+            response = supabase.table('user_profiles').select('user_id').limit(1).execute()
             connected = response.status_code == 200
         else:
             connected = False
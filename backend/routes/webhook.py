@@ -1,7 +1,9 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 import os
+import json
 import logging
 import sys
 from pathlib import Path
@@ -10,26 +12,16 @@ from pydantic import BaseModel, Field
 # Simplified models - avoid validator which can cause typing issues
 import uuid
 
+from services.feed_store import feed_store, etag_matches
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# In-memory storage for now (replace with Supabase later)
-FEED_ENTRIES = []
-TRANSLATIONS = {}
-
-def cleanup_old_entries():
-    """Keep only the latest 20 feed entries, remove older ones"""
-    global FEED_ENTRIES
-    try:
-        if len(FEED_ENTRIES) > 20:
-            # Keep only the latest 20 entries
-            FEED_ENTRIES = sorted(FEED_ENTRIES, key=lambda x: x['created_at'], reverse=True)[:20]
-            logger.info(f"Cleaned up old entries, keeping {len(FEED_ENTRIES)} entries")
-    except Exception as e:
-        logger.error(f"Error during cleanup: {e}")
+# Served from memory, persisted by the feed store backend (FEED_STORE_BACKEND); keeps only the latest 20 entries
+TRANSLATIONS = feed_store.translations
 
 # Define models for the new OpenAI response format
 class MessageContent(BaseModel):
@@ -89,10 +81,7 @@ class TranslatedFeedEntryResponse(BaseModel):
     is_translated: bool
 
 @router.post("/ai_news_webhook", response_model=FeedEntryResponse)
-async def receive_news_webhook(
-    news_data: OpenAIWebhookRequest, 
-    background_tasks: BackgroundTasks
-):
+async def receive_news_webhook(news_data: OpenAIWebhookRequest):
     """
     Enhanced webhook endpoint to receive investment news updates from n8n with OpenAI format
     """
@@ -120,11 +109,8 @@ async def receive_news_webhook(
             timestamp=timestamp
         )
         
-        # Store in memory
-        FEED_ENTRIES.append(feed_entry.dict())
-        
-        # Schedule cleanup of old entries
-        background_tasks.add_task(cleanup_old_entries)
+        # Store in memory and write behind (older entries beyond the feed size drop off)
+        feed_store.add(feed_entry.dict())
         
         logger.info(f"Successfully added news entry from OpenAI format: {feed_entry.title}")
         
@@ -135,37 +121,56 @@ async def receive_news_webhook(
         raise HTTPException(status_code=500, detail=f"Error processing webhook: {str(e)}")
 
 @router.get("/feed_entries", response_model=List[TranslatedFeedEntryResponse])
-async def get_feed_entries(limit: int = 20, language: str = "en"):
+async def get_feed_entries(request: Request, limit: int = 20, language: str = "en"):
     """
     Get the latest feed entries for display in AI Feed
+    
+    Served from a prebuilt body per (language, limit) until the feed changes,
+    with an ETag so polling clients get 304 Not Modified.
     """
     try:
-        # Sort by created_at in descending order and limit
-        sorted_entries = sorted(FEED_ENTRIES, key=lambda x: x['created_at'], reverse=True)[:limit]
-        
-        translated_entries = []
+        cached = feed_store.cached_response(language, limit)
+        if cached is None:
+            version = feed_store.version
+            translated_entries = await build_feed_entries(limit, language)
+            body = json.dumps(
+                jsonable_encoder(translated_entries), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+            ).encode("utf-8")
+            cached = feed_store.cache_response(language, limit, body, version)
+            logger.info(f"Built feed response with {len(translated_entries)} entries in {language}")
         
-        for entry in sorted_entries:
-            # If language is Russian, attempt to get/create translation
-            if language == "ru":
-                translated_entry = await get_translated_entry(entry)
-                translated_entries.append(translated_entry)
-            else:
-                # Return original English entry
-                translated_entry = TranslatedFeedEntryResponse(
-                    **entry,
-                    language="en",
-                    is_translated=False
-                )
-                translated_entries.append(translated_entry)
-        
-        logger.info(f"Retrieved {len(translated_entries)} feed entries in {language}")
-        return translated_entries
+        body, etag = cached
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
         
     except Exception as e:
         logger.error(f"Error retrieving feed entries: {e}")
         raise HTTPException(status_code=500, detail=f"Error retrieving feed entries: {str(e)}")
 
+async def build_feed_entries(limit: int, language: str) -> List[TranslatedFeedEntryResponse]:
+    """Latest feed entries, newest first, translated when language is ru"""
+    sorted_entries = feed_store.latest(limit)
+    
+    translated_entries = []
+    
+    for entry in sorted_entries:
+        # If language is Russian, attempt to get/create translation
+        if language == "ru":
+            translated_entry = await get_translated_entry(entry)
+            translated_entries.append(translated_entry)
+        else:
+            # Return original English entry
+            translated_entry = TranslatedFeedEntryResponse(
+                **entry,
+                language="en",
+                is_translated=False
+            )
+            translated_entries.append(translated_entry)
+    
+    return translated_entries
+
 async def get_translated_entry(entry: dict) -> TranslatedFeedEntryResponse:
     """Get or create translated version of a feed entry"""
     try:
@@ -202,13 +207,13 @@ async def get_translated_entry(entry: dict) -> TranslatedFeedEntryResponse:
         # Translate the content
         translation = await translate_to_russian(api_key, entry['title'], entry['summary'], entry['source'])
         
-        # Cache the translation
-        TRANSLATIONS[f"{entry_id}_ru"] = {
+        # Cache the translation (written behind to the feed store)
+        feed_store.set_translation(entry_id, "ru", {
             "title": translation['title'],
             "summary": translation['summary'],
             "source": translation['source'],
             "created_at": datetime.utcnow().isoformat()
-        }
+        })
         
         # Return translated entry
         return TranslatedFeedEntryResponse(
@@ -260,7 +265,7 @@ async def translate_to_russian(api_key: str, title: str, summary: str, source: s
 async def get_feed_entries_count():
     """Get the total count of feed entries"""
     try:
-        count = len(FEED_ENTRIES)
+        count = len(feed_store)
         return {"count": count}
     except Exception as e:
         logger.error(f"Error getting feed entries count: {e}")
@@ -280,12 +285,10 @@ async def get_translations_count():
 async def clear_all_feed_entries():
     """Clear all feed entries and translations (for testing purposes)"""
     try:
-        global FEED_ENTRIES, TRANSLATIONS
-        entries_count = len(FEED_ENTRIES)
+        entries_count = len(feed_store)
         translations_count = len(TRANSLATIONS)
         
-        FEED_ENTRIES.clear()
-        TRANSLATIONS.clear()
+        feed_store.clear()
         
         logger.info(f"Cleared {entries_count} feed entries and {translations_count} translations")
         return {
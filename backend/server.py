@@ -6,6 +6,7 @@ from fastapi.middleware.cors import CORSMiddleware
 import sys
 import os
 import logging
+import asyncio
 import time
 
 # Add the backend directory to Python path
@@ -18,13 +19,21 @@ from pathlib import Path
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Structured, queue-backed logging; installed before the routes so their
+# module-level logging and print() output go through it
+from logging_config import setup_logging, stop_logging, log_request
+setup_logging()
+
 # Import routes (using httpx-based supabase client - no Rust dependencies)
+from supabase_client import close_supabase_clients
+from services.event_bus import event_bus
+from services.sheets_executor import sheets_executor
+from services.webhook_queue import webhook_queue
+from services.feed_store import feed_store
 from routes import auth, webhook, verification, ai_bots, nowpayments, google_sheets, custom_urls, ai_bot_chat_fixed as ai_bot_chat
 # Crypto payments temporarily disabled due to pydantic v2 conflicts
 # from routes import crypto_payments
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Environment configuration
@@ -40,29 +49,48 @@ app = FastAPI(
     redoc_url="/redoc" if ENVIRONMENT == "development" else None
 )
 
-# Request logging middleware
+# Lifecycle events
+_background_tasks = set()
+
+@app.on_event("startup")
+async def startup_event():
+    """Start the webhook queue workers, warm-load the AI feed and warm the NowPayments reference data cache without holding up startup"""
+    await webhook_queue.start()
+    await feed_store.start()
+    task = asyncio.create_task(nowpayments.warm_reference_cache())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the webhook workers, let in-flight event subscribers finish, flush the feed store, stop the Sheets pool and release pooled Supabase connections"""
+    await webhook_queue.stop()
+    await event_bus.drain()
+    await feed_store.stop()
+    sheets_executor.shutdown()
+    await close_supabase_clients()
+    logger.info("Supabase connection pools closed")
+    stop_logging()
+
+# Request logging middleware - one structured line per request
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    
-    # Log incoming request
-    print(f"\n🌐 INCOMING REQUEST:")
-    print(f"   Method: {request.method}")
-    print(f"   URL: {request.url}")
-    print(f"   Path: {request.url.path}")
-    print(f"   Query: {request.url.query}")
-    print(f"   Headers: {dict(request.headers)}")
-    
-    response = await call_next(request)
-    
-    # Log response
-    process_time = time.time() - start_time
-    print(f"📤 RESPONSE:")
-    print(f"   Status: {response.status_code}")
-    print(f"   Process time: {process_time:.4f}s")
-    print("=" * 60)
-    
-    return response
+    start_time = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        log_request(
+            request.method,
+            request.url.path,
+            status_code,
+            time.perf_counter() - start_time,
+            query=request.url.query,
+            client=request.client.host if request.client else None,
+            user_agent=request.headers.get("user-agent")
+        )
 
 # CORS middleware - configured for production
 allowed_origins = [
@@ -241,5 +269,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=port,
         reload=ENVIRONMENT == "development",
-        log_level="info"
+        log_level="info",
+        access_log=False  # requests are logged by log_requests
     )
\ No newline at end of file
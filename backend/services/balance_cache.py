@@ -0,0 +1,54 @@
+import os
+from typing import Any, Dict, Optional
+
+from services.ttl_cache import TTLCache
+
+# Short safety net only: every code path that moves money writes through
+# (or invalidates) explicitly, the TTL just bounds drift from writes made
+# by other processes or directly in the database.
+BALANCE_CACHE_TTL = float(os.environ.get("BALANCE_CACHE_TTL", 15.0))
+
+_UNSET = object()
+_balances = TTLCache(ttl=BALANCE_CACHE_TTL)
+
+async def get_cached_balance(user_id: str) -> Optional[Dict[str, Any]]:
+    """{'balance': float, 'currency': str} for the user, or None if they have no account row.
+
+    Served from memory while fresh; lookup failures are not cached.
+    """
+    cached = _balances.get(user_id, _UNSET)
+    if cached is not _UNSET:
+        return dict(cached) if cached else None
+
+    from supabase_client import supabase_admin
+
+    response = await supabase_admin.table('user_accounts')\
+        .select('balance, currency')\
+        .eq('user_id', user_id)\
+        .execute_async()
+
+    if response.error:
+        raise RuntimeError(f"Failed to read balance: {response.error}")
+
+    account = None
+    if response.data:
+        row = response.data[0]
+        account = {
+            'balance': float(row['balance']) if row.get('balance') else 0.0,
+            'currency': row.get('currency') or 'USD'
+        }
+    _balances.set(user_id, account)
+    return dict(account) if account else None
+
+def set_cached_balance(user_id: str, balance, currency: str = 'USD'):
+    """Write-through after a balance change whose result is known"""
+    if not user_id or balance is None:
+        return
+    _balances.set(user_id, {'balance': float(balance), 'currency': currency or 'USD'})
+
+def invalidate_balance(user_id: Optional[str] = None):
+    """Forget one user's balance (or all) after a change made without a known result"""
+    _balances.invalidate(user_id)
+
+def balance_cache_stats() -> Dict[str, Any]:
+    return _balances.stats()
@@ -0,0 +1,130 @@
+"""
+In-process domain event bus.
+
+Routes publish what happened (a profile changed, a purchase completed, ...)
+and side effects such as the Google Sheets sync subscribe to it, instead of
+the route calling our own HTTP endpoints. Subscribers run as asyncio tasks
+after publish() returns, so they never add latency to the request that
+raised the event, and a failing subscriber is logged without affecting the
+publisher or the other subscribers.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, DefaultDict, Dict, List, Optional, Set, Type
+
+logger = logging.getLogger(__name__)
+
+class DomainEvent:
+    """Base class for everything published on the bus"""
+
+@dataclass(frozen=True)
+class ProfileChanged(DomainEvent):
+    user_id: str
+    action: str  # created | updated | oauth_created
+
+@dataclass(frozen=True)
+class AccountDeleted(DomainEvent):
+    user_id: str
+
+@dataclass(frozen=True)
+class PurchaseCompleted(DomainEvent):
+    buyer_id: str
+    seller_id: str
+    product_id: Optional[str] = None
+    transaction_id: Optional[str] = None
+    amount: float = 0.0
+
+@dataclass(frozen=True)
+class SubscriptionActivated(DomainEvent):
+    user_id: str
+    plan_type: str
+    payment_id: Optional[str] = None
+    amount: float = 0.0
+
+Handler = Callable[[DomainEvent], Awaitable[Any]]
+
+class EventBus:
+    """Typed publish/subscribe with async, fire-and-forget subscribers"""
+
+    def __init__(self):
+        self._handlers: DefaultDict[Type[DomainEvent], List[Handler]] = defaultdict(list)
+        self._pending: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.handled = 0
+        self.failed = 0
+
+    def subscribe(self, event_type: Type[DomainEvent], handler: Handler):
+        """Run handler(event) for every published event of event_type (or a subclass)"""
+        with self._lock:
+            if handler not in self._handlers[event_type]:
+                self._handlers[event_type].append(handler)
+
+    def on(self, *event_types: Type[DomainEvent]):
+        """Decorator form of subscribe() for one or more event types"""
+        def register(handler: Handler) -> Handler:
+            for event_type in event_types:
+                self.subscribe(event_type, handler)
+            return handler
+        return register
+
+    def _handlers_for(self, event: DomainEvent) -> List[Handler]:
+        with self._lock:
+            handlers = []
+            for event_type, registered in self._handlers.items():
+                if isinstance(event, event_type):
+                    handlers.extend(h for h in registered if h not in handlers)
+            return handlers
+
+    def publish(self, event: DomainEvent) -> int:
+        """Schedule every subscriber of the event; returns how many were scheduled.
+
+        Must be called from the event loop (any async route). Nothing is
+        awaited here, so the caller's response is not held up.
+        """
+        self.published += 1
+        handlers = self._handlers_for(event)
+        if not handlers:
+            return 0
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning(f"No running event loop, dropping {type(event).__name__}")
+            return 0
+
+        for handler in handlers:
+            task = loop.create_task(self._run(handler, event))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+        return len(handlers)
+
+    async def _run(self, handler: Handler, event: DomainEvent):
+        try:
+            await handler(event)
+            self.handled += 1
+        except Exception:
+            self.failed += 1
+            logger.exception(f"Subscriber {getattr(handler, '__name__', handler)} failed for {event!r}")
+
+    async def drain(self, timeout: float = 10.0):
+        """Wait for in-flight subscribers (call on shutdown)"""
+        if self._pending:
+            await asyncio.wait(list(self._pending), timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            subscribers = {event_type.__name__: len(handlers) for event_type, handlers in self._handlers.items()}
+        return {
+            "subscribers": subscribers,
+            "published": self.published,
+            "handled": self.handled,
+            "failed": self.failed,
+            "pending": len(self._pending)
+        }
+
+event_bus = EventBus()
@@ -0,0 +1,289 @@
+"""
+Persistence backends for the AI feed (FeedStore).
+
+  memory   - nothing persisted (single worker, lost on restart)
+  sqlite   - local SQLite file (WAL, memory-mapped reads) shared by every
+             worker on the host and kept across restarts
+  supabase - the news_feed / translations tables, shared by every instance
+
+Backends are only touched by FeedStore's write-behind writer, its startup
+warm load and its periodic change check (marker()); requests are served
+from memory.
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+FEED_STORE_BACKEND = os.getenv("FEED_STORE_BACKEND", "sqlite")
+FEED_STORE_PATH = os.getenv(
+    "FEED_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "feed_store.db")
+)
+FEED_STORE_MMAP_BYTES = 16 * 1024 * 1024
+
+Loaded = Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]
+
+def _to_datetime(value) -> Any:
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return value
+    return value
+
+def _naive_utc(value) -> Any:
+    """created_at as naive UTC, like FeedEntry's default, so entries stay comparable"""
+    value = _to_datetime(value)
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _isoformat(value) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class MemoryFeedBackend:
+    name = "memory"
+
+    async def load(self, limit: int) -> Loaded:
+        return [], {}
+
+    async def marker(self) -> Any:
+        return None
+
+    async def save_entry(self, entry: Dict[str, Any], keep: int):
+        pass
+
+    async def save_translation(self, key: str, entry_id: str, language: str, translation: Dict[str, Any]):
+        pass
+
+    async def clear(self):
+        pass
+
+class SQLiteFeedBackend:
+    """Feed rows in a local SQLite file; feed_meta.version changes on every write"""
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA mmap_size={FEED_STORE_MMAP_BYTES}")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS feed_entries (
+                id TEXT PRIMARY KEY,
+                created_at TEXT NOT NULL,
+                entry TEXT NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_feed_entries_created ON feed_entries (created_at)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS feed_translations (
+                key TEXT PRIMARY KEY,
+                entry_id TEXT NOT NULL,
+                translation TEXT NOT NULL
+            )""")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS feed_meta (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO feed_meta (id, version) VALUES (1, 0)")
+        self._conn.commit()
+
+    def _run(self, fn, *args):
+        with self._lock:
+            try:
+                result = fn(*args)
+                self._conn.commit()
+                return result
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def _bump(self):
+        self._conn.execute("UPDATE feed_meta SET version = version + 1 WHERE id = 1")
+
+    async def load(self, limit: int) -> Loaded:
+        def read():
+            entries = []
+            for (raw,) in self._conn.execute("SELECT entry FROM feed_entries ORDER BY created_at DESC LIMIT ?", (limit,)):
+                entry = json.loads(raw)
+                entry['timestamp'] = _to_datetime(entry.get('timestamp'))
+                entry['created_at'] = _naive_utc(entry.get('created_at'))
+                entries.append(entry)
+            translations = {key: json.loads(raw) for key, raw in self._conn.execute("SELECT key, translation FROM feed_translations")}
+            return entries, translations
+        return await asyncio.to_thread(self._run, read)
+
+    async def marker(self) -> Any:
+        return await asyncio.to_thread(self._run, lambda: self._conn.execute("SELECT version FROM feed_meta WHERE id = 1").fetchone()[0])
+
+    async def save_entry(self, entry: Dict[str, Any], keep: int):
+        def write():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO feed_entries (id, created_at, entry) VALUES (?, ?, ?)",
+                (entry['id'], _isoformat(entry['created_at']), json.dumps(entry, default=_isoformat))
+            )
+            # Same window as the in-memory feed
+            self._conn.execute(
+                "DELETE FROM feed_entries WHERE id NOT IN (SELECT id FROM feed_entries ORDER BY created_at DESC LIMIT ?)", (keep,)
+            )
+            self._conn.execute("DELETE FROM feed_translations WHERE entry_id NOT IN (SELECT id FROM feed_entries)")
+            self._bump()
+        await asyncio.to_thread(self._run, write)
+
+    async def save_translation(self, key: str, entry_id: str, language: str, translation: Dict[str, Any]):
+        def write():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO feed_translations (key, entry_id, translation) VALUES (?, ?, ?)",
+                (key, entry_id, json.dumps(translation, default=_isoformat))
+            )
+            self._bump()
+        await asyncio.to_thread(self._run, write)
+
+    async def clear(self):
+        def write():
+            self._conn.execute("DELETE FROM feed_entries")
+            self._conn.execute("DELETE FROM feed_translations")
+            self._bump()
+        await asyncio.to_thread(self._run, write)
+
+class SupabaseFeedBackend:
+    """news_feed / translations tables; the newest news_feed row and translation are the change marker"""
+    name = "supabase"
+
+    def __init__(self):
+        # Entry id -> id of the news_feed row already holding the same headline
+        self._stored_ids: "OrderedDict[str, str]" = OrderedDict()
+
+    async def load(self, limit: int) -> Loaded:
+        from supabase_client import supabase_admin
+
+        rows = await supabase_admin.table('news_feed')\
+            .select('id, title, summary, sentiment, source, published_at, created_at')\
+            .order('created_at', desc=True)\
+            .limit(limit)\
+            .execute_async()
+        if rows.error:
+            raise RuntimeError(f"Failed to read news_feed: {rows.error}")
+
+        entries = [{
+            'id': row['id'],
+            'title': row['title'],
+            'summary': row['summary'],
+            'sentiment': row.get('sentiment') or 0,
+            'source': row.get('source') or '',
+            'timestamp': _to_datetime(row.get('published_at') or row['created_at']),
+            'created_at': _naive_utc(row['created_at'])
+        } for row in rows.data or []]
+
+        translations = {}
+        if entries:
+            sources = {entry['id']: entry['source'] for entry in entries}
+            result = await supabase_admin.table('translations')\
+                .select('news_feed_id, language, title_translated, summary_translated, created_at')\
+                .in_('news_feed_id', list(sources))\
+                .execute_async()
+            if result.error:
+                raise RuntimeError(f"Failed to read translations: {result.error}")
+            for row in result.data or []:
+                translations[f"{row['news_feed_id']}_{row['language']}"] = {
+                    'title': row['title_translated'],
+                    'summary': row['summary_translated'],
+                    'source': sources.get(row['news_feed_id'], ''),
+                    'created_at': row.get('created_at')
+                }
+        return entries, translations
+
+    async def marker(self) -> Any:
+        from supabase_client import supabase_admin
+
+        newest = {}
+        for table, column in (('news_feed', 'id'), ('translations', 'created_at')):
+            result = await supabase_admin.table(table)\
+                .select(column)\
+                .order('created_at', desc=True)\
+                .limit(1)\
+                .execute_async()
+            if result.error:
+                raise RuntimeError(f"Failed to read {table}: {result.error}")
+            newest[table] = result.data[0][column] if result.data else None
+        return newest['news_feed'], newest['translations']
+
+    async def save_entry(self, entry: Dict[str, Any], keep: int):
+        from supabase_client import supabase_admin
+
+        created_at = entry['created_at']
+        if isinstance(created_at, datetime) and created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        content_hash = hashlib.sha256(f"{entry['title']}\n{entry['summary']}".encode()).hexdigest()
+        # news_feed is the permanent archive: nothing is pruned, identical news is stored once
+        result = await supabase_admin.table('news_feed')\
+            .upsert({
+                'id': entry['id'],
+                'title': entry['title'],
+                'summary': entry['summary'],
+                'sentiment': entry['sentiment'],
+                'source': entry['source'],
+                'original_language': 'en',
+                'content_hash': content_hash,
+                'published_at': _isoformat(entry['timestamp']),
+                'created_at': _isoformat(created_at)
+            }, on_conflict='content_hash', ignore_duplicates=True)\
+            .execute_async()
+        if result.error:
+            raise RuntimeError(f"Failed to write news_feed: {result.error}")
+        if result.data:
+            return
+
+        # A duplicate keeps the stored row and its id; translations must reference that row
+        stored = await supabase_admin.table('news_feed')\
+            .select('id')\
+            .eq('content_hash', content_hash)\
+            .limit(1)\
+            .execute_async()
+        if stored.error or not stored.data:
+            raise RuntimeError(f"Failed to resolve news_feed id: {stored.error or 'row not found'}")
+        if stored.data[0]['id'] != entry['id']:
+            self._stored_ids[entry['id']] = stored.data[0]['id']
+            while len(self._stored_ids) > keep:
+                self._stored_ids.popitem(last=False)
+
+    async def save_translation(self, key: str, entry_id: str, language: str, translation: Dict[str, Any]):
+        from supabase_client import supabase_admin
+
+        result = await supabase_admin.table('translations')\
+            .upsert({
+                'news_feed_id': self._stored_ids.get(entry_id, entry_id),
+                'language': language,
+                'title_translated': translation['title'],
+                'summary_translated': translation['summary'],
+                # Stamped on every write so a re-translation moves marker() too
+                'created_at': datetime.now(timezone.utc).isoformat()
+            }, on_conflict='news_feed_id,language', returning='minimal')\
+            .execute_async()
+        if result.error:
+            raise RuntimeError(f"Failed to write translation: {result.error}")
+
+    async def clear(self):
+        # The archive is shared with the frontend and other instances; never wiped from here
+        print("⚠️ Feed cleared in this worker only; news_feed rows are kept")
+
+def open_feed_backend(name: str = FEED_STORE_BACKEND, path: str = FEED_STORE_PATH):
+    """The configured backend, or the memory backend if it cannot be opened"""
+    try:
+        if name == "sqlite" and path:
+            return SQLiteFeedBackend(path)
+        if name == "supabase":
+            return SupabaseFeedBackend()
+        if name not in ("memory", "sqlite"):
+            print(f"⚠️ Unknown FEED_STORE_BACKEND '{name}', keeping the feed in memory")
+    except Exception as e:
+        print(f"⚠️ Feed store '{name}' unavailable ({e}), keeping the feed in memory")
+    return MemoryFeedBackend()
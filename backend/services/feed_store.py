@@ -0,0 +1,208 @@
+"""
+AI feed storage and prebuilt feed responses.
+
+FeedStore keeps the newest FEED_MAX_ENTRIES entries in a bounded deque
+ordered newest first, so ingest is O(1) for the usual in-order webhook
+(out-of-order entries are placed by timestamp) and nothing is re-sorted
+per request. Serialized GET /feed_entries bodies are cached per
+(language, limit) with a content ETag and dropped whenever the feed
+changes.
+
+Entries and translations are persisted through a pluggable backend
+(services.feed_backends): changes are written behind by one background
+writer, the feed is warm-loaded on startup, and every FEED_SYNC_SECONDS
+each worker compares the backend's change marker and reloads when another
+worker (or instance) has written, so all workers serve the same feed
+without touching the backend per request.
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.feed_backends import MemoryFeedBackend, open_feed_backend
+
+logger = logging.getLogger(__name__)
+
+FEED_MAX_ENTRIES = int(os.getenv("FEED_MAX_ENTRIES", 20))
+FEED_SYNC_SECONDS = float(os.getenv("FEED_SYNC_SECONDS", 5))
+# Distinct (language, limit) responses kept prebuilt
+FEED_RESPONSE_CACHE_SIZE = 64
+
+class FeedStore:
+    def __init__(self, max_entries: int = FEED_MAX_ENTRIES, backend=None):
+        self.max_entries = max_entries
+        self.backend = backend or MemoryFeedBackend()
+        self._entries: deque = deque(maxlen=max_entries)  # newest first
+        self.translations: Dict[str, Dict[str, Any]] = {}  # "<entry id>_<language>" -> translation
+        self._responses: "OrderedDict[Tuple[str, int], Tuple[bytes, str]]" = OrderedDict()
+        self.version = 0
+        self.response_hits = 0
+        self.response_builds = 0
+        self._writes: "asyncio.Queue" = asyncio.Queue()
+        self._pending_writes = 0
+        self._marker: Any = None
+        self._tasks: List[asyncio.Task] = []
+        self.write_failures = 0
+        self.reloads = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, entry: Dict[str, Any]) -> bool:
+        """Insert an entry by created_at; False if it is older than a full feed keeps"""
+        created_at = entry['created_at']
+        if not self._entries or created_at >= self._entries[0]['created_at']:
+            self._entries.appendleft(entry)
+        else:
+            position = next((i for i, e in enumerate(self._entries) if created_at >= e['created_at']), len(self._entries))
+            if position == self.max_entries:
+                return False
+            if len(self._entries) == self.max_entries:
+                self._entries.pop()
+            self._entries.insert(position, entry)
+        self._changed()
+        self._write_behind("save_entry", entry, self.max_entries)
+        return True
+
+    def set_translation(self, entry_id: str, language: str, translation: Dict[str, Any]):
+        key = f"{entry_id}_{language}"
+        self.translations[key] = translation
+        self._write_behind("save_translation", key, entry_id, language, translation)
+
+    def latest(self, limit: int) -> List[Dict[str, Any]]:
+        """Newest entries first (same slicing semantics as a sorted list)"""
+        return list(self._entries)[:limit]
+
+    def clear(self):
+        self._entries.clear()
+        self.translations.clear()
+        self._changed()
+        self._write_behind("clear")
+
+    def _replace(self, entries: List[Dict[str, Any]], translations: Dict[str, Dict[str, Any]]):
+        """Swap in the feed as loaded from the backend"""
+        self._entries.clear()
+        self._entries.extend(sorted(entries, key=lambda e: e['created_at'], reverse=True)[:self.max_entries])
+        # In place: routes hold a reference to this dict
+        self.translations.clear()
+        self.translations.update(translations)
+        self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self._responses.clear()
+
+    def cached_response(self, language: str, limit: int) -> Optional[Tuple[bytes, str]]:
+        """(body, etag) of a prebuilt response for the current feed, if any"""
+        cached = self._responses.get((language, limit))
+        if cached is not None:
+            self._responses.move_to_end((language, limit))
+            self.response_hits += 1
+        return cached
+
+    def cache_response(self, language: str, limit: int, body: bytes, version: int) -> Tuple[bytes, str]:
+        """Keep a body built from feed `version`; returns (body, etag)"""
+        etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        self.response_builds += 1
+        # A body built while the feed changed underneath is served once, not cached
+        if version == self.version:
+            self._responses[(language, limit)] = (body, etag)
+            while len(self._responses) > FEED_RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+        return body, etag
+
+    def invalidate_responses(self):
+        """Drop prebuilt responses (e.g. after translations change)"""
+        self._responses.clear()
+
+    def _write_behind(self, operation: str, *args):
+        self._pending_writes += 1
+        self._writes.put_nowait((operation, args))
+
+    async def _writer(self):
+        while True:
+            operation, args = await self._writes.get()
+            try:
+                await getattr(self.backend, operation)(*args)
+            except Exception as e:
+                self.write_failures += 1
+                logger.error(f"Feed store {self.backend.name} {operation} failed: {e}")
+            finally:
+                self._pending_writes -= 1
+                self._writes.task_done()
+
+    async def _sync(self):
+        while True:
+            await asyncio.sleep(FEED_SYNC_SECONDS)
+            # Reloading with writes still queued would briefly drop them from the served feed
+            if self._pending_writes:
+                continue
+            try:
+                marker = await self.backend.marker()
+                if marker != self._marker and not self._pending_writes:
+                    entries, translations = await self.backend.load(self.max_entries)
+                    if not self._pending_writes:
+                        self._replace(entries, translations)
+                        self._marker = marker
+                        self.reloads += 1
+            except Exception as e:
+                logger.warning(f"Feed store {self.backend.name} sync failed: {e}")
+
+    async def start(self):
+        """Warm-load the feed from the backend and start the writer and sync loops"""
+        if self._tasks:
+            return
+        try:
+            entries, translations = await self.backend.load(self.max_entries)
+            self._marker = await self.backend.marker()
+            if entries or translations:
+                self._replace(entries, translations)
+            print(f"📰 Feed store ({self.backend.name}) loaded {len(self._entries)} entries, {len(self.translations)} translations")
+        except Exception as e:
+            print(f"⚠️ Feed store ({self.backend.name}) warm load failed: {e}")
+        self._tasks.append(asyncio.create_task(self._writer()))
+        if not isinstance(self.backend, MemoryFeedBackend):
+            self._tasks.append(asyncio.create_task(self._sync()))
+
+    async def stop(self, timeout: float = 10.0):
+        """Flush queued writes, then stop the background loops"""
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._writes.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Feed store stopped with {self._pending_writes} unwritten changes")
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "entries": len(self._entries),
+            "translations": len(self.translations),
+            "max_entries": self.max_entries,
+            "version": self.version,
+            "cached_responses": len(self._responses),
+            "response_hits": self.response_hits,
+            "response_builds": self.response_builds,
+            "pending_writes": self._pending_writes,
+            "write_failures": self.write_failures,
+            "reloads": self.reloads
+        }
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, lists and *)"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == etag:
+            return True
+    return False
+
+feed_store = FeedStore(backend=open_feed_backend())
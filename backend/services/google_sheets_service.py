@@ -5,8 +5,9 @@ Synchronizes data from Supabase to Google Sheets automatically
 
 import json
 import os
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 import asyncio
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
@@ -14,6 +15,58 @@ from googleapiclient.errors import HttpError
 import sys
 sys.path.append('/app/backend')
 from supabase_client import supabase_admin as supabase
+from services.sheets_executor import execute_request
+from services.sheet_row_index import SheetRowIndex, open_index_store, row_hash
+from services.user_snapshot import user_record, load_by_user, iter_auth_user_pages, iter_user_snapshot, iter_fallback_snapshot
+
+# Delta sync: push only rows whose content changed since the last run
+SHEETS_DELTA_SYNC = os.getenv("SHEETS_DELTA_SYNC", "true").lower() in ("1", "true", "yes")
+# A periodic full rewrite restores sort order and repairs manual edits to the sheet
+SHEETS_FULL_RESYNC_SECONDS = float(os.getenv("SHEETS_FULL_RESYNC_SECONDS", 6 * 3600))
+# Above this share of changed rows a full rewrite is cheaper than a delta
+SHEETS_DELTA_MAX_FRACTION = float(os.getenv("SHEETS_DELTA_MAX_FRACTION", 0.5))
+# updated_at filters reach back this far before the previous run started (clock skew)
+SHEETS_WATERMARK_SKEW_SECONDS = 60
+# Ranges per values().batchUpdate call, rows per values().update block on full rewrites
+SHEETS_BATCH_RANGES = 500
+SHEETS_WRITE_CHUNK = int(os.getenv("SHEETS_WRITE_CHUNK", 5000))
+
+USERS_SHEET_HEADERS = [
+    'User ID', 'Name', 'Email', 'Country', 
+    'Registration Date', 'Seller Status', 'Subscription Status',
+    'Plan Type', 'Subscription End Date', 'Total Commission Earned'
+]
+
+def _watermark_now() -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=SHEETS_WATERMARK_SKEW_SECONDS)).isoformat()
+
+def _row_runs(row_numbers: Iterable[int]) -> List[Tuple[int, int]]:
+    """Contiguous (first, last) runs of row numbers, bottom-most run first"""
+    runs = []
+    for row in sorted(row_numbers):
+        if runs and row == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], row)
+        else:
+            runs.append((row, row))
+    return runs[::-1]
+
+def _user_row(user: Dict[str, Any]) -> list:
+    return [
+        user.get('user_id', ''),
+        user.get('name', ''),
+        user.get('email', ''),
+        user.get('country', ''),
+        user.get('registration_date', ''),
+        user.get('seller_verification_status', ''),
+        user.get('subscription_status', ''),
+        user.get('plan_type', ''),
+        user.get('subscription_end_date', ''),
+        float(user.get('total_commission_earned', 0))
+    ]
+
+def _email_hash(values: list) -> str:
+    """Hash of the auth.users part of a users row (email, registration date)"""
+    return row_hash([values[2], values[4]])
 
 class GoogleSheetsService:
     def __init__(self):
@@ -25,7 +78,19 @@ class GoogleSheetsService:
             'https://www.googleapis.com/auth/spreadsheets',
             'https://www.googleapis.com/auth/drive'
         ]
+        # Row indexes behind delta syncs and deletions (persisted across restarts);
+        # one sync per sheet at a time
+        index_store = open_index_store()
+        self._users_index = SheetRowIndex('users', index_store)
+        self._monthly_index = SheetRowIndex('monthly_reports', index_store)
+        self._users_lock = threading.Lock()
+        self._balance_lock = threading.Lock()
+        self.last_sync: Dict[str, Dict[str, Any]] = {}
         
+    def _execute(self, request):
+        """Run a Sheets API request under the shared rate limit with retries (blocking)"""
+        return execute_request(request, self.credentials)
+    
     def authenticate(self):
         """Authenticate with Google Sheets API using service account credentials from environment variables ONLY"""
         try:
@@ -73,13 +138,25 @@ class GoogleSheetsService:
             print("📋 Required variables: GOOGLE_PROJECT_ID, GOOGLE_PRIVATE_KEY_ID, GOOGLE_PRIVATE_KEY, GOOGLE_CLIENT_EMAIL, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_X509_CERT_URL")
             return False
     
-    def sync_company_balance(self):
+    def sync_company_balance(self, full: bool = False):
         """Sync company balance data to Google Sheets"""
         try:
             if not self.service:
                 if not self.authenticate():
                     return False
             
+            with self._balance_lock:
+                return self._sync_company_balance(full)
+            
+        except HttpError as e:
+            print(f"❌ Google Sheets API error: {e}")
+            return False
+        except Exception as e:
+            print(f"❌ Error syncing company balance: {str(e)}")
+            return False
+    
+    def _sync_company_balance(self, full: bool):
+        try:
             # Get company balance data
             balance_data = supabase.table('company_balance').select('*').execute()
             monthly_data = supabase.table('company_balance_monthly').select('*').order('report_month', desc=True).execute()
@@ -107,18 +184,13 @@ class GoogleSheetsService:
                 balance.get('currency', 'USD')
             ]
             
-            # Clear and update the current balance sheet
-            self.service.spreadsheets().values().clear(
-                spreadsheetId=self.balance_sheet_id,
-                range='Current Balance!A:Z'
-            ).execute()
-            
-            self.service.spreadsheets().values().update(
+            # Header and single data row always cover the same cells - no clear needed
+            self._execute(self.service.spreadsheets().values().update(
                 spreadsheetId=self.balance_sheet_id,
                 range='Current Balance!A1',
                 valueInputOption='RAW',
                 body={'values': [headers, current_data]}
-            ).execute()
+            ))
             
             # Update monthly reports if available
             if monthly_data.data:
@@ -128,7 +200,7 @@ class GoogleSheetsService:
                     'Active Subscribers', 'New Signups', 'Updated At'
                 ]
                 
-                monthly_rows = [monthly_headers]
+                monthly_rows = []
                 for month in monthly_data.data:
                     monthly_rows.append([
                         month.get('report_month', ''),
@@ -142,265 +214,301 @@ class GoogleSheetsService:
                         month.get('updated_at', '')
                     ])
                 
-                # Clear and update monthly reports
-                self.service.spreadsheets().values().clear(
-                    spreadsheetId=self.balance_sheet_id,
-                    range='Monthly Reports!A:Z'
-                ).execute()
+                keyed_rows = [(str(row[0]), row, None) for row in monthly_rows]
+                index = self._monthly_index
+                same_months = [key for key, _, _ in keyed_rows] == sorted(index.entries, key=lambda k: index.entries[k][0])
                 
-                self.service.spreadsheets().values().update(
-                    spreadsheetId=self.balance_sheet_id,
-                    range='Monthly Reports!A1',
-                    valueInputOption='RAW',
-                    body={'values': monthly_rows}
-                ).execute()
+                if SHEETS_DELTA_SYNC and not full and same_months and index.is_warm(SHEETS_FULL_RESYNC_SECONDS):
+                    # Same months in the same order: rewrite only reports whose figures moved
+                    changed = [(key, row, None) for key, row, _ in keyed_rows if index.get(key)[1] != row_hash(row)]
+                    calls = self._apply_row_delta(self.balance_sheet_id, None, 'Monthly Reports!', index, changed, [])
+                    index.mark_synced()
+                    print(f"✅ Monthly reports delta: {len(changed)} changed ({calls} API calls)")
+                else:
+                    # Clear and update monthly reports
+                    self._execute(self.service.spreadsheets().values().clear(
+                        spreadsheetId=self.balance_sheet_id,
+                        range='Monthly Reports!A:Z'
+                    ))
+                    
+                    self._execute(self.service.spreadsheets().values().update(
+                        spreadsheetId=self.balance_sheet_id,
+                        range='Monthly Reports!A1',
+                        valueInputOption='RAW',
+                        body={'values': [monthly_headers] + monthly_rows}
+                    ))
+                    index.rebuild(keyed_rows)
             
             print(f"✅ Company balance synced to Google Sheets successfully")
             return True
             
-        except HttpError as e:
-            print(f"❌ Google Sheets API error: {e}")
-            return False
-        except Exception as e:
-            print(f"❌ Error syncing company balance: {str(e)}")
-            return False
+        except Exception:
+            # Whatever was half-written, the next run starts from a full rewrite
+            self._monthly_index.discard()
+            raise
     
-    def sync_users_data(self):
-        """Sync users data to Google Sheets with emails from auth.users via RPC function"""
+    def sync_users_data(self, full: bool = False):
+        """Sync users data to Google Sheets with emails from auth.users via RPC function
+        
+        Once a full rewrite has indexed the sheet, runs push only the rows that
+        changed (see _sync_users_delta). full=True, a cold index or
+        SHEETS_FULL_RESYNC_SECONDS since the last rewrite clear and rewrite it.
+        """
         try:
             if not self.service:
                 if not self.authenticate():
                     return False
             
-            print("📊 Collecting user data using RPC function...")
+            with self._users_lock:
+                if SHEETS_DELTA_SYNC and not full and self._users_index.is_warm(SHEETS_FULL_RESYNC_SECONDS):
+                    try:
+                        synced = self._sync_users_delta()
+                        if synced is not None:
+                            return synced
+                    except Exception as delta_error:
+                        print(f"⚠️ Delta users sync failed, falling back to full rewrite: {delta_error}")
+                    self._users_index.discard()
+                return self._sync_users_full()
             
-            # Try to use the RPC function to get complete user data with emails
-            users_data = []
+        except HttpError as e:
+            print(f"❌ Google Sheets API error: {e}")
+            return False
+        except Exception as e:
+            print(f"❌ Error syncing users data: {str(e)}")
+            return False
+    
+    def _sync_users_full(self):
+        """Rewrite the users sheet from a streamed snapshot and rebuild the row index"""
+        try:
+            started = _watermark_now()
+            print("📊 Streaming user snapshot (auth.users pages joined with profiles and subscriptions)...")
             
             try:
-                print("🔍 Using working get_users_emails_simple() RPC function...")
-                emails_result = supabase.rpc('get_users_emails_simple').execute()
-                
-                if emails_result.data:
-                    print(f"✅ Simple RPC successful! Found {len(emails_result.data)} users with emails")
-                    
-                    # Get additional data manually
-                    profiles = supabase.table('user_profiles').select('*').execute()
-                    subscriptions = supabase.table('subscriptions').select('*').execute()
-                    
-                    profiles_data = profiles.data if profiles.data else []
-                    subscriptions_data = subscriptions.data if subscriptions.data else []
-                    
-                    print(f"📊 Combining {len(emails_result.data)} emails with {len(profiles_data)} profiles and {len(subscriptions_data)} subscriptions")
-                    
-                    for email_user in emails_result.data:
-                        user_id = email_user.get('user_id', '')
-                        
-                        # Find matching profile and subscription
-                        profile = next((p for p in profiles_data if p.get('user_id') == user_id), {})
-                        subscription = next((s for s in subscriptions_data if s.get('user_id') == user_id), {})
-                        
-                        users_data.append({
-                            'user_id': user_id,
-                            'name': profile.get('name', ''),
-                            'email': email_user.get('email', ''),  # Email from auth.users!
-                            'country': profile.get('country', ''),
-                            'phone': profile.get('phone', ''),
-                            'registration_date': email_user.get('created_at', ''),
-                            'seller_verification_status': profile.get('seller_verification_status', 'not_verified'),
-                            'plan_type': subscription.get('plan_type', 'free'),
-                            'subscription_status': subscription.get('status', 'inactive'),
-                            'subscription_end_date': subscription.get('end_date', ''),
-                            'total_commission_earned': 0
-                        })
-                else:
-                    print("⚠️ Simple RPC returned no data, falling back to manual method")
-                    raise Exception("No data from simple RPC")
-                    
-            except Exception as rpc_error:
-                print(f"⚠️ Complex RPC failed: {rpc_error}")
-                print("🔄 Trying simple RPC function get_users_emails_simple()...")
-                
-                try:
-                    # Fallback to simple RPC + manual joins
-                    emails_result = supabase.rpc('get_users_emails_simple').execute()
-                    
-                    if emails_result.data:
-                        print(f"✅ Simple RPC successful! Found {len(emails_result.data)} users with emails")
-                        
-                        # Get additional data manually
-                        profiles = supabase.table('user_profiles').select('*').execute()
-                        subscriptions = supabase.table('subscriptions').select('*').execute()
-                        
-                        profiles_data = profiles.data if profiles.data else []
-                        subscriptions_data = subscriptions.data if subscriptions.data else []
-                        
-                        for user in emails_result.data:
-                            user_id = user.get('user_id', '')
-                            
-                            # Find matching profile and subscription
-                            profile = next((p for p in profiles_data if p.get('user_id') == user_id), {})
-                            subscription = next((s for s in subscriptions_data if s.get('user_id') == user_id), {})
-                            
-                            users_data.append({
-                                'user_id': user_id,
-                                'name': profile.get('name', ''),
-                                'email': email_user.get('email', ''),  # Email from auth.users!
-                                'country': profile.get('country', ''),
-                                'registration_date': email_user.get('created_at', ''),
-                                'seller_verification_status': profile.get('seller_verification_status', 'not_verified'),
-                                'plan_type': subscription.get('plan_type', 'free'),
-                                'subscription_status': subscription.get('status', 'inactive'),
-                                'subscription_end_date': subscription.get('end_date', ''),
-                                'total_commission_earned': 0
-                            })
-                    else:
-                        print("❌ Simple RPC also returned no data")
-                        raise Exception("No data from simple RPC")
-                        
-                except Exception as simple_rpc_error:
-                    print(f"❌ Simple RPC also failed: {simple_rpc_error}")
-                    print("🔄 Falling back to manual data collection...")
-                    
-                    # Final fallback: use the original manual method
-                    users_data = self._fallback_manual_sync()
+                summary = self._write_users_sheet(iter_user_snapshot())
+            except Exception as snapshot_error:
+                print(f"⚠️ User snapshot failed: {snapshot_error}")
+                print("🔄 Falling back to manual data collection...")
+                summary = self._write_users_sheet(iter_fallback_snapshot())
             
-            if not users_data:
+            if not summary:
                 print("❌ No user data collected from any method")
                 return False
             
-            # Sort by registration date (newest first)
-            users_data.sort(key=lambda x: x.get('registration_date', ''), reverse=True)
-            
-            # Prepare headers for Google Sheets
-            headers = [
-                'User ID', 'Name', 'Email', 'Country', 
-                'Registration Date', 'Seller Status', 'Subscription Status',
-                'Plan Type', 'Subscription End Date', 'Total Commission Earned'
-            ]
-            
-            # Prepare data rows
-            rows = [headers]
-            for user in users_data:
-                rows.append([
-                    user.get('user_id', ''),
-                    user.get('name', ''),
-                    user.get('email', ''),
-                    user.get('country', ''),
-                    user.get('registration_date', ''),
-                    user.get('seller_verification_status', ''),
-                    user.get('subscription_status', ''),
-                    user.get('plan_type', ''),
-                    user.get('subscription_end_date', ''),
-                    float(user.get('total_commission_earned', 0))
-                ])
-            
-            # Clear and update the users sheet
-            self.service.spreadsheets().values().clear(
-                spreadsheetId=self.users_sheet_id,
-                range='A:Z'
-            ).execute()
-            
-            self.service.spreadsheets().values().update(
-                spreadsheetId=self.users_sheet_id,
-                range='A1',
-                valueInputOption='RAW',
-                body={'values': rows}
-            ).execute()
+            self._users_index.mark_synced(started, full=True)
+            self.last_sync['users'] = {"mode": "full", "rows": summary['total'], "at": datetime.now(timezone.utc).isoformat()}
             
-            print(f"✅ Users data synced to Google Sheets successfully ({len(users_data)} users)")
+            print(f"✅ Users data synced to Google Sheets successfully ({summary['total']} users)")
             
             # Print detailed summary
-            users_with_email = len([u for u in users_data if u.get('email')])
-            users_with_names = len([u for u in users_data if u.get('name')])
-            users_with_country = len([u for u in users_data if u.get('country')])
-            active_subs = len([u for u in users_data if u.get('subscription_status') == 'active'])
-            plus_users = len([u for u in users_data if u.get('plan_type') == 'plus'])
-            verified_sellers = len([u for u in users_data if u.get('seller_verification_status') == 'verified'])
-            
             print(f"   📊 DETAILED SUMMARY:")
-            print(f"   Total Users: {len(users_data)}")
-            print(f"   Users with Email: {users_with_email}")
-            print(f"   Users with Name: {users_with_names}")
-            print(f"   Users with Country: {users_with_country}")
-            print(f"   Active Subscriptions: {active_subs}")
-            print(f"   Plus Plan Users: {plus_users}")
-            print(f"   Verified Sellers: {verified_sellers}")
+            print(f"   Total Users: {summary['total']}")
+            print(f"   Users with Email: {summary['with_email']}")
+            print(f"   Users with Name: {summary['with_name']}")
+            print(f"   Users with Country: {summary['with_country']}")
+            print(f"   Active Subscriptions: {summary['active_subscriptions']}")
+            print(f"   Plus Plan Users: {summary['plus_users']}")
+            print(f"   Verified Sellers: {summary['verified_sellers']}")
             
             return True
             
         except HttpError as e:
             print(f"❌ Google Sheets API error: {e}")
+            self._users_index.discard()
             return False
         except Exception as e:
             print(f"❌ Error syncing users data: {str(e)}")
             import traceback
             traceback.print_exc()
+            self._users_index.discard()
             return False
-
-    def _fallback_manual_sync(self):
-        """Fallback method for manual data collection when RPC functions fail"""
-        print("📊 Using fallback manual data collection...")
+    
+    def _write_users_sheet(self, users: Iterable[Dict[str, Any]]) -> Optional[Dict[str, int]]:
+        """Write the header and one row per user in SHEETS_WRITE_CHUNK blocks.
         
-        try:
-            # Get data from individual tables
-            profiles = supabase.table('user_profiles').select('*').execute()
-            subscriptions = supabase.table('subscriptions').select('*').execute()
-            email_validations = supabase.table('subscription_email_validation').select('user_id, email').execute()
-            
-            profiles_data = profiles.data if profiles.data else []
-            subscriptions_data = subscriptions.data if subscriptions.data else []
-            email_validations_data = email_validations.data if email_validations.data else []
-            
-            # Collect all unique user IDs
-            all_user_ids = set()
-            for profile in profiles_data:
-                all_user_ids.add(profile.get('user_id'))
-            for subscription in subscriptions_data:
-                all_user_ids.add(subscription.get('user_id'))
-            for email_val in email_validations_data:
-                all_user_ids.add(email_val.get('user_id'))
-            
-            users_data = []
-            
-            for user_id in all_user_ids:
+        Rows overwrite the sheet in place and leftover rows below the new end
+        are cleared afterwards, so readers never see an empty sheet. Only one
+        block is held in memory; the row index is rebuilt as rows go out.
+        Returns summary counts, or None if there were no users (sheet untouched).
+        """
+        index = self._users_index
+        index.begin_rebuild()
+        summary = {'total': 0, 'with_email': 0, 'with_name': 0, 'with_country': 0,
+                   'active_subscriptions': 0, 'plus_users': 0, 'verified_sellers': 0}
+        block = [USERS_SHEET_HEADERS]
+        block_start = 1
+        
+        for user in users:
+            values = _user_row(user)
+            if not values[0] or index.get(values[0]):
+                continue  # one row per user
+            index.put(values[0], values, _email_hash(values))
+            block.append(values)
+            
+            summary['total'] += 1
+            summary['with_email'] += bool(user.get('email'))
+            summary['with_name'] += bool(user.get('name'))
+            summary['with_country'] += bool(user.get('country'))
+            summary['active_subscriptions'] += user.get('subscription_status') == 'active'
+            summary['plus_users'] += user.get('plan_type') == 'plus'
+            summary['verified_sellers'] += user.get('seller_verification_status') == 'verified'
+            
+            if len(block) >= SHEETS_WRITE_CHUNK:
+                self._write_block(self.users_sheet_id, f"A{block_start}", block)
+                block_start += len(block)
+                block = []
+        
+        if not summary['total']:
+            index.discard()
+            return None
+        if block:
+            self._write_block(self.users_sheet_id, f"A{block_start}", block)
+            block_start += len(block)
+        
+        # Drop whatever the previous, longer sheet had below the new last row
+        self._execute(self.service.spreadsheets().values().clear(
+            spreadsheetId=self.users_sheet_id,
+            range=f"A{block_start}:Z"
+        ))
+        return summary
+    
+    def _write_block(self, spreadsheet_id: str, start_range: str, rows: List[list]):
+        self._execute(self.service.spreadsheets().values().update(
+            spreadsheetId=spreadsheet_id,
+            range=start_range,
+            valueInputOption='RAW',
+            body={'values': rows}
+        ))
+    
+    def _sync_users_delta(self) -> Optional[bool]:
+        """Push only users whose row changed since the last run.
+        
+        Profiles and subscriptions are read from the updated_at watermark on;
+        auth.users is streamed page by page to catch sign-ups, deletions and
+        email changes, keeping only the ids seen and the changed users.
+        Changed rows go out in values().batchUpdate calls and removed users'
+        rows in one deleteDimension batchUpdate.
+        Returns None when a full rewrite is needed instead.
+        """
+        index = self._users_index
+        started = _watermark_now()
+        
+        profiles, subscriptions = supabase.gather_sync(
+            supabase.table('user_profiles').select('*').gte('updated_at', index.watermark),
+            supabase.table('subscriptions').select('*').gte('updated_at', index.watermark)
+        )
+        if profiles.error or subscriptions.error:
+            print("⚠️ Delta sources unavailable, doing a full users sync")
+            return None
+        
+        profiles_by_user = {p['user_id']: p for p in profiles.data or [] if p.get('user_id')}
+        subscriptions_by_user = {s['user_id']: s for s in subscriptions.data or [] if s.get('user_id')}
+        touched = set(profiles_by_user) | set(subscriptions_by_user)
+        max_changes = max(50, len(index.entries) * SHEETS_DELTA_MAX_FRACTION)
+        
+        seen = set()
+        candidates: Dict[str, Dict[str, Any]] = {}
+        for page in iter_auth_user_pages():
+            for email_user in page:
+                user_id = email_user.get('user_id')
                 if not user_id:
                     continue
-                
-                profile = next((p for p in profiles_data if p.get('user_id') == user_id), {})
-                subscription = next((s for s in subscriptions_data if s.get('user_id') == user_id), {})
-                email_validation = next((e for e in email_validations_data if e.get('user_id') == user_id), {})
-                
-                # Get best available email (from email validation table)
-                email = email_validation.get('email', '')
-                
-                users_data.append({
-                    'user_id': user_id,
-                    'name': profile.get('name', ''),
-                    'email': email,
-                    'country': profile.get('country', ''),
-                    'registration_date': profile.get('created_at', '') or subscription.get('created_at', ''),
-                    'seller_verification_status': profile.get('seller_verification_status', 'not_verified'),
-                    'plan_type': subscription.get('plan_type', 'free'),
-                    'subscription_status': subscription.get('status', 'inactive'),
-                    'subscription_end_date': subscription.get('end_date', ''),
-                    'total_commission_earned': 0
-                })
-            
-            print(f"✅ Fallback method collected {len(users_data)} users")
-            return users_data
-            
-        except Exception as e:
-            print(f"❌ Fallback method also failed: {e}")
-            return []
+                seen.add(user_id)
+                entry = index.get(user_id)
+                if user_id in touched or entry is None or \
+                        entry[2] != row_hash([email_user.get('email', ''), email_user.get('created_at', '')]):
+                    candidates[user_id] = email_user
+            if len(candidates) > max_changes:
+                print(f"📊 Over {len(candidates)} users changed, a full rewrite is cheaper")
+                return None
+        
+        if not seen:
+            print("⚠️ No auth users returned, doing a full users sync")
+            return None
+        removed = [user_id for user_id in index.entries if user_id not in seen]
+        if len(candidates) + len(removed) > max_changes:
+            print(f"📊 {len(candidates) + len(removed)} users changed, a full rewrite is cheaper")
+            return None
+        
+        # Each changed user also needs the half of their row that did not change
+        load_by_user('user_profiles', candidates.keys() - profiles_by_user.keys(), profiles_by_user)
+        load_by_user('subscriptions', candidates.keys() - subscriptions_by_user.keys(), subscriptions_by_user)
+        
+        changed = []
+        added = 0
+        # Oldest first, so users new since the last rewrite are appended in sign-up order
+        for user_id in sorted(candidates, key=lambda uid: candidates[uid].get('created_at') or ''):
+            values = _user_row(user_record(candidates[user_id], profiles_by_user.get(user_id, {}), subscriptions_by_user.get(user_id, {})))
+            entry = index.get(user_id)
+            if entry is None or entry[1] != row_hash(values):
+                added += entry is None
+                changed.append((user_id, values, _email_hash(values)))
+        
+        calls = self._apply_row_delta(self.users_sheet_id, 0, '', index, changed, removed) if changed or removed else 0
+        index.mark_synced(started)
+        self.last_sync['users'] = {
+            "mode": "delta",
+            "updated": len(changed) - added,
+            "added": added,
+            "removed": len(removed),
+            "api_calls": calls,
+            "at": datetime.now(timezone.utc).isoformat()
+        }
+        print(f"✅ Users delta sync: {len(changed) - added} updated, {added} added, {len(removed)} removed ({calls} API calls)")
+        return True
+    
+    def _apply_row_delta(self, spreadsheet_id: str, sheet_gid: Optional[int], range_prefix: str,
+                         index: SheetRowIndex, changed: List[Tuple[str, list, Optional[str]]], removed: List[str]) -> int:
+        """Delete removed keys' rows, then write changed and new rows; returns API calls made"""
+        calls = 0
+        rows_to_delete = [index.get(key)[0] for key in removed if index.get(key)]
+        if rows_to_delete:
+            # Bottom-most first so earlier deletions do not shift later ones
+            requests = [{
+                'deleteDimension': {
+                    'range': {
+                        'sheetId': sheet_gid,
+                        'dimension': 'ROWS',
+                        'startIndex': first - 1,  # 0-indexed for API
+                        'endIndex': last  # Exclusive end
+                    }
+                }
+            } for first, last in _row_runs(rows_to_delete)]
+            self._execute(self.service.spreadsheets().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'requests': requests}
+            ))
+            calls += 1
+            index.remove(removed)
+        
+        data = [{
+            'range': f"{range_prefix}A{index.put(key, values, source_hash)}",
+            'values': [values]
+        } for key, values, source_hash in changed]
+        for start in range(0, len(data), SHEETS_BATCH_RANGES):
+            self._execute(self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'valueInputOption': 'RAW', 'data': data[start:start + SHEETS_BATCH_RANGES]}
+            ))
+            calls += 1
+        return calls
+    
+    def sync_status(self) -> Dict[str, Any]:
+        """Row index and last-run summary for /google-sheets/status"""
+        return {
+            "delta_enabled": SHEETS_DELTA_SYNC,
+            "full_resync_seconds": SHEETS_FULL_RESYNC_SECONDS,
+            "users_index": self._users_index.status(),
+            "monthly_index": self._monthly_index.status(),
+            "last_sync": self.last_sync
+        }
     
-    def sync_all_data(self):
+    def sync_all_data(self, full: bool = False):
         """Sync all data to Google Sheets"""
         try:
             print("🔄 Starting Google Sheets sync...")
             
-            balance_success = self.sync_company_balance()
-            users_success = self.sync_users_data()
+            balance_success = self.sync_company_balance(full)
+            users_success = self.sync_users_data(full)
             
             if balance_success and users_success:
                 print("✅ All data synced to Google Sheets successfully")
@@ -414,7 +522,14 @@ class GoogleSheetsService:
             return False
 
     def delete_user_from_sheets(self, user_id: str, user_email: str = None):
-        """Delete a specific user from Google Sheets"""
+        """Delete a specific user from Google Sheets
+        
+        The row comes from the persistent row index and is confirmed with a
+        one-cell read before a single deleteDimension batchUpdate, so the
+        cost does not grow with the sheet. A cold or out-of-step index (or
+        an email to match as well) falls back to scanning the User ID and
+        Email columns, which also re-points the index.
+        """
         try:
             if not self.service:
                 if not self.authenticate():
@@ -422,83 +537,88 @@ class GoogleSheetsService:
             
             print(f"🗑️ Deleting user {user_id} from Google Sheets...")
             
-            # Get current sheet data
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.users_sheet_id,
-                range='A:Z'
-            ).execute()
-            
-            values = result.get('values', [])
-            
-            if not values:
-                print("⚠️ No data found in Google Sheets")
-                return False
-            
-            # Find the row with the user to delete
-            headers = values[0] if values else []
-            user_id_col = None
-            email_col = None
-            
-            # Find User ID and Email column indexes
-            for i, header in enumerate(headers):
-                if header.lower() in ['user id', 'user_id']:
-                    user_id_col = i
-                elif header.lower() == 'email':
-                    email_col = i
-            
-            if user_id_col is None:
-                print("❌ Could not find User ID column in Google Sheets")
-                return False
-            
-            # Find rows to delete (by user_id or email)
-            rows_to_delete = []
-            for i, row in enumerate(values[1:], 1):  # Skip header row
-                if len(row) > user_id_col:
-                    # Check if this row matches the user to delete
-                    row_user_id = row[user_id_col] if user_id_col < len(row) else ''
-                    row_email = row[email_col] if email_col is not None and email_col < len(row) else ''
-                    
-                    if row_user_id == user_id or (user_email and row_email == user_email):
-                        rows_to_delete.append(i + 1)  # +1 for sheet row number (1-indexed)
-                        print(f"📍 Found user data at row {i + 1}: {row_user_id} / {row_email}")
-            
-            if not rows_to_delete:
-                print(f"⚠️ No rows found for user {user_id} in Google Sheets")
-                return True  # Not an error if user not in sheets
-            
-            # Delete rows (start from the end to avoid index shifting)
-            for row_num in sorted(rows_to_delete, reverse=True):
-                try:
-                    # Delete the row
-                    delete_request = {
-                        'requests': [{
-                            'deleteDimension': {
-                                'range': {
-                                    'sheetId': 0,  # Assuming first sheet
-                                    'dimension': 'ROWS',
-                                    'startIndex': row_num - 1,  # 0-indexed for API
-                                    'endIndex': row_num  # Exclusive end
-                                }
-                            }
-                        }]
-                    }
-                    
-                    self.service.spreadsheets().batchUpdate(
+            with self._users_lock:
+                index = self._users_index
+                rows_to_delete = []
+                entry = index.get(user_id)
+                
+                if entry and not user_email:
+                    result = self._execute(self.service.spreadsheets().values().get(
                         spreadsheetId=self.users_sheet_id,
-                        body=delete_request
-                    ).execute()
-                    
-                    print(f"✅ Deleted row {row_num} from Google Sheets")
-                    
-                except Exception as row_error:
-                    print(f"❌ Failed to delete row {row_num}: {row_error}")
+                        range=f"A{entry[0]}"
+                    ))
+                    cell = result.get('values', [])
+                    if cell and cell[0] and cell[0][0] == user_id:
+                        rows_to_delete = [entry[0]]
+                        print(f"📍 Found user data at row {entry[0]} (row index)")
+                    else:
+                        print(f"⚠️ Row index out of step at row {entry[0]}, scanning the sheet")
+                elif not entry and not user_email and index.is_warm(SHEETS_FULL_RESYNC_SECONDS):
+                    print(f"⚠️ User {user_id} is not in the Google Sheets row index")
+                    return True  # Not an error if user not in sheets
+                
+                if not rows_to_delete:
+                    rows_to_delete = self._scan_user_rows(user_id, user_email)
+                    if rows_to_delete is None:
+                        return False
+                
+                if not rows_to_delete:
+                    print(f"⚠️ No rows found for user {user_id} in Google Sheets")
+                    return True  # Not an error if user not in sheets
+                
+                # All of the user's rows in one request, bottom-most first
+                self._execute(self.service.spreadsheets().batchUpdate(
+                    spreadsheetId=self.users_sheet_id,
+                    body={'requests': [{
+                        'deleteDimension': {
+                            'range': {
+                                'sheetId': 0,  # Assuming first sheet
+                                'dimension': 'ROWS',
+                                'startIndex': first - 1,  # 0-indexed for API
+                                'endIndex': last  # Exclusive end
+                            }
+                        }
+                    } for first, last in _row_runs(rows_to_delete)]}
+                ))
+                index.remove_rows(rows_to_delete)
+                index.flush()
             
-            print(f"✅ User {user_id} deleted from Google Sheets successfully")
+            print(f"✅ User {user_id} deleted from Google Sheets successfully ({len(rows_to_delete)} rows)")
             return True
             
         except Exception as e:
             print(f"❌ Error deleting user from Google Sheets: {str(e)}")
             return False
+    
+    def _scan_user_rows(self, user_id: str, user_email: Optional[str]) -> Optional[List[int]]:
+        """Sheet rows holding user_id (or user_email), found by reading the User ID..Email columns.
+        
+        Re-points the row index from the same read. None if the sheet is empty.
+        """
+        result = self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=self.users_sheet_id,
+            range='A:C'
+        ))
+        values = result.get('values', [])
+        if not values:
+            print("⚠️ No data found in Google Sheets")
+            return None
+        
+        user_id_col = USERS_SHEET_HEADERS.index('User ID')
+        email_col = USERS_SHEET_HEADERS.index('Email')
+        key_rows: Dict[str, List[int]] = {}
+        rows_to_delete = []
+        for row_number, row in enumerate(values[1:], 2):  # Skip header row
+            row_user_id = row[user_id_col] if len(row) > user_id_col else ''
+            row_email = row[email_col] if len(row) > email_col else ''
+            if row_user_id:
+                key_rows.setdefault(row_user_id, []).append(row_number)
+            if row_user_id == user_id or (user_email and row_email == user_email):
+                rows_to_delete.append(row_number)
+                print(f"📍 Found user data at row {row_number}: {row_user_id} / {row_email}")
+        
+        self._users_index.relocate(key_rows, len(values))
+        return rows_to_delete
 
 # Helper function for SQL execution (if not available as RPC)
 def create_sql_executor():
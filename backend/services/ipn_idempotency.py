@@ -0,0 +1,172 @@
+"""
+Idempotent NowPayments IPN processing.
+
+NowPayments retries an IPN until it is satisfied with the answer, and the
+same (payment_id, payment_status) often arrives several times. Each key is
+claimed before processing:
+  1. an in-process LRU of keys already processed (no I/O),
+  2. keys being processed right now by this process,
+  3. an INSERT ... ON CONFLICT DO NOTHING into nowpayments_processed_ipns,
+     which also catches duplicates handled by other workers or before a
+     restart.
+A failed run releases its claim so the next retry processes the IPN again;
+a claim left 'processing' by a crashed worker can be taken over after
+IPN_CLAIM_TIMEOUT_SECONDS. If the table is unavailable processing continues
+with the in-memory checks only.
+"""
+
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+IPN_IDEMPOTENCY_TABLE = "nowpayments_processed_ipns"
+IPN_LRU_SIZE = int(os.getenv("IPN_LRU_SIZE", 10000))
+IPN_CLAIM_TIMEOUT_SECONDS = float(os.getenv("IPN_CLAIM_TIMEOUT_SECONDS", 600))
+
+class IPNIdempotency:
+    def __init__(self, lru_size: int = IPN_LRU_SIZE):
+        self.lru_size = lru_size
+        self._processed: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self._inflight = set()
+        self.counters = {
+            "claimed": 0,
+            "processed": 0,
+            "released": 0,
+            "reclaimed": 0,
+            "duplicates_memory": 0,
+            "duplicates_inflight": 0,
+            "duplicates_database": 0,
+            "db_errors": 0
+        }
+
+    @staticmethod
+    def _key(payment_id, payment_status) -> Tuple[str, str]:
+        return str(payment_id), str(payment_status or '')
+
+    def _remember(self, key: Tuple[str, str]):
+        self._processed[key] = None
+        self._processed.move_to_end(key)
+        while len(self._processed) > self.lru_size:
+            self._processed.popitem(last=False)
+
+    def seen(self, payment_id, payment_status) -> bool:
+        """True if this process already applied the IPN (LRU only, no I/O)"""
+        key = self._key(payment_id, payment_status)
+        if key not in self._processed:
+            return False
+        self._processed.move_to_end(key)
+        self.counters["duplicates_memory"] += 1
+        return True
+
+    async def claim(self, payment_id, payment_status) -> Optional[str]:
+        """None if the caller should process this IPN, else where the duplicate was caught"""
+        key = self._key(payment_id, payment_status)
+        if key in self._processed:
+            self._processed.move_to_end(key)
+            self.counters["duplicates_memory"] += 1
+            return "memory"
+        if key in self._inflight:
+            self.counters["duplicates_inflight"] += 1
+            return "inflight"
+
+        self._inflight.add(key)
+        try:
+            from supabase_client import supabase_admin
+
+            inserted = await supabase_admin.table(IPN_IDEMPOTENCY_TABLE)\
+                .upsert({
+                    'payment_id': key[0],
+                    'payment_status': key[1],
+                    'state': 'processing',
+                    'claimed_at': datetime.now(timezone.utc).isoformat()
+                }, on_conflict='payment_id,payment_status', ignore_duplicates=True)\
+                .execute_async()
+
+            if inserted.error:
+                self.counters["db_errors"] += 1
+                print(f"⚠️ IPN idempotency table unavailable ({inserted.error}), relying on in-memory checks")
+                self.counters["claimed"] += 1
+                return None
+            if inserted.data:
+                self.counters["claimed"] += 1
+                return None
+
+            # Already recorded: processed, or claimed by another worker
+            cutoff = (datetime.now(timezone.utc) - timedelta(seconds=IPN_CLAIM_TIMEOUT_SECONDS)).isoformat()
+            reclaimed = await supabase_admin.table(IPN_IDEMPOTENCY_TABLE)\
+                .update({'claimed_at': datetime.now(timezone.utc).isoformat()})\
+                .eq('payment_id', key[0])\
+                .eq('payment_status', key[1])\
+                .eq('state', 'processing')\
+                .lt('claimed_at', cutoff)\
+                .execute_async()
+            if reclaimed.data:
+                print(f"♻️ Taking over stale IPN claim for payment_id {key[0]} ({key[1]})")
+                self.counters["reclaimed"] += 1
+                self.counters["claimed"] += 1
+                return None
+
+            existing = await supabase_admin.table(IPN_IDEMPOTENCY_TABLE)\
+                .select('state')\
+                .eq('payment_id', key[0])\
+                .eq('payment_status', key[1])\
+                .execute_async()
+            if existing.data and existing.data[0].get('state') == 'processed':
+                self._remember(key)
+            self._inflight.discard(key)
+            self.counters["duplicates_database"] += 1
+            return "database"
+
+        except Exception as e:
+            self.counters["db_errors"] += 1
+            print(f"⚠️ IPN idempotency check failed ({e}), relying on in-memory checks")
+            self.counters["claimed"] += 1
+            return None
+
+    async def complete(self, payment_id, payment_status):
+        """Record a successfully processed IPN"""
+        key = self._key(payment_id, payment_status)
+        self._inflight.discard(key)
+        self._remember(key)
+        self.counters["processed"] += 1
+        try:
+            from supabase_client import supabase_admin
+
+            result = await supabase_admin.table(IPN_IDEMPOTENCY_TABLE)\
+                .update({'state': 'processed', 'processed_at': datetime.now(timezone.utc).isoformat()}, returning='minimal')\
+                .eq('payment_id', key[0])\
+                .eq('payment_status', key[1])\
+                .execute_async()
+            if result.error:
+                self.counters["db_errors"] += 1
+        except Exception as e:
+            self.counters["db_errors"] += 1
+            print(f"⚠️ Failed to record processed IPN {key}: {e}")
+
+    async def release(self, payment_id, payment_status):
+        """Drop the claim of a failed run so a retry is processed again"""
+        key = self._key(payment_id, payment_status)
+        self._inflight.discard(key)
+        self.counters["released"] += 1
+        try:
+            from supabase_client import supabase_admin
+
+            await supabase_admin.table(IPN_IDEMPOTENCY_TABLE)\
+                .delete(returning='minimal')\
+                .eq('payment_id', key[0])\
+                .eq('payment_status', key[1])\
+                .eq('state', 'processing')\
+                .execute_async()
+        except Exception as e:
+            self.counters["db_errors"] += 1
+            print(f"⚠️ Failed to release IPN claim {key}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        counters = dict(self.counters)
+        counters["duplicates_absorbed"] = counters["duplicates_memory"] + counters["duplicates_inflight"] + counters["duplicates_database"]
+        counters["remembered"] = len(self._processed)
+        counters["inflight"] = len(self._inflight)
+        return counters
+
+ipn_idempotency = IPNIdempotency()
@@ -0,0 +1,133 @@
+"""
+Shared NowPayments JWT for the subscription and payout APIs.
+
+The token from POST /v1/auth is cached until shortly before it expires.
+Inside the refresh margin callers still get the current token while one
+background login replaces it; concurrent callers that find no usable token
+wait on that same login (single-flight). A 401 invalidates the token, and
+request() retries once with a fresh one.
+"""
+
+import os
+import json
+import time
+import base64
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+
+NOWPAYMENTS_AUTH_URL = "https://api.nowpayments.io/v1/auth"
+# Used when the token carries no readable exp claim (NowPayments issues 5 minute tokens)
+NOWPAYMENTS_JWT_TTL = float(os.getenv("NOWPAYMENTS_JWT_TTL", 300))
+# Refresh this long before expiry, while the current token is still handed out
+NOWPAYMENTS_JWT_REFRESH_MARGIN = float(os.getenv("NOWPAYMENTS_JWT_REFRESH_MARGIN", 60))
+
+def _token_lifetime(token: str) -> float:
+    """Seconds until the JWT's exp claim, or NOWPAYMENTS_JWT_TTL if it cannot be read"""
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return max(0.0, float(claims['exp']) - time.time())
+    except Exception:
+        return NOWPAYMENTS_JWT_TTL
+
+class NowPaymentsTokenManager:
+    def __init__(self, refresh_margin: float = NOWPAYMENTS_JWT_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.logins = 0
+        self.login_failures = 0
+        self.invalidations = 0
+
+    async def get_token(self) -> Optional[str]:
+        """A valid JWT, or None if NowPayments login fails"""
+        now = time.monotonic()
+        if self._token and now < self._expires_at:
+            self.hits += 1
+            if now >= self._expires_at - self.refresh_margin:
+                self._start_refresh()
+            return self._token
+        return await asyncio.shield(self._start_refresh())
+
+    def invalidate(self, token: Optional[str] = None):
+        """Drop the cached token (only if it is still `token`, when given)"""
+        if token is None or token == self._token:
+            self._token = None
+            self._expires_at = 0.0
+            self.invalidations += 1
+
+    async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, **kwargs) -> httpx.Response:
+        """Authenticated NowPayments call; a 401 refreshes the token and retries once"""
+        response = None
+        for _ in range(2):
+            token = await self.get_token()
+            if not token:
+                raise RuntimeError("Failed to authenticate with NowPayments")
+            request_headers = dict(headers or {})
+            request_headers["Authorization"] = f"Bearer {token}"
+            async with httpx.AsyncClient() as client:
+                response = await client.request(method, url, headers=request_headers, **kwargs)
+            if response.status_code != 401:
+                return response
+            print(f"⚠️ NowPayments rejected the cached JWT (401), re-authenticating")
+            self.invalidate(token)
+        return response
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.get_running_loop().create_task(self._login())
+        return self._refresh
+
+    async def _login(self) -> Optional[str]:
+        try:
+            nowpayments_email = os.getenv("NOWPAYMENTS_EMAIL")
+            nowpayments_password = os.getenv("NOWPAYMENTS_PASSWORD")
+
+            if not nowpayments_email or not nowpayments_password:
+                print(f"❌ NowPayments credentials missing:")
+                print(f"   NOWPAYMENTS_EMAIL: {'Present' if nowpayments_email else 'Missing'}")
+                print(f"   NOWPAYMENTS_PASSWORD: {'Present' if nowpayments_password else 'Missing'}")
+                return None
+
+            print(f"🔐 Authenticating with NowPayments using email: {nowpayments_email}")
+            self.logins += 1
+
+            async with httpx.AsyncClient() as client:
+                response = await client.post(
+                    NOWPAYMENTS_AUTH_URL,
+                    json={"email": nowpayments_email, "password": nowpayments_password},
+                    headers={"Content-Type": "application/json"}
+                )
+
+            if response.status_code == 200:
+                token = response.json().get("token")
+                if token:
+                    self._token = token
+                    self._expires_at = time.monotonic() + _token_lifetime(token)
+                    return token
+
+            self.login_failures += 1
+            print(f"JWT auth failed: {response.status_code} - {response.text}")
+            return None
+
+        except Exception as e:
+            self.login_failures += 1
+            print(f"JWT auth error: {str(e)}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        remaining = self._expires_at - time.monotonic() if self._token else 0
+        return {
+            "cached": bool(self._token) and remaining > 0,
+            "expires_in_seconds": round(max(0.0, remaining), 1),
+            "hits": self.hits,
+            "logins": self.logins,
+            "login_failures": self.login_failures,
+            "invalidations": self.invalidations
+        }
+
+nowpayments_tokens = NowPaymentsTokenManager()
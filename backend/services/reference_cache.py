@@ -0,0 +1,109 @@
+"""
+Stale-while-revalidate cache for slow-moving upstream reference data
+(NowPayments currencies, minimum amounts, fees, estimates).
+
+Each entry is fresh for `ttl` seconds and may then be served for another
+`stale_ttl` seconds while a single background refresh replaces it. Misses
+single-flight: concurrent callers for the same key share one upstream
+call. If a refresh fails, the last value keeps being served until its
+stale window ends.
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class ReferenceDataCache:
+    def __init__(self, max_size: int = 2000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, fresh_until, stale_until)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl: float, stale_ttl: float = 0) -> Any:
+        """Cached value for key, loading it with loader() when missing or past its stale window.
+
+        loader raises to signal failure; failures are never cached.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            if now < stale_until:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._load(key, loader, ttl, stale_ttl)
+                return value
+
+        self.misses += 1
+        return await asyncio.shield(self._load(key, loader, ttl, stale_ttl))
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Any value still inside its stale window, without loading"""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() >= entry[2]:
+            return default
+        return entry[0]
+
+    def invalidate(self, key: Hashable = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl: float, stale_ttl: float) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._refresh(key, loader, ttl, stale_ttl))
+            self._inflight[key] = task
+            # Background refreshes may have no awaiting caller; failures are counted in _refresh
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl: float, stale_ttl: float) -> Any:
+        self.refreshes += 1
+        try:
+            value = await loader()
+        except Exception as e:
+            self.refresh_failures += 1
+            stale = self.peek(key, _MISSING)
+            if stale is not _MISSING:
+                logger.warning(f"Refreshing {key} failed ({e}), serving the stale value")
+                return stale
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        now = time.monotonic()
+        self._entries[key] = (value, now + ttl, now + ttl + stale_ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "inflight": len(self._inflight)
+        }
@@ -0,0 +1,253 @@
+"""
+Row index for Google Sheets syncs.
+
+SheetRowIndex maps each key (user_id, report month) to the sheet row it was
+written to, plus a hash of what was written, so syncs and deletions can
+address rows directly. Indexes can be backed by a small SQLite file
+(SHEETS_INDEX_PATH) so they survive restarts; every change is written
+through and committed by flush() at the end of each sheet operation.
+"""
+
+import os
+import json
+import time
+import bisect
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SHEETS_INDEX_PATH = os.getenv(
+    "SHEETS_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "sheets_row_index.db")
+)
+
+def row_hash(values) -> str:
+    return hashlib.blake2b(json.dumps(values, default=str, separators=(',', ':')).encode(), digest_size=8).hexdigest()
+
+class SheetIndexStore:
+    """SQLite persistence for any number of named SheetRowIndex instances"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sheet_rows (
+                sheet TEXT NOT NULL,
+                key TEXT NOT NULL,
+                row_number INTEGER NOT NULL,
+                row_hash TEXT,
+                source_hash TEXT,
+                PRIMARY KEY (sheet, key)
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sheet_rows_row ON sheet_rows (sheet, row_number)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sheet_index_meta (
+                sheet TEXT PRIMARY KEY,
+                next_row INTEGER NOT NULL,
+                watermark TEXT,
+                full_sync_at REAL
+            )""")
+        self._conn.commit()
+
+    def load(self, sheet: str) -> Optional[Tuple[Dict[str, list], int, Optional[str], Optional[float]]]:
+        with self._lock:
+            meta = self._conn.execute(
+                "SELECT next_row, watermark, full_sync_at FROM sheet_index_meta WHERE sheet = ?", (sheet,)
+            ).fetchone()
+            if meta is None:
+                return None
+            entries = {key: [row_number, hash_, source] for key, row_number, hash_, source in self._conn.execute(
+                "SELECT key, row_number, row_hash, source_hash FROM sheet_rows WHERE sheet = ?", (sheet,)
+            )}
+            return entries, meta[0], meta[1], meta[2]
+
+    def clear(self, sheet: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sheet_rows WHERE sheet = ?", (sheet,))
+            self._conn.execute("DELETE FROM sheet_index_meta WHERE sheet = ?", (sheet,))
+
+    def put(self, sheet: str, key: str, entry: list):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sheet_rows (sheet, key, row_number, row_hash, source_hash) VALUES (?, ?, ?, ?, ?)",
+                (sheet, key, entry[0], entry[1], entry[2])
+            )
+
+    def remove(self, sheet: str, keys: List[str], deleted_rows: List[int]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM sheet_rows WHERE sheet = ? AND key = ?", [(sheet, key) for key in keys])
+            # Bottom-most first, so each shift only sees rows that were below it
+            for row_number in sorted(deleted_rows, reverse=True):
+                self._conn.execute(
+                    "UPDATE sheet_rows SET row_number = row_number - 1 WHERE sheet = ? AND row_number > ?",
+                    (sheet, row_number)
+                )
+
+    def replace_rows(self, sheet: str, entries: Dict[str, list]):
+        with self._lock:
+            self._conn.execute("DELETE FROM sheet_rows WHERE sheet = ?", (sheet,))
+            self._conn.executemany(
+                "INSERT INTO sheet_rows (sheet, key, row_number, row_hash, source_hash) VALUES (?, ?, ?, ?, ?)",
+                [(sheet, key, e[0], e[1], e[2]) for key, e in entries.items()]
+            )
+
+    def save_meta(self, sheet: str, next_row: int, watermark: Optional[str], full_sync_at: Optional[float]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sheet_index_meta (sheet, next_row, watermark, full_sync_at) VALUES (?, ?, ?, ?)",
+                (sheet, next_row, watermark, full_sync_at)
+            )
+            self._conn.commit()
+
+    def rollback(self):
+        with self._lock:
+            self._conn.rollback()
+
+class SheetRowIndex:
+    """Where each keyed row sits in a sheet and a hash of what was last written there.
+
+    Row numbers are 1-based sheet rows; the header occupies the rows above
+    first_row. Kept in step with every write so a sync can address changed
+    rows directly instead of rewriting the sheet. Callers serialise access
+    per sheet and call flush() once the sheet itself has been updated.
+    """
+
+    def __init__(self, name: str, store: Optional[SheetIndexStore] = None, first_row: int = 2):
+        self.name = name
+        self.store = store
+        self.first_row = first_row
+        self._reset_memory()
+        loaded = store.load(name) if store else None
+        if loaded:
+            self.entries, self.next_row, self.watermark, self.full_sync_at = loaded
+
+    def _reset_memory(self):
+        self.entries: Dict[str, list] = {}  # key -> [row_number, row_hash, source_hash]
+        self.next_row = self.first_row
+        self.watermark: Optional[str] = None
+        self.full_sync_at: Optional[float] = None
+
+    def reset(self):
+        """Forget everything (the next sync rewrites the sheet)"""
+        self._reset_memory()
+        if self.store:
+            self.store.clear(self.name)
+            self.flush()
+
+    def begin_rebuild(self):
+        """Start indexing a full rewrite; rows are added with put() in sheet order"""
+        self._reset_memory()
+        if self.store:
+            self.store.clear(self.name)
+
+    def rebuild(self, keyed_rows: Iterable[Tuple[str, list, Optional[str]]], watermark: Optional[str] = None):
+        """Index rows exactly as just written, in sheet order"""
+        self.begin_rebuild()
+        for key, values, source_hash in keyed_rows:
+            self.put(key, values, source_hash)
+        self.mark_synced(watermark, full=True)
+
+    def is_warm(self, max_age: float) -> bool:
+        return self.full_sync_at is not None and time.time() - self.full_sync_at < max_age
+
+    def get(self, key: str) -> Optional[list]:
+        return self.entries.get(key)
+
+    def put(self, key: str, values: list, source_hash: Optional[str] = None) -> int:
+        """Record a write of values for key; returns its row (new keys go at the bottom)"""
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [self.next_row, None, None]
+            self.next_row += 1
+        entry[1] = row_hash(values)
+        entry[2] = source_hash
+        if self.store:
+            self.store.put(self.name, key, entry)
+        return entry[0]
+
+    def remove(self, keys: Iterable[str]) -> List[int]:
+        """Forget keys whose rows were deleted and shift the rows below them up"""
+        keys = [key for key in set(keys) if key in self.entries]
+        deleted = sorted(self.entries.pop(key)[0] for key in keys)
+        if deleted:
+            for entry in self.entries.values():
+                entry[0] -= bisect.bisect_left(deleted, entry[0])
+            self.next_row -= len(deleted)
+            if self.store:
+                self.store.remove(self.name, keys, deleted)
+        return deleted
+
+    def remove_rows(self, row_numbers: Iterable[int]) -> List[str]:
+        """Forget whatever was indexed at deleted sheet rows and shift the rows below them up"""
+        deleted = sorted(set(row_numbers))
+        deleted_set = set(deleted)
+        keys = [key for key, entry in self.entries.items() if entry[0] in deleted_set]
+        for key in keys:
+            del self.entries[key]
+        if deleted:
+            for entry in self.entries.values():
+                entry[0] -= bisect.bisect_left(deleted, entry[0])
+            self.next_row = max(self.first_row, self.next_row - len(deleted))
+            if self.store:
+                self.store.remove(self.name, keys, deleted)
+        return keys
+
+    def relocate(self, key_rows: Dict[str, List[int]], last_row: int):
+        """Re-point keys at the rows a scan of the key column found them in.
+
+        Keys no longer in the sheet are dropped; hashes are kept, so a
+        delta sync can continue without a full rewrite.
+        """
+        for key in list(self.entries):
+            rows = key_rows.get(key)
+            if rows:
+                self.entries[key][0] = rows[0]
+            else:
+                del self.entries[key]
+        self.next_row = max(self.first_row, last_row + 1)
+        if self.store:
+            self.store.replace_rows(self.name, self.entries)
+
+    def mark_synced(self, watermark: Optional[str] = None, full: bool = False):
+        """Record a completed sync and commit the index"""
+        if watermark is not None:
+            self.watermark = watermark
+        if full:
+            self.full_sync_at = time.time()
+        self.flush()
+
+    def flush(self):
+        """Commit pending changes to the store"""
+        if self.store:
+            self.store.save_meta(self.name, self.next_row, self.watermark, self.full_sync_at)
+
+    def discard(self):
+        """Drop uncommitted store changes and the in-memory state after a failed write"""
+        if self.store:
+            self.store.rollback()
+        self.reset()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "rows": len(self.entries),
+            "watermark": self.watermark,
+            "last_full_sync": datetime.fromtimestamp(self.full_sync_at, timezone.utc).isoformat() if self.full_sync_at else None,
+            "persisted": self.store.path if self.store else None
+        }
+
+def open_index_store(path: str = SHEETS_INDEX_PATH) -> Optional[SheetIndexStore]:
+    """The SQLite store, or None (memory-only indexes) if the path is not writable"""
+    if not path:
+        return None
+    try:
+        return SheetIndexStore(path)
+    except Exception as e:
+        print(f"⚠️ Sheets row index not persisted ({path}): {e}")
+        return None
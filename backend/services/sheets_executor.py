@@ -0,0 +1,187 @@
+"""
+Google Sheets API calls off the event loop.
+
+googleapiclient is blocking, so every Sheets operation runs on a small
+dedicated thread pool (sheets_executor.run) and each HTTP request goes
+through execute_request(), which:
+  - waits for a token from a bucket sized to the Sheets per-minute quota,
+  - retries 429 / 5xx / connection errors with exponential backoff and
+    jitter, honouring Retry-After,
+  - uses one authorized httplib2 connection per worker thread (httplib2
+    objects are not thread-safe).
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import httplib2
+import google_auth_httplib2
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__name__)
+
+SHEETS_MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", 2))
+# Sheets allows 60 requests per minute per user (the service account) and 300 per project
+SHEETS_REQUESTS_PER_MINUTE = float(os.getenv("SHEETS_REQUESTS_PER_MINUTE", 60))
+SHEETS_REQUEST_BURST = int(os.getenv("SHEETS_REQUEST_BURST", 10))
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", 5))
+SHEETS_BACKOFF_BASE_SECONDS = float(os.getenv("SHEETS_BACKOFF_BASE_SECONDS", 1.0))
+SHEETS_BACKOFF_MAX_SECONDS = float(os.getenv("SHEETS_BACKOFF_MAX_SECONDS", 64.0))
+SHEETS_HTTP_TIMEOUT = float(os.getenv("SHEETS_HTTP_TIMEOUT", 60.0))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks the calling (worker) thread until a token is free"""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def acquire(self) -> float:
+        """Take one token, sleeping as long as needed; returns the time waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.waited_seconds += waited
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+sheets_rate_limiter = TokenBucket(SHEETS_REQUESTS_PER_MINUTE, SHEETS_REQUEST_BURST)
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "retries": 0, "failures": 0}
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+def _thread_http(credentials):
+    """Authorized httplib2 connection owned by the current thread"""
+    http = getattr(_local, "http", None)
+    if http is None or getattr(_local, "credentials", None) is not credentials:
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT))
+        _local.http = http
+        _local.credentials = credentials
+    return http
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    retry_after = None
+    if isinstance(error, HttpError):
+        retry_after = error.resp.get('retry-after')
+    if retry_after:
+        try:
+            return min(SHEETS_BACKOFF_MAX_SECONDS, float(retry_after))
+        except ValueError:
+            pass
+    delay = min(SHEETS_BACKOFF_MAX_SECONDS, SHEETS_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def execute_request(request, credentials=None) -> Any:
+    """execute() a googleapiclient request under the rate limit, retrying transient failures.
+
+    Blocking - call from a sheets_executor worker, never from the event loop.
+    """
+    attempt = 0
+    while True:
+        sheets_rate_limiter.acquire()
+        _count("requests")
+        try:
+            if credentials is not None:
+                return request.execute(http=_thread_http(credentials))
+            return request.execute()
+        except HttpError as e:
+            if e.resp.status not in RETRYABLE_STATUSES or attempt >= SHEETS_MAX_RETRIES:
+                _count("failures")
+                raise
+            error = e
+        except (ConnectionError, TimeoutError, httplib2.HttpLib2Error) as e:
+            if attempt >= SHEETS_MAX_RETRIES:
+                _count("failures")
+                raise
+            error = e
+            _local.http = None  # reconnect on the next attempt
+
+        delay = _retry_delay(attempt, error)
+        attempt += 1
+        _count("retries")
+        logger.warning(f"Sheets request failed ({error}), retry {attempt}/{SHEETS_MAX_RETRIES} in {delay:.1f}s")
+        time.sleep(delay)
+
+class SheetsExecutor:
+    """Bounded thread pool running blocking Sheets work behind an async API"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max(1, max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sheets")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the Sheets pool and await its result"""
+        with self._lock:
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(self._call, fn, *args, **kwargs))
+
+    def _call(self, fn: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            result = fn(*args, **kwargs)
+            with self._lock:
+                self.completed += 1
+            return result
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def shutdown(self, wait: bool = False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pool = {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed
+            }
+        with _stats_lock:
+            requests = dict(_stats)
+        return {
+            "pool": pool,
+            "requests": requests,
+            "rate_limit_per_minute": SHEETS_REQUESTS_PER_MINUTE,
+            "rate_limit_waited_seconds": round(sheets_rate_limiter.waited_seconds, 2)
+        }
+
+sheets_executor = SheetsExecutor(SHEETS_MAX_WORKERS)
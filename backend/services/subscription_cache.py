@@ -0,0 +1,59 @@
+import os
+import copy
+from typing import Any, Dict, Optional
+
+from services.ttl_cache import TTLCache
+
+# Bypasses every plan limit regardless of its subscription row
+SUPER_ADMIN_USER_ID = 'cd0e9717-f85d-4726-81e9-f260394ead58'
+
+# Fallback limits per plan when a subscription row has none (-1 = unlimited)
+DEFAULT_PLAN_LIMITS = {
+    "free": {"ai_bots": 1, "manual_bots": 2, "marketplace_products": 1},
+    "plus": {"ai_bots": 3, "manual_bots": 5, "marketplace_products": 10},
+    "pro": {"ai_bots": -1, "manual_bots": -1, "marketplace_products": -1}
+}
+
+SUBSCRIPTION_CACHE_TTL = float(os.environ.get("SUBSCRIPTION_CACHE_TTL", 60.0))
+
+_UNSET = object()
+_subscriptions = TTLCache(ttl=SUBSCRIPTION_CACHE_TTL)
+
+def get_plan_limits(subscription: Optional[Dict[str, Any]]) -> Optional[Dict[str, int]]:
+    """Limits for a subscription row (None for super admin, free plan if no row)"""
+    if not subscription:
+        return dict(DEFAULT_PLAN_LIMITS["free"])
+    plan_type = subscription.get('plan_type', 'free')
+    if plan_type == 'super_admin':
+        return None
+    limits = subscription.get('limits') or DEFAULT_PLAN_LIMITS.get(plan_type, DEFAULT_PLAN_LIMITS["free"])
+    return dict(limits)
+
+async def get_cached_subscription(user_id: str) -> Optional[Dict[str, Any]]:
+    """User's subscriptions row, served from memory for SUBSCRIPTION_CACHE_TTL seconds.
+
+    Returns None when the user has no subscription (that is cached too).
+    Lookup failures are not cached. Callers get a copy they may mutate.
+    """
+    cached = _subscriptions.get(user_id, _UNSET)
+    if cached is not _UNSET:
+        return copy.deepcopy(cached)
+
+    from supabase_client import supabase_admin
+
+    response = await supabase_admin.table('subscriptions')\
+        .select('*')\
+        .eq('user_id', user_id)\
+        .execute_async()
+
+    subscription = response.data[0] if response.data else None
+    if not response.error:
+        _subscriptions.set(user_id, subscription)
+    return copy.deepcopy(subscription)
+
+def invalidate_subscription(user_id: Optional[str] = None):
+    """Forget the cached subscription for one user (or everyone)"""
+    _subscriptions.invalidate(user_id)
+
+def subscription_cache_stats() -> Dict[str, Any]:
+    return _subscriptions.stats()
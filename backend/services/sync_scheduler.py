@@ -0,0 +1,101 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+
+class CoalescingScheduler:
+    """Debounced runner for an expensive, idempotent job.
+
+    Triggers that arrive within debounce_seconds of the first one collapse
+    into a single run, at most one run is in progress at a time, and any
+    number of triggers during a run schedule exactly one follow-up run.
+    Must be triggered from the event loop.
+    """
+
+    def __init__(self, name: str, job: Callable[[], Awaitable[Any]], debounce_seconds: float = 5.0):
+        self.name = name
+        self.debounce_seconds = debounce_seconds
+        self._job = job
+        self._worker: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._running = False
+        self._scheduled_for: Optional[float] = None
+        self.triggers = 0
+        self.coalesced = 0
+        self.runs = 0
+        self.failures = 0
+        self.last_reason: Optional[str] = None
+        self.last_started: Optional[float] = None
+        self.last_finished: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_result: Any = None
+        self.last_error: Optional[str] = None
+
+    def trigger(self, reason: Optional[str] = None) -> bool:
+        """Request a run; returns False when it was folded into one already pending"""
+        self.triggers += 1
+        self.last_reason = reason
+        already_pending = self._dirty
+        self._dirty = True
+
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._work())
+            return True
+        if already_pending:
+            self.coalesced += 1
+            return False
+        # Running, nothing queued yet: this becomes the single follow-up
+        return True
+
+    async def _work(self):
+        while self._dirty:
+            self._scheduled_for = time.time() + self.debounce_seconds
+            await asyncio.sleep(self.debounce_seconds)
+            self._scheduled_for = None
+            # Triggers from here on belong to the follow-up run
+            self._dirty = False
+            self._running = True
+            self.last_started = time.time()
+            started = time.perf_counter()
+            try:
+                self.last_result = await self._job()
+                self.last_error = None
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                logger.exception(f"{self.name} run failed")
+            finally:
+                self._running = False
+                self.runs += 1
+                self.last_duration = round(time.perf_counter() - started, 3)
+                self.last_finished = time.time()
+
+    async def wait_idle(self, timeout: Optional[float] = None):
+        """Wait for the pending/in-progress runs (if any) to finish"""
+        if self._worker and not self._worker.done():
+            await asyncio.wait([self._worker], timeout=timeout)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "running": self._running,
+            "pending": self._dirty,
+            "next_run_at": _iso(self._scheduled_for),
+            "debounce_seconds": self.debounce_seconds,
+            "triggers": self.triggers,
+            "coalesced": self.coalesced,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_reason": self.last_reason,
+            "last_started": _iso(self.last_started),
+            "last_finished": _iso(self.last_finished),
+            "last_duration_seconds": self.last_duration,
+            "last_result": self.last_result,
+            "last_error": self.last_error
+        }
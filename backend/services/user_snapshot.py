@@ -0,0 +1,155 @@
+"""
+Streaming user snapshot for the Google Sheets sync and other exports.
+
+Users are read one page at a time and each page is joined only against
+the profile and subscription rows of its own users (dict lookups), so
+memory is bounded by the page size and the work grows linearly with the
+number of users instead of users x profiles.
+"""
+
+import os
+import heapq
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from supabase_client import supabase_admin as supabase
+
+SNAPSHOT_PAGE_SIZE = int(os.getenv("SNAPSHOT_PAGE_SIZE", 1000))
+# user_ids per PostgREST in.() filter (keeps the URL short)
+SOURCE_LOOKUP_CHUNK = 150
+
+def user_record(email_user: Dict[str, Any], profile: Dict[str, Any], subscription: Dict[str, Any]) -> Dict[str, Any]:
+    """One user's export row from the auth.users entry, profile and subscription"""
+    return {
+        'user_id': email_user.get('user_id', ''),
+        'name': profile.get('name', ''),
+        'email': email_user.get('email', ''),  # Email from auth.users!
+        'country': profile.get('country', ''),
+        'phone': profile.get('phone', ''),
+        'registration_date': email_user.get('created_at', ''),
+        'seller_verification_status': profile.get('seller_verification_status', 'not_verified'),
+        'plan_type': subscription.get('plan_type', 'free'),
+        'subscription_status': subscription.get('status', 'inactive'),
+        'subscription_end_date': subscription.get('end_date', ''),
+        'total_commission_earned': 0
+    }
+
+def load_by_user(table: str, user_ids: Iterable[str], into: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
+    """{user_id: row} from table for user_ids, via chunked in.() filters run concurrently.
+
+    Raises RuntimeError when any chunk fails, so callers never join
+    against a partial page.
+    """
+    into = {} if into is None else into
+    user_ids = sorted(user_ids)
+    if not user_ids:
+        return into
+    results = supabase.gather_sync(*[
+        supabase.table(table).select('*').in_('user_id', user_ids[i:i + SOURCE_LOOKUP_CHUNK])
+        for i in range(0, len(user_ids), SOURCE_LOOKUP_CHUNK)
+    ])
+    for result in results:
+        if result.error:
+            raise RuntimeError(f"Failed to read {table}: {result.error}")
+        for row in result.data or []:
+            into.setdefault(row['user_id'], row)
+    return into
+
+def iter_auth_user_pages(page_size: int = SNAPSHOT_PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """auth.users as pages of {user_id, email, created_at}, newest first.
+
+    Walks get_users_emails_page with a (created_at, id) keyset; where that
+    function is not deployed yet, Range-pages get_users_emails_simple.
+    Raises RuntimeError if a page cannot be read.
+    """
+    first = supabase.rpc('get_users_emails_page', {'p_limit': page_size}).execute()
+    if first.error:
+        print("⚠️ get_users_emails_page unavailable, paging get_users_emails_simple with Range requests")
+        yield from _iter_range_pages(lambda: supabase.rpc('get_users_emails_simple'), page_size)
+        return
+
+    page = first.data or []
+    while page:
+        yield page
+        if len(page) < page_size:
+            return
+        last = page[-1]
+        response = supabase.rpc('get_users_emails_page', {
+            'p_after_created_at': last.get('created_at'),
+            'p_after_id': last.get('user_id'),
+            'p_limit': page_size
+        }).execute()
+        if response.error:
+            raise RuntimeError(f"Failed to read users page: {response.error}")
+        page = response.data or []
+
+def _iter_range_pages(make_query, page_size: int) -> Iterator[List[Dict[str, Any]]]:
+    """Pages of a stable-ordered query fetched with Range headers"""
+    offset = 0
+    while True:
+        response = make_query().range(offset, offset + page_size - 1).execute()
+        if response.status_code == 416:  # offset past the last row
+            return
+        if response.error:
+            raise RuntimeError(f"Failed to read rows {offset}-{offset + page_size - 1}: {response.error}")
+        page = response.data or []
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+def iter_table_by_user(table: str, columns: str = '*', page_size: int = SNAPSHOT_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """Every row of table in (user_id, id) order, one page in memory at a time"""
+    def query():
+        return supabase.table(table).select(columns).order('user_id').order('id')
+    for page in _iter_range_pages(query, page_size):
+        yield from page
+
+def iter_user_snapshot(page_size: int = SNAPSHOT_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """user_record() for every auth user, newest first, built page by page"""
+    for page in iter_auth_user_pages(page_size):
+        user_ids = [u['user_id'] for u in page if u.get('user_id')]
+        profiles = load_by_user('user_profiles', user_ids)
+        subscriptions = load_by_user('subscriptions', user_ids)
+        for email_user in page:
+            user_id = email_user.get('user_id')
+            if user_id:
+                yield user_record(email_user, profiles.get(user_id, {}), subscriptions.get(user_id, {}))
+
+def iter_fallback_snapshot(page_size: int = SNAPSHOT_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """Records for every user_id found in profiles, subscriptions or email validations.
+
+    Used when auth.users cannot be read: the three tables are streamed in
+    user_id order and sort-merge joined, so no table is held in memory.
+    Emails come from subscription_email_validation. Yields in user_id order.
+    """
+    sources = {
+        'profile': iter_table_by_user('user_profiles', page_size=page_size),
+        'subscription': iter_table_by_user('subscriptions', page_size=page_size),
+        'email_validation': iter_table_by_user('subscription_email_validation', 'id, user_id, email', page_size)
+    }
+    merged = heapq.merge(*[_tagged(name, rows) for name, rows in sources.items()], key=lambda item: item[0])
+
+    previous = None
+    for user_id, group in itertools.groupby(merged, key=lambda item: item[0]):
+        if previous is not None and user_id < previous:
+            raise RuntimeError("Snapshot sources are not ordered by user_id")
+        previous = user_id
+
+        first = {}
+        for _, name, row in group:
+            first.setdefault(name, row)
+        profile = first.get('profile', {})
+        subscription = first.get('subscription', {})
+
+        yield user_record({
+            'user_id': user_id,
+            'email': first.get('email_validation', {}).get('email', ''),
+            'created_at': profile.get('created_at', '') or subscription.get('created_at', '')
+        }, profile, subscription)
+
+def _tagged(name: str, rows: Iterator[Dict[str, Any]]) -> Iterator[tuple]:
+    for row in rows:
+        if row.get('user_id'):
+            yield row['user_id'], name, row
@@ -0,0 +1,247 @@
+"""
+Durable acknowledge-then-process queue for payment provider webhooks.
+
+Webhook routes verify the request, enqueue() the raw body and answer 200
+straight away; a pool of async workers applies the jobs afterwards. Jobs
+live in a small SQLite file (WEBHOOK_QUEUE_PATH) so anything acknowledged
+survives a restart, and:
+  - jobs sharing an ordering key (payment / withdrawal id) run strictly in
+    arrival order; a job is only eligible once no earlier job with its key
+    is left,
+  - a claimed job holds a lease, so a job whose worker died is picked up
+    again once the lease ends (processing is at-least-once; handlers must
+    be idempotent),
+  - a handler exception retries the job with exponential backoff and
+    jitter; after WEBHOOK_MAX_ATTEMPTS it moves to webhook_dead_letters.
+"""
+
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_QUEUE_PATH = os.getenv(
+    "WEBHOOK_QUEUE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "webhook_queue.db")
+)
+WEBHOOK_QUEUE_WORKERS = int(os.getenv("WEBHOOK_QUEUE_WORKERS", 4))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 8))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", 2.0))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", 600.0))
+WEBHOOK_LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", 300.0))
+# How often idle workers look for jobs whose backoff has ended
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", 1.0))
+
+JobHandler = Callable[[str], Awaitable[Any]]
+
+class WebhookQueue:
+    def __init__(self, path: str, workers: int = WEBHOOK_QUEUE_WORKERS):
+        self.path = path or ":memory:"
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._handlers: Dict[str, JobHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self.counters = {"enqueued": 0, "processed": 0, "retried": 0, "dead_lettered": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.path != ":memory:":
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                ordering_key TEXT,
+                body TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                lease_until REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_error TEXT
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_webhook_jobs_key ON webhook_jobs (ordering_key, id)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                ordering_key TEXT,
+                body TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                failed_at REAL NOT NULL,
+                last_error TEXT
+            )""")
+        conn.commit()
+        return conn
+
+    def register(self, kind: str, handler: JobHandler):
+        """Process jobs of this kind with handler(body); it raises to have the job retried"""
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind: str, body, ordering_key: Optional[str] = None) -> int:
+        """Durably store a webhook body; returns the job id once it is committed"""
+        if isinstance(body, bytes):
+            body = body.decode()
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO webhook_jobs (kind, ordering_key, body, available_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, None if ordering_key is None else str(ordering_key), body, now, now)
+            )
+            self._conn.commit()
+            self.counters["enqueued"] += 1
+        if self._wake is not None:
+            self._wake.set()
+        return cursor.lastrowid
+
+    def _claim(self) -> Optional[tuple]:
+        """Lease the oldest ready job whose key has no earlier job left"""
+        kinds = list(self._handlers)
+        if not kinds:
+            return None
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT id, kind, ordering_key, body, attempts FROM webhook_jobs j
+                WHERE kind IN ({','.join('?' * len(kinds))})
+                  AND available_at <= ? AND lease_until <= ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM webhook_jobs e WHERE e.ordering_key = j.ordering_key AND e.id < j.id
+                  )
+                ORDER BY id LIMIT 20""", (*kinds, now, now)).fetchall()
+            for row in rows:
+                # Another process sharing the file may have leased it first
+                cursor = self._conn.execute(
+                    "UPDATE webhook_jobs SET lease_until = ? WHERE id = ? AND lease_until <= ?",
+                    (now + WEBHOOK_LEASE_SECONDS, row[0], now)
+                )
+                if cursor.rowcount:
+                    self._conn.commit()
+                    return row
+            self._conn.commit()
+        return None
+
+    def _finish(self, job_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM webhook_jobs WHERE id = ?", (job_id,))
+            self._conn.commit()
+            self.counters["processed"] += 1
+
+    def _release(self, job_id: int):
+        with self._lock:
+            self._conn.execute("UPDATE webhook_jobs SET lease_until = 0 WHERE id = ?", (job_id,))
+            self._conn.commit()
+
+    def _fail(self, job: tuple, error: Exception):
+        job_id, kind, ordering_key, body, attempts = job
+        attempts += 1
+        message = f"{type(error).__name__}: {error}"[:2000]
+        now = time.time()
+        with self._lock:
+            if attempts >= WEBHOOK_MAX_ATTEMPTS:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO webhook_dead_letters (id, kind, ordering_key, body, attempts, created_at, failed_at, last_error) "
+                    "SELECT id, kind, ordering_key, body, ?, created_at, ?, ? FROM webhook_jobs WHERE id = ?",
+                    (attempts, now, message, job_id)
+                )
+                self._conn.execute("DELETE FROM webhook_jobs WHERE id = ?", (job_id,))
+                self.counters["dead_lettered"] += 1
+                print(f"💀 Webhook job {job_id} ({kind}, key {ordering_key}) dead-lettered after {attempts} attempts: {message}")
+            else:
+                delay = min(WEBHOOK_RETRY_MAX_SECONDS, WEBHOOK_RETRY_BASE_SECONDS * (2 ** (attempts - 1)))
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                self._conn.execute(
+                    "UPDATE webhook_jobs SET attempts = ?, available_at = ?, lease_until = 0, last_error = ? WHERE id = ?",
+                    (attempts, now + delay, message, job_id)
+                )
+                self.counters["retried"] += 1
+                print(f"⚠️ Webhook job {job_id} ({kind}) failed, retry {attempts}/{WEBHOOK_MAX_ATTEMPTS - 1} in {delay:.1f}s: {message}")
+            self._conn.commit()
+
+    async def _worker(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Webhook queue read failed: {e}")
+                job = None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), WEBHOOK_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._handlers[job[1]](job[3])
+            except asyncio.CancelledError:
+                self._release(job[0])
+                raise
+            except Exception as e:
+                logger.exception(f"Webhook job {job[0]} ({job[1]}) failed")
+                self._fail(job, e)
+            else:
+                self._finish(job[0])
+            # More work may be ready for the other workers (e.g. the next job of this key)
+            self._wake.set()
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        pending = self.stats()["pending"]
+        print(f"📥 Webhook queue started with {self.workers} workers ({pending} pending jobs, {self.path})")
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, ordering_key, attempts, created_at, failed_at, last_error FROM webhook_dead_letters "
+                "ORDER BY failed_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        columns = ("id", "kind", "ordering_key", "attempts", "created_at", "failed_at", "last_error")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            pending, leased, retrying = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(lease_until > ?), 0), COALESCE(SUM(attempts > 0), 0) FROM webhook_jobs", (now,)
+            ).fetchone()
+            dead = self._conn.execute("SELECT COUNT(*) FROM webhook_dead_letters").fetchone()[0]
+        return {
+            "pending": pending,
+            "in_progress": leased,
+            "retrying": retrying,
+            "dead_letters": dead,
+            "workers": len(self._tasks),
+            **self.counters
+        }
+
+def open_webhook_queue(path: str = WEBHOOK_QUEUE_PATH) -> WebhookQueue:
+    """The SQLite-backed queue, in memory only if the path is not writable"""
+    try:
+        return WebhookQueue(path)
+    except Exception as e:
+        print(f"⚠️ Webhook queue not persisted ({path}): {e}")
+        return WebhookQueue(":memory:")
+
+webhook_queue = open_webhook_queue()
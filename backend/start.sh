@@ -6,4 +6,4 @@ export ENVIRONMENT=production
 export PORT=${PORT:-8001}
 
 # Start the server
-uvicorn server:app --host 0.0.0.0 --port $PORT --no-reload
\ No newline at end of file
+uvicorn server:app --host 0.0.0.0 --port $PORT --no-reload --no-access-log
\ No newline at end of file
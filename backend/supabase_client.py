@@ -1,4 +1,8 @@
 import os
+import asyncio
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import httpx
 from dotenv import load_dotenv
 import json
@@ -11,10 +15,27 @@ SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_ANON_KEY = os.environ.get("SUPABASE_ANON_KEY")
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_SERVICE_KEY")
 
+# Connection pool configuration (shared by every query made through a client)
+SUPABASE_HTTP2 = os.environ.get("SUPABASE_HTTP2", "true").lower() in ("1", "true", "yes")
+SUPABASE_TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", 15.0))
+SUPABASE_CONNECT_TIMEOUT = float(os.environ.get("SUPABASE_CONNECT_TIMEOUT", 5.0))
+SUPABASE_MAX_CONNECTIONS = int(os.environ.get("SUPABASE_MAX_CONNECTIONS", 100))
+SUPABASE_MAX_KEEPALIVE = int(os.environ.get("SUPABASE_MAX_KEEPALIVE", 20))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.environ.get("SUPABASE_KEEPALIVE_EXPIRY", 30.0))
+SUPABASE_GATHER_CONCURRENCY = int(os.environ.get("SUPABASE_GATHER_CONCURRENCY", 10))
+# Largest page the keyset history endpoints hand out
+HISTORY_PAGE_MAX = int(os.environ.get("HISTORY_PAGE_MAX", 200))
+
 class SupabaseHTTPClient:
-    """Simple Supabase client using httpx (no Rust dependencies)"""
+    """Simple Supabase client using httpx (no Rust dependencies)
+    
+    Owns one long-lived pooled httpx.Client so PostgREST calls reuse
+    keep-alive (and HTTP/2 when available) connections instead of paying
+    for TCP/TLS setup on every query. Call close() on shutdown.
+    """
     
-    def __init__(self, url: str, key: str):
+    def __init__(self, url: str, key: str, timeout: Optional[httpx.Timeout] = None,
+                 limits: Optional[httpx.Limits] = None, http2: Optional[bool] = None):
         self.url = url.rstrip('/')
         self.key = key
         self.headers = {
@@ -23,9 +44,90 @@ class SupabaseHTTPClient:
             'Content-Type': 'application/json',
             'Prefer': 'return=representation'
         }
+        self.timeout = timeout or httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT)
+        self.limits = limits or httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY
+        )
+        self.http2 = SUPABASE_HTTP2 if http2 is None else http2
+        self._http_client = None
+        self._async_http_client = None
+        self._http_lock = threading.Lock()
+    
+    @property
+    def http(self) -> httpx.Client:
+        """Shared pooled client, created on first use"""
+        if self._http_client is None or self._http_client.is_closed:
+            with self._http_lock:
+                if self._http_client is None or self._http_client.is_closed:
+                    self._http_client = self._build_http_client()
+        return self._http_client
+    
+    @property
+    def async_http(self) -> httpx.AsyncClient:
+        """Shared pooled async client used by execute_async()/await query"""
+        if self._async_http_client is None or self._async_http_client.is_closed:
+            self._async_http_client = self._build_http_client(httpx.AsyncClient)
+        return self._async_http_client
+    
+    def _build_http_client(self, client_class=httpx.Client):
+        try:
+            return client_class(http2=self.http2, timeout=self.timeout, limits=self.limits)
+        except ImportError:
+            # HTTP/2 needs the optional 'h2' package (httpx[http2])
+            print("⚠️ h2 package not installed - Supabase client using HTTP/1.1 keep-alive")
+            self.http2 = False
+            return client_class(timeout=self.timeout, limits=self.limits)
+    
+    def close(self):
+        """Close pooled sync connections (called on app shutdown)"""
+        with self._http_lock:
+            if self._http_client is not None and not self._http_client.is_closed:
+                self._http_client.close()
+            self._http_client = None
+    
+    async def aclose(self):
+        """Close both the sync and the async connection pools"""
+        self.close()
+        if self._async_http_client is not None and not self._async_http_client.is_closed:
+            await self._async_http_client.aclose()
+        self._async_http_client = None
     
     def table(self, table_name: str):
         return SupabaseTable(self, table_name)
+    
+    async def gather(self, *queries, concurrency: int = SUPABASE_GATHER_CONCURRENCY):
+        """Run independent queries concurrently, at most `concurrency` in flight.
+        
+        Returns one SupabaseResponse per query in input order. A failing query
+        never cancels the others - its response carries status_code >= 400 and
+        the failure in `error`.
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def run(query):
+            async with semaphore:
+                try:
+                    return await query.execute_async()
+                except Exception as e:
+                    return _failed_response(e)
+        
+        return list(await asyncio.gather(*(run(query) for query in queries)))
+    
+    def gather_sync(self, *queries, concurrency: int = SUPABASE_GATHER_CONCURRENCY):
+        """Blocking counterpart of gather() for synchronous callers (thread pool)"""
+        if not queries:
+            return []
+        
+        def run(query):
+            try:
+                return query.execute()
+            except Exception as e:
+                return _failed_response(e)
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(queries)))) as executor:
+            return list(executor.map(run, queries))
 
 class SupabaseTable:
     """Simple table operations"""
@@ -35,102 +137,326 @@ class SupabaseTable:
         self.table_name = table_name
         self.url = f"{client.url}/rest/v1/{table_name}"
     
-    def select(self, columns: str = "*"):
-        return SupabaseQuery(self, 'select', columns)
+    def select(self, columns: str = "*", count: Optional[str] = None, head: bool = False):
+        query = SupabaseQuery(self, 'select', columns)
+        if count:
+            query.count(count, head=head)
+        return query
     
-    def insert(self, data):
-        return SupabaseQuery(self, 'insert', data)
+    def insert(self, data, returning: str = "representation"):
+        """Insert one row (dict) or many rows (list of dicts) in a single request"""
+        return SupabaseQuery(self, 'insert', data, returning=returning)
     
-    def update(self, data):
-        return SupabaseQuery(self, 'update', data)
+    def upsert(self, data, on_conflict: Optional[str] = None, ignore_duplicates: bool = False,
+               returning: str = "representation"):
+        """INSERT ... ON CONFLICT via PostgREST resolution preferences.
+        
+        on_conflict names the unique column(s) to match on (defaults to the
+        primary key); ignore_duplicates=True keeps existing rows untouched
+        instead of merging the new values into them.
+        """
+        query = SupabaseQuery(self, 'upsert', data, returning=returning)
+        query.on_conflict = on_conflict
+        query.resolution = 'ignore-duplicates' if ignore_duplicates else 'merge-duplicates'
+        return query
     
-    def delete(self):
-        return SupabaseQuery(self, 'delete', None)
+    def update(self, data, returning: str = "representation"):
+        return SupabaseQuery(self, 'update', data, returning=returning)
+    
+    def delete(self, returning: str = "representation"):
+        return SupabaseQuery(self, 'delete', None, returning=returning)
+
+# Characters that must be double-quoted inside PostgREST list / logic-tree values
+_POSTGREST_RESERVED = set(',.:()"\\ ')
+
+def _format_filter_value(value) -> str:
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+def _quote_list_value(value) -> str:
+    text = _format_filter_value(value)
+    if any(ch in _POSTGREST_RESERVED for ch in text):
+        text = '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return text
+
+def _clean_columns(columns: str) -> str:
+    """Drop whitespace outside double quotes, as PostgREST expects in select="""
+    cleaned = []
+    quoted = False
+    for ch in columns:
+        if ch == '"':
+            quoted = not quoted
+        if ch.isspace() and not quoted:
+            continue
+        cleaned.append(ch)
+    return ''.join(cleaned)
+
+def encode_cursor(row: Dict[str, Any], sort_column: str = 'created_at', id_column: str = 'id') -> str:
+    """Opaque keyset cursor for the position just after `row`"""
+    raw = json.dumps([row.get(sort_column), row.get(id_column)], separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor; raises ValueError on anything malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, id_value = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if sort_value is None or id_value is None:
+        raise ValueError("Invalid cursor")
+    return sort_value, id_value
+
+def keyset_page(rows: Optional[List[Dict[str, Any]]], limit: int,
+                sort_column: str = 'created_at', id_column: str = 'id'):
+    """Split a keyset() result (limit + 1 rows) into (page, next_cursor)"""
+    rows = rows or []
+    limit = max(limit, 0)
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    if not page:
+        return page, None
+    return page, encode_cursor(page[-1], sort_column, id_column)
 
 class SupabaseQuery:
-    """Query builder and executor"""
+    """Query builder and executor
+    
+    Filters are kept as (key, value) pairs and URL-encoded by httpx, so
+    values containing '&', ',', '(' etc. are safe. Supports embedded
+    resources in select(), e.g. select('*, seller:user_profiles(display_name)').
+    """
     
-    def __init__(self, table: SupabaseTable, operation: str, data):
+    def __init__(self, table: SupabaseTable, operation: str, data, returning: str = "representation"):
+        if returning not in ('representation', 'minimal'):
+            raise ValueError(f"Unsupported returning mode: {returning}")
         self.table = table
         self.operation = operation
         self.data = data
+        self.returning = returning
+        self.on_conflict = None
+        self.resolution = None
         self.filters = []
+        self.orders = {}
+        self.range_items = None
+        self.count_mode = None
+        self.head = False
     
-    def eq(self, column: str, value):
-        self.filters.append(f"{column}=eq.{value}")
+    def filter(self, column: str, operator: str, value):
+        """Raw PostgREST filter: column=operator.value"""
+        self.filters.append((column, f"{operator}.{_format_filter_value(value)}"))
         return self
     
+    def eq(self, column: str, value):
+        return self.filter(column, 'eq', value)
+    
     def neq(self, column: str, value):
-        self.filters.append(f"{column}=neq.{value}")
-        return self
+        return self.filter(column, 'neq', value)
+    
+    def gt(self, column: str, value):
+        return self.filter(column, 'gt', value)
     
     def gte(self, column: str, value):
-        self.filters.append(f"{column}=gte.{value}")
-        return self
+        return self.filter(column, 'gte', value)
+    
+    def lt(self, column: str, value):
+        return self.filter(column, 'lt', value)
     
     def lte(self, column: str, value):
-        self.filters.append(f"{column}=lte.{value}")
-        return self
+        return self.filter(column, 'lte', value)
     
     def like(self, column: str, value):
-        self.filters.append(f"{column}=like.{value}")
+        return self.filter(column, 'like', value)
+    
+    def ilike(self, column: str, value):
+        return self.filter(column, 'ilike', value)
+    
+    def is_(self, column: str, value):
+        """IS comparison, value is None/True/False (or 'null'/'unknown')"""
+        return self.filter(column, 'is', value)
+    
+    def in_(self, column: str, values):
+        items = ','.join(_quote_list_value(v) for v in values)
+        self.filters.append((column, f"in.({items})"))
         return self
     
-    def order(self, column: str, desc: bool = False):
+    def not_(self, column: str, operator: str, value):
+        """Negated filter, e.g. not_('status', 'in', ['failed', 'expired'])"""
+        if operator == 'in':
+            value = '(' + ','.join(_quote_list_value(v) for v in value) + ')'
+        self.filters.append((column, f"not.{operator}.{_format_filter_value(value)}"))
+        return self
+    
+    def or_(self, filters: str, reference_table: Optional[str] = None):
+        """OR of PostgREST filters, e.g. or_('user_id.eq.X,seller_id.eq.X')"""
+        key = f"{reference_table}.or" if reference_table else 'or'
+        self.filters.append((key, f"({filters})"))
+        return self
+    
+    def order(self, column: str, desc: bool = False, nullsfirst: Optional[bool] = None,
+              reference_table: Optional[str] = None):
         order_dir = "desc" if desc else "asc"
-        self.filters.append(f"order={column}.{order_dir}")
+        term = f"{column}.{order_dir}"
+        if nullsfirst is not None:
+            term += ".nullsfirst" if nullsfirst else ".nullslast"
+        key = f"{reference_table}.order" if reference_table else 'order'
+        self.orders.setdefault(key, []).append(term)
+        return self
+    
+    def limit(self, count: int, reference_table: Optional[str] = None):
+        key = f"{reference_table}.limit" if reference_table else 'limit'
+        self.filters.append((key, str(count)))
+        return self
+    
+    def offset(self, count: int, reference_table: Optional[str] = None):
+        key = f"{reference_table}.offset" if reference_table else 'offset'
+        self.filters.append((key, str(count)))
         return self
     
-    def limit(self, count: int):
-        self.filters.append(f"limit={count}")
+    def range(self, start: int, end: int):
+        """Rows start..end inclusive; sent as a Range header on reads"""
+        if self.operation == 'select':
+            self.range_items = (start, end)
+        else:
+            self.offset(start).limit(end - start + 1)
         return self
     
+    def keyset(self, cursor: Optional[str] = None, limit: int = 50,
+               sort_column: str = 'created_at', id_column: str = 'id'):
+        """Newest-first keyset page on (sort_column, id_column).
+        
+        Fetches limit + 1 rows so keyset_page() can tell whether another
+        page exists; the cursor filter keeps deep pages O(limit) as long
+        as (sort_column, id_column) is indexed.
+        """
+        self.order(sort_column, desc=True).order(id_column, desc=True)
+        if cursor:
+            sort_value, id_value = decode_cursor(cursor)
+            sort_value = _quote_list_value(sort_value)
+            id_value = _quote_list_value(id_value)
+            # Own `and` key so it composes with a caller's or_()
+            self.filters.append(('and', f"(or({sort_column}.lt.{sort_value},"
+                                        f"and({sort_column}.eq.{sort_value},{id_column}.lt.{id_value})))"))
+        return self.limit(limit + 1)
+    
+    def count(self, mode: str = "exact", head: bool = True):
+        """Ask PostgREST for the row count (exact/planned/estimated).
+        
+        With head=True (the default) a HEAD request is sent, so only the
+        Content-Range header travels back; read it from response.count.
+        """
+        if mode not in ('exact', 'planned', 'estimated'):
+            raise ValueError(f"Unsupported count mode: {mode}")
+        self.count_mode = mode
+        self.head = head
+        return self
+    
+    def _build_request(self):
+        """Return (method, url, request kwargs) for this query"""
+        methods = {'select': 'GET', 'insert': 'POST', 'upsert': 'POST', 'update': 'PATCH', 'delete': 'DELETE'}
+        if self.operation not in methods:
+            raise ValueError(f"Unsupported operation: {self.operation}")
+        
+        params = []
+        prefer = [f"return={self.returning}"]
+        if self.operation == 'select' and self.data and self.data != '*':
+            params.append(('select', _clean_columns(self.data)))
+        if self.operation in ('insert', 'upsert') and isinstance(self.data, list):
+            # Bulk payloads: rows missing a key get the column default, not NULL
+            columns = []
+            for row in self.data:
+                columns.extend(key for key in row if key not in columns)
+            if any(len(row) != len(columns) for row in self.data):
+                params.append(('columns', ','.join(columns)))
+                prefer.append("missing=default")
+        if self.on_conflict:
+            params.append(('on_conflict', _clean_columns(self.on_conflict)))
+        params.extend(self.filters)
+        params.extend((key, ','.join(terms)) for key, terms in self.orders.items())
+        
+        if self.resolution:
+            prefer.append(f"resolution={self.resolution}")
+        
+        headers = dict(self.table.client.headers)
+        method = methods[self.operation]
+        if self.count_mode:
+            prefer.append(f"count={self.count_mode}")
+            if self.head and self.operation == 'select':
+                method = 'HEAD'
+        headers['Prefer'] = ','.join(prefer)
+        if self.range_items:
+            headers['Range-Unit'] = 'items'
+            headers['Range'] = f"{self.range_items[0]}-{self.range_items[1]}"
+        
+        kwargs = {'headers': headers, 'params': params}
+        if self.operation in ('insert', 'upsert', 'update'):
+            kwargs['json'] = self.data
+        return method, self.table.url, kwargs
+    
     def execute(self):
         """Execute the query"""
         try:
-            url = self.table.url
-            if self.filters:
-                url += "?" + "&".join(self.filters)
-            
-            with httpx.Client() as client:
-                if self.operation == 'select':
-                    response = client.get(url, headers=self.table.client.headers)
-                elif self.operation == 'insert':
-                    response = client.post(url, headers=self.table.client.headers, json=self.data)
-                elif self.operation == 'update':
-                    response = client.patch(url, headers=self.table.client.headers, json=self.data)
-                elif self.operation == 'delete':
-                    response = client.delete(url, headers=self.table.client.headers)
-                else:
-                    raise ValueError(f"Unsupported operation: {self.operation}")
-                
-                # Return response-like object
-                result = SupabaseResponse()
-                result.status_code = response.status_code
-                
-                if response.status_code >= 200 and response.status_code < 300:
-                    try:
-                        result.data = response.json()
-                    except:
-                        result.data = []
-                else:
-                    result.data = []
-                    print(f"Supabase error: {response.status_code} - {response.text}")
-                
-                return result
-                
+            method, url, kwargs = self._build_request()
+            response = self.table.client.http.request(method, url, **kwargs)
+            return _to_supabase_response(response, "Supabase error")
         except Exception as e:
             print(f"Supabase request failed: {e}")
-            result = SupabaseResponse()
-            result.status_code = 500
-            result.data = []
-            return result
+            return _failed_response(e)
+    
+    async def execute_async(self):
+        """Execute the query without blocking the event loop"""
+        try:
+            method, url, kwargs = self._build_request()
+            response = await self.table.client.async_http.request(method, url, **kwargs)
+            return _to_supabase_response(response, "Supabase error")
+        except Exception as e:
+            print(f"Supabase request failed: {e}")
+            return _failed_response(e)
+    
+    def __await__(self):
+        return self.execute_async().__await__()
 
 class SupabaseResponse:
     """Response object to mimic supabase library"""
     def __init__(self):
         self.data = []
         self.status_code = 200
+        self.error = None
+        self.count = None
+
+def _parse_content_range_count(content_range: Optional[str]) -> Optional[int]:
+    """Total from a PostgREST Content-Range header such as '0-24/3573' or '*/0'"""
+    if not content_range or '/' not in content_range:
+        return None
+    total = content_range.rsplit('/', 1)[1]
+    return int(total) if total.isdigit() else None
+
+def _to_supabase_response(response: httpx.Response, error_label: str) -> SupabaseResponse:
+    result = SupabaseResponse()
+    result.status_code = response.status_code
+    
+    if response.status_code >= 200 and response.status_code < 300:
+        result.count = _parse_content_range_count(response.headers.get('content-range'))
+        try:
+            result.data = response.json()
+        except:
+            result.data = []
+    else:
+        result.data = []
+        result.error = response.text
+        print(f"{error_label}: {response.status_code} - {response.text}")
+    
+    return result
+
+def _failed_response(error: Optional[Exception] = None) -> SupabaseResponse:
+    result = SupabaseResponse()
+    result.status_code = 500
+    result.data = []
+    result.error = str(error) if error else "request failed"
+    return result
 
 # Initialize clients
 if SUPABASE_URL and SUPABASE_ANON_KEY:
@@ -163,34 +489,43 @@ class SupabaseRPCQuery:
         self.client = client
         self.function_name = function_name
         self.params = params or {}
+        self.range_items = None
+    
+    def range(self, start: int, end: int):
+        """Rows start..end inclusive of a set-returning function (Range header)"""
+        self.range_items = (start, end)
+        return self
+    
+    @property
+    def headers(self) -> Dict[str, str]:
+        if not self.range_items:
+            return self.client.headers
+        headers = dict(self.client.headers)
+        headers['Range-Unit'] = 'items'
+        headers['Range'] = f"{self.range_items[0]}-{self.range_items[1]}"
+        return headers
     
     def execute(self):
         try:
             url = f"{self.client.url}/rest/v1/rpc/{self.function_name}"
-            
-            with httpx.Client() as client:
-                response = client.post(url, headers=self.client.headers, json=self.params)
-                
-                result = SupabaseResponse()
-                result.status_code = response.status_code
-                
-                if response.status_code >= 200 and response.status_code < 300:
-                    try:
-                        result.data = response.json()
-                    except:
-                        result.data = []
-                else:
-                    result.data = []
-                    print(f"Supabase RPC error: {response.status_code} - {response.text}")
-                
-                return result
-                
+            response = self.client.http.post(url, headers=self.headers, json=self.params)
+            return _to_supabase_response(response, "Supabase RPC error")
         except Exception as e:
             print(f"Supabase RPC request failed: {e}")
-            result = SupabaseResponse()
-            result.status_code = 500
-            result.data = []
-            return result
+            return _failed_response(e)
+    
+    async def execute_async(self):
+        """Call the function without blocking the event loop"""
+        try:
+            url = f"{self.client.url}/rest/v1/rpc/{self.function_name}"
+            response = await self.client.async_http.post(url, headers=self.headers, json=self.params)
+            return _to_supabase_response(response, "Supabase RPC error")
+        except Exception as e:
+            print(f"Supabase RPC request failed: {e}")
+            return _failed_response(e)
+    
+    def __await__(self):
+        return self.execute_async().__await__()
 
 # Add Admin Auth functionality
 class SupabaseAdminAuth:
@@ -201,20 +536,29 @@ class SupabaseAdminAuth:
         """Delete user from auth.users using admin API"""
         try:
             url = f"{self.client.url}/auth/v1/admin/users/{user_id}"
-            
-            with httpx.Client() as http_client:
-                response = http_client.delete(url, headers=self.client.headers)
-                
-                if response.status_code in [200, 204]:
-                    print(f"✅ User {user_id} deleted from auth.users successfully")
-                    return True
-                else:
-                    print(f"❌ Failed to delete user from auth.users: HTTP {response.status_code} - {response.text}")
-                    return False
-                    
+            response = self.client.http.delete(url, headers=self.client.headers)
+            return self._handle_delete_response(user_id, response)
         except Exception as e:
             print(f"❌ Error deleting user from auth.users: {e}")
             return False
+    
+    async def delete_user_async(self, user_id: str):
+        """Delete user from auth.users without blocking the event loop"""
+        try:
+            url = f"{self.client.url}/auth/v1/admin/users/{user_id}"
+            response = await self.client.async_http.delete(url, headers=self.client.headers)
+            return self._handle_delete_response(user_id, response)
+        except Exception as e:
+            print(f"❌ Error deleting user from auth.users: {e}")
+            return False
+    
+    def _handle_delete_response(self, user_id: str, response: httpx.Response):
+        if response.status_code in [200, 204]:
+            print(f"✅ User {user_id} deleted from auth.users successfully")
+            return True
+        else:
+            print(f"❌ Failed to delete user from auth.users: HTTP {response.status_code} - {response.text}")
+            return False
 
 class SupabaseAuth:
     def __init__(self, client: SupabaseHTTPClient):
@@ -229,4 +573,10 @@ if supabase_admin:
 if supabase:
     supabase.rpc = lambda function_name, params=None: SupabaseRPCQuery(supabase, function_name, params)
 if supabase_admin:
-    supabase_admin.rpc = lambda function_name, params=None: SupabaseRPCQuery(supabase_admin, function_name, params)
\ No newline at end of file
+    supabase_admin.rpc = lambda function_name, params=None: SupabaseRPCQuery(supabase_admin, function_name, params)
+
+async def close_supabase_clients():
+    """Release pooled connections held by the module-level clients"""
+    for client in (supabase, supabase_admin):
+        if client:
+            await client.aclose()
@@ -0,0 +1,134 @@
+-- Atomic marketplace purchase: balance check, buyer debit, seller credit,
+-- transaction record, both notifications and the company fee update in a
+-- single Postgres transaction, so the API needs one RPC round trip.
+-- Buyer and seller account rows are locked (in user_id order, to avoid
+-- deadlocks between crossing purchases) before any balance is read, so
+-- concurrent purchases can no longer overwrite each other's balances.
+CREATE OR REPLACE FUNCTION public.process_marketplace_purchase_atomic(
+    p_buyer_id UUID,
+    p_seller_id UUID,
+    p_product_id UUID,
+    p_amount DECIMAL(20, 2),
+    p_description TEXT DEFAULT NULL
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_buyer_balance DECIMAL(20, 2);
+    v_buyer_new_balance DECIMAL(20, 2);
+    v_seller_new_balance DECIMAL(20, 2);
+    v_platform_fee DECIMAL(20, 2);
+    v_seller_amount DECIMAL(20, 2);
+    v_transaction_id UUID;
+    v_company JSONB := NULL;
+BEGIN
+    IF p_amount IS NULL OR p_amount <= 0 THEN
+        RETURN jsonb_build_object(
+            'success', false,
+            'error', 'invalid_amount',
+            'message', 'Purchase amount must be positive'
+        );
+    END IF;
+
+    -- Make sure both accounts exist so they can be locked
+    INSERT INTO public.user_accounts (user_id, balance, currency)
+    VALUES (p_buyer_id, 0, 'USD'), (p_seller_id, 0, 'USD')
+    ON CONFLICT (user_id) DO NOTHING;
+
+    -- Lock both rows in a stable order
+    PERFORM 1
+    FROM public.user_accounts
+    WHERE user_id IN (p_buyer_id, p_seller_id)
+    ORDER BY user_id
+    FOR UPDATE;
+
+    SELECT COALESCE(balance, 0) INTO v_buyer_balance
+    FROM public.user_accounts
+    WHERE user_id = p_buyer_id;
+
+    IF v_buyer_balance < p_amount THEN
+        RETURN jsonb_build_object(
+            'success', false,
+            'error', 'insufficient_funds',
+            'message', 'Insufficient balance to complete purchase',
+            'current_balance', v_buyer_balance,
+            'required_amount', p_amount
+        );
+    END IF;
+
+    -- Calculate fees (10% platform fee)
+    v_platform_fee := ROUND(p_amount * 0.10, 2);
+    v_seller_amount := p_amount - v_platform_fee;
+
+    -- 1. Deduct amount from buyer's balance
+    UPDATE public.user_accounts
+    SET balance = COALESCE(balance, 0) - p_amount,
+        updated_at = NOW()
+    WHERE user_id = p_buyer_id
+    RETURNING balance INTO v_buyer_new_balance;
+
+    -- 2. Add seller amount to seller's balance
+    UPDATE public.user_accounts
+    SET balance = COALESCE(balance, 0) + v_seller_amount,
+        updated_at = NOW()
+    WHERE user_id = p_seller_id
+    RETURNING balance INTO v_seller_new_balance;
+
+    -- Buying your own product leaves the buyer with the seller credit too
+    IF p_buyer_id = p_seller_id THEN
+        v_buyer_new_balance := v_seller_new_balance;
+    END IF;
+
+    -- 3. Create transaction record for the purchase
+    INSERT INTO public.transactions (
+        user_id, seller_id, product_id, transaction_type,
+        amount, platform_fee, net_amount, status, description
+    ) VALUES (
+        p_buyer_id, p_seller_id, p_product_id, 'purchase',
+        p_amount, v_platform_fee, v_seller_amount, 'completed',
+        COALESCE(p_description, 'Purchase of product ' || p_product_id::TEXT)
+    ) RETURNING id INTO v_transaction_id;
+
+    -- 4. Notifications for buyer and seller
+    INSERT INTO public.user_notifications (user_id, title, message, type, is_read)
+    VALUES
+    (
+        p_buyer_id,
+        'Purchase Successful! 🛒',
+        'You have successfully purchased "' || COALESCE(p_description, 'a product') || '" for $'
+            || TRIM(TO_CHAR(p_amount, '999999999990.00')) || '. Your new balance is $'
+            || TRIM(TO_CHAR(v_buyer_new_balance, '999999999990.00')) || '.',
+        'success',
+        false
+    ),
+    (
+        p_seller_id,
+        'Sale Completed! 💰',
+        'Your product was purchased for $' || TRIM(TO_CHAR(p_amount, '999999999990.00'))
+            || '. You received $' || TRIM(TO_CHAR(v_seller_amount, '999999999990.00'))
+            || ' (after 10% platform fee).',
+        'success',
+        false
+    );
+
+    -- 5. Company balance; best effort, a failure here must not undo the purchase
+    BEGIN
+        v_company := public.update_company_balance_marketplace(v_platform_fee);
+    EXCEPTION WHEN OTHERS THEN
+        v_company := jsonb_build_object('success', false, 'message', SQLERRM);
+    END;
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'transaction_id', v_transaction_id,
+        'amount_charged', p_amount,
+        'platform_fee', v_platform_fee,
+        'seller_received', v_seller_amount,
+        'buyer_new_balance', v_buyer_new_balance,
+        'seller_new_balance', v_seller_new_balance,
+        'company_balance', v_company
+    );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Grant execute permissions
+GRANT EXECUTE ON FUNCTION public.process_marketplace_purchase_atomic(UUID, UUID, UUID, DECIMAL, TEXT) TO service_role;
@@ -0,0 +1,75 @@
+-- Charge one AI chat turn and record it in a single round trip.
+-- The debit is a conditional UPDATE (balance >= cost), so two chat tabs
+-- racing on the same account cannot both spend the last cents; the user
+-- and assistant messages are only written if the charge went through.
+CREATE OR REPLACE FUNCTION public.charge_and_record_chat_turn(
+    p_user_id UUID,
+    p_session_id UUID,
+    p_cost DECIMAL(20, 2),
+    p_user_message TEXT DEFAULT NULL,
+    p_assistant_message TEXT DEFAULT NULL,
+    p_ai_model VARCHAR DEFAULT NULL,
+    p_bot_creation_stage VARCHAR DEFAULT 'initial'
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_new_balance DECIMAL(20, 2);
+    v_current_balance DECIMAL(20, 2);
+    v_user_message_id UUID := NULL;
+    v_assistant_message_id UUID := NULL;
+BEGIN
+    -- Atomic debit-if-sufficient
+    UPDATE public.user_accounts
+    SET balance = balance - p_cost,
+        updated_at = NOW()
+    WHERE user_id = p_user_id
+      AND balance >= p_cost
+    RETURNING balance INTO v_new_balance;
+
+    IF NOT FOUND THEN
+        SELECT COALESCE(balance, 0) INTO v_current_balance
+        FROM public.user_accounts
+        WHERE user_id = p_user_id;
+
+        RETURN jsonb_build_object(
+            'success', false,
+            'error', 'insufficient_balance',
+            'current_balance', COALESCE(v_current_balance, 0),
+            'required_cost', p_cost
+        );
+    END IF;
+
+    IF p_user_message IS NOT NULL THEN
+        INSERT INTO public.ai_bot_chat_history (
+            user_id, session_id, message_type, message_content,
+            ai_model, bot_creation_stage
+        ) VALUES (
+            p_user_id, p_session_id, 'user', p_user_message,
+            p_ai_model, p_bot_creation_stage
+        )
+        RETURNING id INTO v_user_message_id;
+    END IF;
+
+    IF p_assistant_message IS NOT NULL THEN
+        INSERT INTO public.ai_bot_chat_history (
+            user_id, session_id, message_type, message_content,
+            ai_model, bot_creation_stage
+        ) VALUES (
+            p_user_id, p_session_id, 'assistant', p_assistant_message,
+            p_ai_model, p_bot_creation_stage
+        )
+        RETURNING id INTO v_assistant_message_id;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'charged', p_cost,
+        'new_balance', v_new_balance,
+        'user_message_id', v_user_message_id,
+        'assistant_message_id', v_assistant_message_id
+    );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Grant execute permissions
+GRANT EXECUTE ON FUNCTION public.charge_and_record_chat_turn(UUID, UUID, DECIMAL, TEXT, TEXT, VARCHAR, VARCHAR) TO service_role;
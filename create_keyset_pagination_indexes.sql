@@ -0,0 +1,18 @@
+-- Indexes backing keyset (cursor) pagination on (created_at, id)
+-- Each history endpoint filters by user and walks newest-first, so the
+-- cursor predicate becomes an index range scan of `limit` rows.
+
+CREATE INDEX IF NOT EXISTS idx_transactions_user_created_id
+    ON public.transactions (user_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_transactions_seller_created_id
+    ON public.transactions (seller_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_user_notifications_user_created_id
+    ON public.user_notifications (user_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_nowpayments_invoices_user_created_id
+    ON public.nowpayments_invoices (user_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_nowpayments_withdrawals_user_created_id
+    ON public.nowpayments_withdrawals (user_id, created_at DESC, id DESC);
@@ -0,0 +1,17 @@
+-- Idempotency store for NowPayments IPN webhooks.
+-- One row per (payment_id, payment_status): the webhook claims a key with
+-- INSERT ... ON CONFLICT DO NOTHING before processing it, so NowPayments
+-- retries of an IPN that was already applied are answered without
+-- repeating the subscription, notification and balance writes.
+CREATE TABLE IF NOT EXISTS public.nowpayments_processed_ipns (
+    payment_id TEXT NOT NULL,
+    payment_status TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'processing' CHECK (state IN ('processing', 'processed')),
+    claimed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    processed_at TIMESTAMPTZ,
+    PRIMARY KEY (payment_id, payment_status)
+);
+
+ALTER TABLE public.nowpayments_processed_ipns ENABLE ROW LEVEL SECURITY;
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON public.nowpayments_processed_ipns TO service_role;
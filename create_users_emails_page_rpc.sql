@@ -0,0 +1,33 @@
+-- Keyset page of auth.users for streaming exports (Google Sheets sync).
+-- Newest first on (created_at, id); pass the last row of the previous page
+-- as p_after_created_at / p_after_id. Each call returns at most p_limit
+-- rows instead of materialising every user like get_users_emails_simple().
+CREATE OR REPLACE FUNCTION public.get_users_emails_page(
+    p_after_created_at TIMESTAMPTZ DEFAULT NULL,
+    p_after_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 1000
+)
+RETURNS TABLE (
+    user_id UUID,
+    email TEXT,
+    created_at TIMESTAMPTZ
+)
+SECURITY DEFINER
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        au.id AS user_id,
+        au.email::TEXT,
+        au.created_at
+    FROM
+        auth.users au
+    WHERE
+        p_after_created_at IS NULL
+        OR (au.created_at, au.id) < (p_after_created_at, p_after_id)
+    ORDER BY au.created_at DESC, au.id DESC
+    LIMIT LEAST(GREATEST(p_limit, 1), 5000);
+$$;
+
+-- Grant execute permissions
+GRANT EXECUTE ON FUNCTION public.get_users_emails_page(TIMESTAMPTZ, UUID, INTEGER) TO service_role;
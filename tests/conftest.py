@@ -0,0 +1,190 @@
+import os
+import sys
+
+import pytest
+
+# Backend modules import each other as top-level packages (services.x, supabase_client)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+# Keep the module-level stores of imported routes in memory during tests
+os.environ.setdefault("WEBHOOK_QUEUE_PATH", ":memory:")
+os.environ.setdefault("FEED_STORE_BACKEND", "memory")
+os.environ.setdefault("SHEETS_INDEX_PATH", "")
+
+
+class FakeResult:
+    def __init__(self, data=None, error=None):
+        self.data = data
+        self.error = error
+
+
+class FakeQuery:
+    """Chainable stand-in for SupabaseQuery, run against FakeSupabase's in-memory rows"""
+
+    def __init__(self, db, target, operation, data=None, on_conflict=None, ignore_duplicates=False, returning="representation"):
+        self.db = db
+        self.target = target
+        self.operation = operation
+        self.data = data
+        self.on_conflict = on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        self.returning = returning
+        self.filters = []  # (method, column, value) as called, for assertions
+        self._predicates = []
+        self._order = None
+        self._limit = None
+
+    def _filter(self, method, column, value, predicate):
+        self.filters.append((method, column, value))
+        self._predicates.append(lambda row: predicate(row.get(column)))
+        return self
+
+    def eq(self, column, value):
+        return self._filter('eq', column, value, lambda v: v == value)
+
+    def neq(self, column, value):
+        return self._filter('neq', column, value, lambda v: v is not None and v != value)
+
+    def lt(self, column, value):
+        return self._filter('lt', column, value, lambda v: v is not None and v < value)
+
+    def lte(self, column, value):
+        return self._filter('lte', column, value, lambda v: v is not None and v <= value)
+
+    def gt(self, column, value):
+        return self._filter('gt', column, value, lambda v: v is not None and v > value)
+
+    def gte(self, column, value):
+        return self._filter('gte', column, value, lambda v: v is not None and v >= value)
+
+    def in_(self, column, values):
+        return self._filter('in_', column, values, lambda v: v in values)
+
+    def is_(self, column, value):
+        return self._filter('is_', column, value, lambda v: v is None if value in (None, 'null') else v is value)
+
+    def not_(self, column, operator, value):
+        assert operator == 'in', "FakeQuery.not_ only supports 'in'"
+        return self._filter('not_', column, value, lambda v: v not in value)
+
+    def order(self, column, desc=False, **options):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _matching(self, rows):
+        matched = [row for row in rows if all(predicate(row) for predicate in self._predicates)]
+        if self._order:
+            column, desc = self._order
+            matched.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        return matched[:self._limit] if self._limit is not None else matched
+
+    def _run(self):
+        if self.operation == 'rpc':
+            function = self.db.functions.get(self.target)
+            if function is None:
+                return FakeResult(error=f"function {self.target} does not exist")
+            return FakeResult(function(self.data or {}))
+
+        rows = self.db.rows(self.target)
+        if self.operation == 'select':
+            return FakeResult([dict(row) for row in self._matching(rows)])
+        if self.operation in ('insert', 'upsert'):
+            written = []
+            for data in self.data if isinstance(self.data, list) else [self.data]:
+                keys = (self.on_conflict or 'id').split(',')
+                existing = next((row for row in rows if all(k in data and row.get(k) == data[k] for k in keys)), None)
+                if self.operation == 'upsert' and existing is not None:
+                    if not self.ignore_duplicates:
+                        existing.update(data)
+                        written.append(existing)
+                    continue
+                row = dict(data)
+                row.setdefault('id', f"{self.target}-{len(rows) + 1}")
+                rows.append(row)
+                written.append(row)
+        else:
+            written = self._matching(rows)
+            for row in written:
+                if self.operation == 'update':
+                    row.update(self.data)
+                else:
+                    rows.remove(row)
+        return FakeResult([] if self.returning == 'minimal' else [dict(row) for row in written])
+
+    async def execute_async(self):
+        self.db.calls.append(self)
+        error = self.db.error or self.db.errors.get(self.target)
+        if error:
+            return FakeResult(error=error)
+        if self.db.respond is not None:
+            scripted = self.db.respond(self)
+            if scripted is not None:
+                return scripted
+        return self._run()
+
+
+class FakeTable:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def select(self, columns='*', **options):
+        return FakeQuery(self.db, self.name, 'select')
+
+    def insert(self, data, returning="representation"):
+        return FakeQuery(self.db, self.name, 'insert', data, returning=returning)
+
+    def upsert(self, data, on_conflict=None, ignore_duplicates=False, returning="representation"):
+        return FakeQuery(self.db, self.name, 'upsert', data, on_conflict, ignore_duplicates, returning)
+
+    def update(self, data, returning="representation"):
+        return FakeQuery(self.db, self.name, 'update', data, returning=returning)
+
+    def delete(self, returning="representation"):
+        return FakeQuery(self.db, self.name, 'delete', returning=returning)
+
+
+class FakeSupabase:
+    """In-memory stand-in for supabase_client.supabase_admin.
+
+    tables:    table name -> list of row dicts
+    functions: RPC name -> callable(params) returning the RPC's data
+    error:     returned by every call (the database is unreachable)
+    errors:    table / RPC name -> error returned by calls to it
+    respond:   optional callable(query) -> FakeResult overriding a call (None runs it normally)
+    calls:     every executed query, in order
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.functions = {}
+        self.error = None
+        self.errors = {}
+        self.respond = None
+        self.calls = []
+
+    def rows(self, name):
+        return self.tables.setdefault(name, [])
+
+    def table(self, name):
+        return FakeTable(self, name)
+
+    def rpc(self, function_name, params=None):
+        return FakeQuery(self, function_name, 'rpc', params)
+
+    def executed(self, target, operation):
+        return [call for call in self.calls if call.target == target and call.operation == operation]
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    """A FakeSupabase installed as supabase_client.supabase_admin"""
+    import supabase_client
+
+    fake = FakeSupabase()
+    monkeypatch.setattr(supabase_client, "supabase_admin", fake)
+    return fake
@@ -0,0 +1,241 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.feed_store import FeedStore, etag_matches
+
+START = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def entry(minute, entry_id=None):
+    return {"id": entry_id or f"e{minute}", "title": f"t{minute}", "created_at": START + timedelta(minutes=minute)}
+
+
+def ids(store, limit=100):
+    return [e["id"] for e in store.latest(limit)]
+
+
+def test_in_order_entries_are_served_newest_first():
+    store = FeedStore(max_entries=5)
+    for minute in range(3):
+        assert store.add(entry(minute))
+    assert ids(store) == ["e2", "e1", "e0"]
+
+
+def test_full_feed_drops_the_oldest():
+    store = FeedStore(max_entries=3)
+    for minute in range(5):
+        store.add(entry(minute))
+    assert ids(store) == ["e4", "e3", "e2"]
+    assert len(store) == 3
+
+
+def test_out_of_order_entry_is_placed_by_created_at():
+    store = FeedStore(max_entries=5)
+    for minute in (0, 2, 4):
+        store.add(entry(minute))
+    assert store.add(entry(3))
+    assert store.add(entry(1))
+    assert ids(store) == ["e4", "e3", "e2", "e1", "e0"]
+
+
+def test_out_of_order_entry_evicts_the_oldest_when_full():
+    store = FeedStore(max_entries=3)
+    for minute in (0, 2, 4):
+        store.add(entry(minute))
+    assert store.add(entry(3))
+    assert ids(store) == ["e4", "e3", "e2"]
+
+
+def test_entry_older_than_a_full_feed_is_rejected():
+    store = FeedStore(max_entries=3)
+    for minute in (2, 3, 4):
+        store.add(entry(minute))
+    version = store.version
+    assert not store.add(entry(1))
+    assert ids(store) == ["e4", "e3", "e2"]
+    assert store.version == version
+
+
+def test_latest_respects_limit():
+    store = FeedStore(max_entries=5)
+    for minute in range(5):
+        store.add(entry(minute))
+    assert ids(store, 2) == ["e4", "e3"]
+
+
+def test_cached_response_is_served_until_the_feed_changes():
+    store = FeedStore()
+    store.add(entry(0))
+    assert store.cached_response("en", 20) is None
+
+    body, etag = store.cache_response("en", 20, b'[{"id": "e0"}]', store.version)
+    assert store.cached_response("en", 20) == (body, etag)
+    assert store.cached_response("ru", 20) is None
+    assert store.response_hits == 1
+
+    store.add(entry(1))
+    assert store.cached_response("en", 20) is None
+
+
+def test_etag_depends_on_the_body_only():
+    first, second = FeedStore(), FeedStore()
+    _, etag_a = first.cache_response("en", 20, b"[1]", first.version)
+    _, etag_b = second.cache_response("ru", 5, b"[1]", second.version)
+    _, etag_c = second.cache_response("en", 20, b"[2]", second.version)
+    assert etag_a == etag_b != etag_c
+    assert etag_a.startswith('"') and etag_a.endswith('"')
+
+
+def test_body_built_from_an_older_version_is_not_cached():
+    store = FeedStore()
+    version = store.version
+    store.add(entry(0))
+    body, etag = store.cache_response("en", 20, b"[]", version)
+    assert body == b"[]" and etag
+    assert store.cached_response("en", 20) is None
+
+
+def test_response_cache_is_bounded(monkeypatch):
+    from services import feed_store as module
+
+    monkeypatch.setattr(module, "FEED_RESPONSE_CACHE_SIZE", 2)
+    store = FeedStore()
+    for limit in (1, 2, 3):
+        store.cache_response("en", limit, b"[]", store.version)
+    assert store.cached_response("en", 1) is None
+    assert store.cached_response("en", 3) is not None
+
+
+def test_clear_and_translation_updates_invalidate_responses():
+    store = FeedStore()
+    store.add(entry(0))
+    store.cache_response("en", 20, b"[]", store.version)
+    store.invalidate_responses()
+    assert store.cached_response("en", 20) is None
+
+    store.cache_response("en", 20, b"[]", store.version)
+    store.clear()
+    assert store.cached_response("en", 20) is None
+    assert len(store) == 0
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", "abc"', True),
+    ("*", True),
+    ('"xyz"', False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"abc"') is expected
+
+
+class Result:
+    def __init__(self, data=None, error=None):
+        self.data = data
+        self.error = error
+
+
+class Query:
+    def __init__(self, rows, data=None, on_conflict=None):
+        self.rows = rows
+        self.data = data
+        self.on_conflict = on_conflict
+        self.filters = []
+        self.newest_first = False
+        self.count = None
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def order(self, column, desc=False):
+        self.newest_first = desc
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    async def execute_async(self):
+        if self.data is not None:
+            keys = self.on_conflict.split(',')
+            for row in self.rows:
+                if all(row[k] == self.data[k] for k in keys):
+                    if self.on_conflict == 'content_hash':
+                        return Result([])
+                    row.update(self.data)
+                    return Result([dict(row)])
+            self.rows.append(dict(self.data))
+            return Result([dict(self.data)])
+        matched = [row for row in self.rows if all(f(row) for f in self.filters)]
+        if self.newest_first:
+            matched.reverse()
+        return Result([dict(row) for row in matched[:self.count]])
+
+
+class Table:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def upsert(self, data, on_conflict=None, **options):
+        return Query(self.rows, data, on_conflict)
+
+    def select(self, columns='*'):
+        return Query(self.rows)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables = {'news_feed': [], 'translations': []}
+
+    def table(self, name):
+        return Table(self.tables[name])
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    import supabase_client
+
+    fake = FakeSupabase()
+    monkeypatch.setattr(supabase_client, "supabase_admin", fake)
+    return fake
+
+
+def news(entry_id, title="Headline"):
+    return {
+        "id": entry_id, "title": title, "summary": "Summary", "sentiment": 50, "source": "test",
+        "timestamp": START, "created_at": START
+    }
+
+
+def test_translation_of_a_duplicate_headline_references_the_stored_row(supabase):
+    from services.feed_backends import SupabaseFeedBackend
+
+    async def run():
+        backend = SupabaseFeedBackend()
+        await backend.save_entry(news("first"), 20)
+        await backend.save_entry(news("second"), 20)
+        await backend.save_translation("second_ru", "second", "ru", {"title": "T", "summary": "S"})
+
+    asyncio.run(run())
+    assert [row["id"] for row in supabase.tables["news_feed"]] == ["first"]
+    assert [row["news_feed_id"] for row in supabase.tables["translations"]] == ["first"]
+
+
+def test_marker_changes_when_a_translation_is_written(supabase):
+    from services.feed_backends import SupabaseFeedBackend
+
+    async def run():
+        backend = SupabaseFeedBackend()
+        await backend.save_entry(news("first"), 20)
+        before = await backend.marker()
+        await backend.save_translation("first_ru", "first", "ru", {"title": "T", "summary": "S"})
+        return before, await backend.marker()
+
+    before, after = asyncio.run(run())
+    assert before == ("first", None)
+    assert after != before
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from services.ipn_idempotency import IPNIdempotency
+
+IPNS = "nowpayments_processed_ipns"
+
+
+def claim_row(supabase, payment_id, payment_status):
+    return next((row for row in supabase.rows(IPNS) if (row["payment_id"], row["payment_status"]) == (payment_id, payment_status)), None)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_first_claim_processes_and_records(supabase):
+    ipn = IPNIdempotency()
+    assert run(ipn.claim(101, "finished")) is None
+    assert claim_row(supabase, "101", "finished")["state"] == "processing"
+
+    run(ipn.complete(101, "finished"))
+    assert claim_row(supabase, "101", "finished")["state"] == "processed"
+    assert ipn.seen(101, "finished")
+
+
+def test_duplicate_after_completion_caught_in_memory(supabase):
+    ipn = IPNIdempotency()
+    run(ipn.claim(101, "finished"))
+    run(ipn.complete(101, "finished"))
+    assert run(ipn.claim(101, "finished")) == "memory"
+
+
+def test_concurrent_duplicate_caught_in_flight(supabase):
+    ipn = IPNIdempotency()
+    assert run(ipn.claim(101, "finished")) is None
+    assert run(ipn.claim(101, "finished")) == "inflight"
+
+
+def test_other_worker_duplicate_caught_in_database(supabase):
+    first, second = IPNIdempotency(), IPNIdempotency()
+    run(first.claim(101, "finished"))
+    run(first.complete(101, "finished"))
+
+    assert run(second.claim(101, "finished")) == "database"
+    # A processed row is remembered, so the next duplicate needs no I/O
+    assert second.seen(101, "finished")
+
+
+def test_status_change_is_a_new_key(supabase):
+    ipn = IPNIdempotency()
+    run(ipn.claim(101, "confirming"))
+    run(ipn.complete(101, "confirming"))
+    assert run(ipn.claim(101, "finished")) is None
+
+
+def test_release_lets_a_retry_process_again(supabase):
+    first, second = IPNIdempotency(), IPNIdempotency()
+    run(first.claim(101, "finished"))
+    run(first.release(101, "finished"))
+
+    assert claim_row(supabase, "101", "finished") is None
+    assert not first.seen(101, "finished")
+    assert run(second.claim(101, "finished")) is None
+
+
+def test_stale_claim_is_taken_over(supabase, monkeypatch):
+    first, second = IPNIdempotency(), IPNIdempotency()
+    run(first.claim(101, "finished"))
+    # The first worker died; its claim is older than the timeout
+    claim_row(supabase, "101", "finished")["claimed_at"] = "2000-01-01T00:00:00+00:00"
+
+    assert run(second.claim(101, "finished")) is None
+    assert second.stats()["reclaimed"] == 1
+
+
+def test_fresh_claim_of_another_worker_is_a_duplicate(supabase):
+    first, second = IPNIdempotency(), IPNIdempotency()
+    run(first.claim(101, "finished"))
+    assert run(second.claim(101, "finished")) == "database"
+    assert not second.seen(101, "finished")
+
+
+def test_unavailable_table_falls_back_to_memory(supabase):
+    supabase.error = "relation does not exist"
+    ipn = IPNIdempotency()
+    assert run(ipn.claim(101, "finished")) is None
+    assert run(ipn.claim(101, "finished")) == "inflight"
+    run(ipn.complete(101, "finished"))
+    assert run(ipn.claim(101, "finished")) == "memory"
+    assert ipn.stats()["db_errors"] >= 2
+
+
+def test_lru_is_bounded(supabase):
+    ipn = IPNIdempotency(lru_size=2)
+    for payment_id in (1, 2, 3):
+        run(ipn.claim(payment_id, "finished"))
+        run(ipn.complete(payment_id, "finished"))
+    assert ipn.stats()["remembered"] == 2
+    assert not ipn.seen(1, "finished")
+
+
+@pytest.fixture
+def nowpayments(monkeypatch):
+    from routes import nowpayments as module
+
+    monkeypatch.setattr(module, "ipn_idempotency", IPNIdempotency())
+    return module
+
+
+TOPUP_IPN = '{"payment_id": 555, "payment_status": "finished", "invoice_id": 777, "actually_paid": "50"}'
+
+
+def test_failed_database_write_is_not_recorded_as_processed(supabase, nowpayments):
+    supabase.error = "upstream request timed out"
+    with pytest.raises(RuntimeError):
+        run(nowpayments.apply_nowpayments_ipn(TOPUP_IPN))
+
+    ipn = nowpayments.ipn_idempotency
+    assert not ipn.seen(555, "finished")
+    assert ipn.stats()["released"] == 1 and ipn.stats()["processed"] == 0
+
+
+def test_successful_ipn_is_completed_once(supabase, nowpayments, monkeypatch):
+    calls = []
+
+    async def process(webhook_data):
+        calls.append(webhook_data["payment_id"])
+        return {"success": True}
+
+    monkeypatch.setattr(nowpayments, "process_nowpayments_ipn", process)
+    run(nowpayments.apply_nowpayments_ipn(TOPUP_IPN))
+    result = run(nowpayments.apply_nowpayments_ipn(TOPUP_IPN))
+
+    assert calls == [555]
+    assert result["duplicate"] is True
+    assert claim_row(supabase, "555", "finished")["state"] == "processed"
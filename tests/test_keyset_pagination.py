@@ -0,0 +1,56 @@
+import pytest
+
+from supabase_client import SupabaseHTTPClient, decode_cursor, encode_cursor, keyset_page
+
+
+def rows(n):
+    return [{"id": f"id-{i}", "created_at": f"2026-01-{30 - i:02d}T00:00:00+00:00"} for i in range(n)]
+
+
+def test_cursor_round_trip():
+    row = {"id": "0b6f", "created_at": "2026-01-02T03:04:05.123456+00:00"}
+    assert decode_cursor(encode_cursor(row)) == ("2026-01-02T03:04:05.123456+00:00", "0b6f")
+
+
+def test_cursor_custom_columns():
+    row = {"seq": 7, "uid": "abc"}
+    assert decode_cursor(encode_cursor(row, sort_column="seq", id_column="uid")) == (7, "abc")
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "WzFd", encode_cursor({})])
+def test_malformed_cursor_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_last_page_has_no_cursor():
+    page, cursor = keyset_page(rows(3), 3)
+    assert len(page) == 3 and cursor is None
+
+
+def test_extra_row_yields_cursor_for_last_returned_row():
+    data = rows(4)
+    page, cursor = keyset_page(data, 3)
+    assert page == data[:3]
+    assert decode_cursor(cursor) == (data[2]["created_at"], data[2]["id"])
+
+
+@pytest.mark.parametrize("data", [None, []])
+def test_empty_result(data):
+    assert keyset_page(data, 10) == ([], None)
+
+
+@pytest.mark.parametrize("limit", [0, -5])
+def test_non_positive_limit_returns_empty_page(limit):
+    assert keyset_page(rows(3), limit) == ([], None)
+
+
+def test_keyset_query_filters_after_cursor():
+    client = SupabaseHTTPClient("http://localhost", "key")
+    cursor = encode_cursor({"id": "id-2", "created_at": "2026-01-28T00:00:00+00:00"})
+    _, _, kwargs = client.table("transactions").select("*").keyset(cursor, 10)._build_request()
+    params = dict(kwargs["params"])
+    assert params["limit"] == "11"
+    assert params["order"] == "created_at.desc,id.desc"
+    # The timestamp contains ':' and '.', so it must be quoted inside the logic tree
+    assert params["and"] == '(or(created_at.lt."2026-01-28T00:00:00+00:00",and(created_at.eq."2026-01-28T00:00:00+00:00",id.lt.id-2)))'
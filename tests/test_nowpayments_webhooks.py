@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import hmac
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import supabase_client
+from routes import nowpayments
+from services.webhook_queue import WebhookQueue
+
+SECRET = "ipn-secret"
+
+
+class Result:
+    def __init__(self, data=None, error=None):
+        self.data = data
+        self.error = error
+
+
+class Call:
+    """Chainable stand-in for a query; execute_async() asks the database for its result"""
+
+    def __init__(self, db, target, operation, data=None):
+        self.db = db
+        self.target = target
+        self.operation = operation
+        self.data = data
+        self.filters = []
+
+    def __getattr__(self, name):
+        def chain(*args, **kwargs):
+            self.filters.append((name,) + args)
+            return self
+        return chain
+
+    async def execute_async(self):
+        self.db.calls.append(self)
+        return self.db.respond(self)
+
+
+class ScriptedDatabase:
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = []
+
+    def table(self, name):
+        db = self
+
+        class Table:
+            def select(self, columns='*'):
+                return Call(db, name, 'select')
+
+            def insert(self, data, **options):
+                return Call(db, name, 'insert', data)
+
+            def update(self, data, **options):
+                return Call(db, name, 'update', data)
+
+            def delete(self, **options):
+                return Call(db, name, 'delete')
+
+        return Table()
+
+    def rpc(self, function_name, params=None):
+        return Call(self, function_name, 'rpc', params)
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    queue = WebhookQueue(":memory:")
+    monkeypatch.setattr(nowpayments, "webhook_queue", queue)
+    return queue
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(nowpayments.router)
+    return TestClient(app)
+
+
+def sign(payload, sorted_keys=True):
+    body = json.dumps(payload, sort_keys=sorted_keys, separators=(',', ':')).encode()
+    return hmac.new(SECRET.encode(), body, hashlib.sha512).hexdigest()
+
+
+IPN = {"payment_status": "finished", "payment_id": 5077, "actually_paid": "20", "invoice_id": 9}
+
+
+def test_ipn_with_invalid_signature_is_rejected_before_queueing(monkeypatch, queue, client):
+    monkeypatch.setattr(nowpayments, "NOWPAYMENTS_IPN_SECRET", SECRET)
+    response = client.post("/nowpayments/webhook", content=json.dumps(IPN), headers={"x-nowpayments-sig": "0" * 128})
+    assert response.status_code == 401
+    assert queue.stats()["enqueued"] == 0
+
+
+def test_unsigned_ipn_is_rejected_when_a_secret_is_configured(monkeypatch, queue, client):
+    monkeypatch.setattr(nowpayments, "NOWPAYMENTS_IPN_SECRET", SECRET)
+    response = client.post("/nowpayments/webhook", content=json.dumps(IPN))
+    assert response.status_code == 401
+    assert queue.stats()["enqueued"] == 0
+
+
+def test_ipn_signed_over_sorted_json_is_queued(monkeypatch, queue, client):
+    monkeypatch.setattr(nowpayments, "NOWPAYMENTS_IPN_SECRET", SECRET)
+    # Keys arrive unsorted; NowPayments signs the key-sorted JSON
+    response = client.post("/nowpayments/webhook", content=json.dumps(IPN), headers={"x-nowpayments-sig": sign(IPN)})
+    assert response.status_code == 200 and response.json()["success"]
+    assert queue.stats()["enqueued"] == 1
+
+
+def test_withdrawal_with_invalid_signature_is_rejected(monkeypatch, queue, client):
+    monkeypatch.setattr(nowpayments, "NOWPAYMENTS_IPN_SECRET", SECRET)
+    payload = {"id": "batch-1", "status": "FINISHED"}
+    response = client.post("/nowpayments/withdrawal/webhook", content=json.dumps(payload), headers={"x-nowpayments-sig": sign({"id": "other"})})
+    assert response.status_code == 401
+    assert queue.stats()["enqueued"] == 0
+
+
+def test_signature_check_is_skipped_without_a_secret(monkeypatch):
+    monkeypatch.setattr(nowpayments, "NOWPAYMENTS_IPN_SECRET", None)
+    assert nowpayments.verify_nowpayments_signature(b"{}", None)
+
+
+def run_withdrawal(monkeypatch, respond, payload):
+    db = ScriptedDatabase(respond)
+    monkeypatch.setattr(supabase_client, "supabase_admin", db)
+    return db, asyncio.run(nowpayments.process_withdrawal_webhook(payload))
+
+
+def test_failed_status_function_raises_for_retry(monkeypatch):
+    def respond(call):
+        if call.operation == 'rpc':
+            return Result({"success": False, "message": "Withdrawal record not found for batch ID: batch-1"})
+        return Result([])
+
+    with pytest.raises(RuntimeError, match="not found"):
+        run_withdrawal(monkeypatch, respond, {"id": "batch-1", "status": "FINISHED"})
+
+
+def test_unavailable_database_raises_for_retry(monkeypatch):
+    with pytest.raises(RuntimeError):
+        run_withdrawal(monkeypatch, lambda call: Result(error="connection timed out"), {"id": "batch-1", "status": "FINISHED"})
+
+
+WITHDRAWAL = {"id": "w-1", "user_id": "u-1", "amount": 25.0, "currency": "usdttrc20", "status": "pending"}
+
+
+def manual_fallback(withdrawal, balance=100.0):
+    """Status function unavailable; the withdrawal and account rows as given"""
+    def respond(call):
+        if call.operation == 'rpc':
+            return Result(error="function update_withdrawal_status_webhook does not exist")
+        if call.target == 'nowpayments_withdrawals' and call.operation == 'select':
+            return Result([dict(withdrawal)])
+        if call.target == 'nowpayments_withdrawals' and call.operation == 'update':
+            completed = withdrawal["status"] in nowpayments.WITHDRAWAL_DEDUCTED_STATUSES
+            guarded = any(f[0] == 'not_' for f in call.filters)
+            return Result([] if guarded and completed else [dict(withdrawal, **call.data)])
+        if call.target == 'user_accounts' and call.operation == 'select':
+            return Result([{"balance": balance}])
+        return Result([{"balance": balance - withdrawal["amount"]}])
+    return respond
+
+
+def balance_updates(db):
+    return [call for call in db.calls if call.target == 'user_accounts' and call.operation == 'update']
+
+
+def test_manual_fallback_deducts_a_pending_withdrawal_once(monkeypatch):
+    db, result = run_withdrawal(monkeypatch, manual_fallback(WITHDRAWAL), {"id": "batch-1", "status": "FINISHED"})
+    assert result["success"]
+    [update] = balance_updates(db)
+    assert update.data["balance"] == 75.0
+    # Conditional on the balance that was read
+    assert ('eq', 'balance', 100.0) in update.filters
+
+
+def test_manual_fallback_skips_deduction_for_a_completed_withdrawal(monkeypatch):
+    completed = dict(WITHDRAWAL, status="completed")
+    db, result = run_withdrawal(monkeypatch, manual_fallback(completed), {"id": "batch-1", "status": "FINISHED"})
+    assert result["success"]
+    assert balance_updates(db) == []
+
+
+def test_redelivery_racing_the_completion_does_not_deduct(monkeypatch):
+    # Read as pending, but another delivery completed it before this update
+    state = dict(WITHDRAWAL)
+    respond = manual_fallback(state)
+
+    def racing(call):
+        if call.target == 'nowpayments_withdrawals' and call.operation == 'update':
+            state["status"] = "completed"
+        return respond(call)
+
+    db, result = run_withdrawal(monkeypatch, racing, {"id": "batch-1", "status": "FINISHED"})
+    assert result["success"]
+    assert balance_updates(db) == []
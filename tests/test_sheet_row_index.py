@@ -0,0 +1,87 @@
+import pytest
+
+from services.sheet_row_index import SheetIndexStore, SheetRowIndex
+
+
+def rows_of(index):
+    return {key: entry[0] for key, entry in index.entries.items()}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SheetIndexStore(str(tmp_path / "index.db"))
+
+
+def make_index(store=None, keys="abcde"):
+    index = SheetRowIndex("users", store)
+    index.rebuild((key, [key], None) for key in keys)
+    return index
+
+
+def test_rebuild_assigns_rows_below_header():
+    index = make_index()
+    assert rows_of(index) == {"a": 2, "b": 3, "c": 4, "d": 5, "e": 6}
+    assert index.next_row == 7
+
+
+def test_put_appends_new_keys_and_keeps_existing_rows():
+    index = make_index(keys="ab")
+    assert index.put("a", ["a", "changed"]) == 2
+    assert index.put("z", ["z"]) == 4
+    assert index.next_row == 5
+
+
+def test_remove_shifts_rows_below_each_deleted_row():
+    index = make_index()
+    assert index.remove(["b", "d", "missing"]) == [3, 5]
+    assert rows_of(index) == {"a": 2, "c": 3, "e": 4}
+    assert index.next_row == 5
+
+
+def test_remove_unknown_keys_is_a_no_op():
+    index = make_index()
+    assert index.remove(["x"]) == []
+    assert rows_of(index) == {"a": 2, "b": 3, "c": 4, "d": 5, "e": 6}
+
+
+def test_remove_rows_returns_keys_at_deleted_rows():
+    index = make_index()
+    assert sorted(index.remove_rows([2, 5, 5])) == ["a", "d"]
+    assert rows_of(index) == {"b": 2, "c": 3, "e": 4}
+    assert index.next_row == 5
+
+
+def test_remove_rows_without_indexed_keys_still_shifts():
+    index = make_index(keys="abc")
+    # Row 4 holds something the index never saw (e.g. a duplicate row)
+    index.entries["c"][0] = 5
+    index.next_row = 6
+    assert index.remove_rows([4]) == []
+    assert rows_of(index) == {"a": 2, "b": 3, "c": 4}
+
+
+def test_remove_rows_never_moves_next_row_above_header():
+    index = SheetRowIndex("users")
+    index.remove_rows([2, 3, 4])
+    assert index.next_row == index.first_row
+
+
+@pytest.mark.parametrize("delete", [
+    lambda index: index.remove(["a", "c", "e"]),
+    lambda index: index.remove_rows([2, 4, 6]),
+])
+def test_deletions_are_persisted(store, delete):
+    index = make_index(store)
+    delete(index)
+    index.flush()
+
+    reloaded = SheetRowIndex("users", store)
+    assert rows_of(reloaded) == rows_of(index) == {"b": 2, "d": 3}
+    assert reloaded.next_row == index.next_row == 4
+
+
+def test_discard_drops_uncommitted_changes(store):
+    index = make_index(store)
+    index.remove(["a"])
+    index.discard()
+    assert SheetRowIndex("users", store).entries == {}
@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+import pytest
+
+from services import webhook_queue as queue_module
+from services.webhook_queue import WebhookQueue
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(queue_module, "WEBHOOK_RETRY_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(queue_module, "WEBHOOK_RETRY_MAX_SECONDS", 0.05)
+    monkeypatch.setattr(queue_module, "WEBHOOK_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(queue_module, "WEBHOOK_MAX_ATTEMPTS", 3)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "queue.db")
+
+
+async def drain(queue, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while queue.stats()["pending"]:
+        assert time.monotonic() < deadline, queue.stats()
+        await asyncio.sleep(0.01)
+
+
+def run_queue(queue, scenario):
+    async def main():
+        await queue.start()
+        try:
+            await scenario()
+            await drain(queue)
+        finally:
+            await queue.stop()
+    asyncio.run(main())
+
+
+def test_jobs_with_one_key_run_in_arrival_order(path):
+    queue = WebhookQueue(path, workers=4)
+    applied = []
+
+    async def handler(body):
+        # Later jobs would overtake a slow first job without per-key ordering
+        await asyncio.sleep(0.02 if body.endswith(":0") else 0)
+        applied.append(body)
+
+    queue.register("ipn", handler)
+
+    async def scenario():
+        for i in range(5):
+            queue.enqueue("ipn", f"payment-a:{i}", ordering_key="payment-a")
+
+    run_queue(queue, scenario)
+    assert applied == [f"payment-a:{i}" for i in range(5)]
+    assert queue.stats()["processed"] == 5
+
+
+def test_different_keys_run_concurrently(path):
+    queue = WebhookQueue(path, workers=2)
+    running, peak = [0], [0]
+
+    async def handler(body):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.05)
+        running[0] -= 1
+
+    queue.register("ipn", handler)
+
+    async def scenario():
+        queue.enqueue("ipn", "a", ordering_key="a")
+        queue.enqueue("ipn", "b", ordering_key="b")
+
+    run_queue(queue, scenario)
+    assert peak[0] == 2
+
+
+def test_failed_job_is_retried_until_it_succeeds(path):
+    queue = WebhookQueue(path, workers=1)
+    attempts = []
+
+    async def handler(body):
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise RuntimeError("database unavailable")
+
+    queue.register("ipn", handler)
+    run_queue(queue, lambda: asyncio.sleep(0, queue.enqueue("ipn", "{}", ordering_key="p")))
+
+    assert len(attempts) == 3
+    stats = queue.stats()
+    assert stats["retried"] == 2 and stats["processed"] == 1 and stats["dead_letters"] == 0
+
+
+def test_retry_waits_for_backoff(path, monkeypatch):
+    monkeypatch.setattr(queue_module, "WEBHOOK_RETRY_BASE_SECONDS", 0.2)
+    monkeypatch.setattr(queue_module, "WEBHOOK_RETRY_MAX_SECONDS", 0.2)
+    queue = WebhookQueue(path, workers=1)
+    attempts = []
+
+    async def handler(body):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RuntimeError("timeout")
+
+    queue.register("ipn", handler)
+    run_queue(queue, lambda: asyncio.sleep(0, queue.enqueue("ipn", "{}")))
+
+    # Half the delay plus jitter: at least 0.1s between attempts
+    assert attempts[1] - attempts[0] >= 0.1
+
+
+def test_job_is_dead_lettered_after_max_attempts(path):
+    queue = WebhookQueue(path, workers=1)
+    attempts = []
+
+    async def handler(body):
+        attempts.append(body)
+        raise RuntimeError("withdrawal not found")
+
+    queue.register("withdrawal", handler)
+    run_queue(queue, lambda: asyncio.sleep(0, queue.enqueue("withdrawal", "batch-1", ordering_key="batch-1")))
+
+    assert len(attempts) == queue_module.WEBHOOK_MAX_ATTEMPTS
+    [dead] = queue.dead_letters()
+    assert dead["kind"] == "withdrawal" and dead["ordering_key"] == "batch-1"
+    assert dead["attempts"] == queue_module.WEBHOOK_MAX_ATTEMPTS
+    assert "withdrawal not found" in dead["last_error"]
+    assert queue.stats()["dead_letters"] == 1
+
+
+def test_dead_letter_unblocks_later_jobs_of_its_key(path):
+    queue = WebhookQueue(path, workers=1)
+    applied = []
+
+    async def handler(body):
+        if body == "bad":
+            raise ValueError("malformed")
+        applied.append(body)
+
+    queue.register("ipn", handler)
+
+    async def scenario():
+        queue.enqueue("ipn", "bad", ordering_key="p")
+        queue.enqueue("ipn", "good", ordering_key="p")
+
+    run_queue(queue, scenario)
+    assert applied == ["good"]
+
+
+def test_pending_jobs_survive_a_restart(path):
+    WebhookQueue(path).enqueue("ipn", b'{"payment_id": 1}', ordering_key=1)
+
+    queue = WebhookQueue(path, workers=1)
+    applied = []
+
+    async def handler(body):
+        applied.append(body)
+
+    queue.register("ipn", handler)
+    run_queue(queue, lambda: asyncio.sleep(0))
+    assert applied == ['{"payment_id": 1}']
+
+
+def test_expired_lease_is_claimed_again(path, monkeypatch):
+    queue = WebhookQueue(path, workers=1)
+    queue.register("ipn", lambda body: None)
+    job_id = queue.enqueue("ipn", "{}")
+
+    # A worker leased the job and died
+    assert queue._claim()[0] == job_id
+    assert queue._claim() is None
+
+    later = time.time() + queue_module.WEBHOOK_LEASE_SECONDS + 1
+    monkeypatch.setattr(queue_module.time, "time", lambda: later)
+    assert queue._claim()[0] == job_id
+
+
+def test_unregistered_kinds_are_left_queued(path):
+    queue = WebhookQueue(path, workers=1)
+    queue.register("ipn", lambda body: None)
+    queue.enqueue("capitalist_deposit", "{}")
+    assert queue._claim() is None
+    assert queue.stats()["pending"] == 1